@@ -7,12 +7,31 @@
 ╚══════════════════════════════════════════════════════════════╝
 """
 
-import io
+import os
+import shutil
+import functools
+import itertools
+import tempfile
 import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 from datetime import datetime
+from vendoriq_core import (build_cube, chart_cost_breakdown, chart_discount_tax, chart_donut,
+    chart_hbar, chart_material_bar, chart_price_anomalies, chart_supplier_bar, chart_trend, chart_uom_bar, concat_frames,
+    dataset_key, DATASET_STORE_MAX_BYTES, DatasetRegistry, DatasetStore, DateIndex, DuckDBBackend,
+    excel_sheet_names, EXPORT_CACHE_MAX_BYTES, EXPORT_FORMATS, extend_cube, FIG_CACHE_MAX_BYTES,
+    file_digest, FilterEngine, fmt_inr, fmt_inr_array, _held_bytes, ingest_files, INR_FORMAT, item_rollup,
+    load_sample, LRUCache, make_template_csv, memory_report, MemoryBudgetError, METRICS_LOG, monthly_trend,
+    _nbytes_all, ordered_rows, PAGE_SIZES, PandasBackend, parquet_available, PARSE_CACHE_MAX_BYTES,
+    parse_file, PERF_RUNS_KEPT, PRICE_TOP_LINES, PRICE_Z, PriceIndex, public_cols, QueryFilters, safe_sort, ScatterGrid, SearchIndex, sort_order,
+    span, SpanRecorder, active_spans, sql_available, store_available, STORE_DIR, STREAM_MEM_BUDGET,
+    TABLE_SEARCH_COLS, vendor_summary,
+    VIEW_CACHE_MAX_BYTES, VS_MEASURES, write_excel_report, write_export)
 
 # ═══════════════════════════════════════════════════════════════
 #  PAGE CONFIG  — must be first Streamlit call
@@ -111,6 +130,25 @@ input::placeholder { color: #475569 !important; }
     border-bottom: 2px solid #38bdf8 !important;
 }
 
+/* view selector — a horizontal radio styled like the tab strip */
+.stRadio [role="radiogroup"] {
+    gap: 2px !important;
+    border-bottom: 1px solid rgba(56,189,248,0.1) !important;
+}
+.stRadio [role="radiogroup"] > label {
+    border-radius: 8px 8px 0 0 !important;
+    padding: 10px 20px !important;
+    margin: 0 !important;
+    transition: all 0.18s !important;
+}
+.stRadio [role="radiogroup"] > label > div:first-child { display: none !important; }
+.stRadio [role="radiogroup"] > label p { color: #64748b !important; font-weight: 500 !important; font-size: 13px !important; }
+.stRadio [role="radiogroup"] > label:has(input:checked) {
+    background: rgba(56,189,248,0.07) !important;
+    border-bottom: 2px solid #38bdf8 !important;
+}
+.stRadio [role="radiogroup"] > label:has(input:checked) p { color: #38bdf8 !important; }
+
 .stButton > button {
     background: rgba(255,255,255,0.05) !important;
     border: 1px solid rgba(56,189,248,0.3) !important;
@@ -278,288 +316,164 @@ input::placeholder { color: #475569 !important; }
 
 
 # ═══════════════════════════════════════════════════════════════
-#  CONSTANTS
-# ═══════════════════════════════════════════════════════════════
-COLS = [
-    "PO Dt","PO No","Supplier","Item","HSN No","Item Description",
-    "Indent Dt","Indent No","UOM","Quantity","Rate",
-    "Material","Excise","Discount","Tax","Freight","Others","Net",
-]
-NUMERIC_COLS = ["Quantity","Rate","Material","Excise","Discount","Tax","Freight","Others","Net"]
-PALETTE = ["#0ea5e9","#6366f1","#10b981","#f59e0b","#ec4899",
-           "#a78bfa","#38bdf8","#34d399","#fb923c","#f472b6"]
-_BG   = "#0d1528"
-_GRID = "rgba(56,189,248,0.07)"
-_TICK = "#475569"
-_LAYOUT = dict(
-    paper_bgcolor=_BG, plot_bgcolor=_BG,
-    font=dict(family="DM Sans", color=_TICK, size=11),
-    margin=dict(t=10, b=10, l=10, r=10),
-    legend=dict(bgcolor="rgba(0,0,0,0)", font=dict(size=10, color=_TICK)),
-)
-
-def _ax(grid=True, **kw):
-    """Axis config. Pass overrides (incl. tickfont) via **kw to avoid duplicate-key TypeError."""
-    base = dict(
-        showgrid=grid, gridcolor=_GRID, zeroline=False,
-        linecolor="rgba(56,189,248,0.08)",
-        tickfont=dict(size=10, color=_TICK),
-    )
-    base.update(kw)
-    return base
-
-
-# ═══════════════════════════════════════════════════════════════
-#  HELPERS
-# ═══════════════════════════════════════════════════════════════
-def fmt_inr(n) -> str:
-    try:
-        n = float(n)
-        if n != n: return "₹0"
-    except (TypeError, ValueError):
-        return "₹0"
-    if   n >= 1_00_00_000: return f"₹{n/1_00_00_000:.2f}Cr"
-    elif n >= 1_00_000:    return f"₹{n/1_00_000:.2f}L"
-    elif n >= 1_000:       return f"₹{n/1_000:.1f}K"
-    else:                  return f"₹{n:,.0f}"
-
-def fmt_inr_full(n) -> str:
-    try:    return f"₹{float(n):,.2f}"
-    except: return "₹0.00"
-
-def clean_df(df: pd.DataFrame) -> pd.DataFrame:
-    str_cols = ["PO Dt","PO No","Supplier","Item","HSN No","Item Description","Indent Dt","Indent No","UOM"]
-    for c in str_cols:
-        if c in df.columns:
-            df[c] = df[c].fillna("").astype(str).str.strip().replace({"nan":"","None":"","NaN":""})
-    for c in NUMERIC_COLS:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
-    return df
-
-def safe_sort(series: pd.Series) -> list:
-    return sorted(series.dropna().astype(str).replace("", pd.NA).dropna().unique().tolist())
-
-def make_template_csv() -> bytes:
-    header = ",".join(COLS) + "\n"
-    row = "01/04/2024,PO-00001,Vendor Name,ITM-001,72071190,Item Description,28/03/2024,IN-00001,NOS,10,5000,50000,0,500,8910,1500,250,60160\n"
-    return (header + row).encode()
-
-
-# ═══════════════════════════════════════════════════════════════
-#  SAMPLE DATA
+#  APP CACHES  — process-wide, shared by every session
 # ═══════════════════════════════════════════════════════════════
 @st.cache_data(show_spinner=False)
-def load_sample() -> pd.DataFrame:
-    import random
-    random.seed(42)
-    suppliers = ["Tata Steel Ltd","Reliance Industries","Mahindra Logistics",
-                 "Bosch India Pvt Ltd","Siemens Ltd","L&T Engineering",
-                 "BHEL Corporation","Wipro Infrastructure","HCL Manufacturing","Infosys Supply"]
-    items     = ["Cold Rolled Sheets","Hot Rolled Coils","Stainless Steel Pipes",
-                 "Aluminium Extrusions","Copper Cables","PVC Conduits",
-                 "MS Angles","GI Sheets","Carbon Steel Rods","Mild Steel Plates"]
-    hsns = ["7209","7208","7306","7601","8544","3917","7216","7210","7213","7211"]
-    uoms = ["MT","NOS","KG","MTR","SET","BOX","PCS","LTR","RLL","CTN"]
-    rows = []
-    for i in range(150):
-        si=random.randint(0,9); ii=random.randint(0,9)
-        qty=random.randint(10,500); rate=random.randint(200,6000)
-        mat=qty*rate; tax=round(mat*0.18,2); disc=round(mat*0.03,2)
-        frgt=random.randint(500,6000); oth=random.randint(100,1500)
-        net=round(mat+tax-disc+frgt+oth,2)
-        d=random.randint(1,28); m=random.randint(1,12); y=random.choice([2023,2024])
-        rows.append({
-            "PO Dt":f"{d:02d}/{m:02d}/{y}","PO No":f"PO-{2000+i:05d}",
-            "Supplier":suppliers[si],"Item":f"ITM-{1000+ii:04d}",
-            "HSN No":hsns[ii],"Item Description":items[ii],
-            "Indent Dt":f"{d:02d}/{m:02d}/{y}","Indent No":f"IN-{3000+i:05d}",
-            "UOM":uoms[random.randint(0,9)],
-            "Quantity":qty,"Rate":rate,"Material":mat,"Excise":0,
-            "Discount":disc,"Tax":tax,"Freight":frgt,"Others":oth,"Net":net,
-        })
-    return clean_df(pd.DataFrame(rows))
-
-
-# ═══════════════════════════════════════════════════════════════
-#  FILE PARSER
-# ═══════════════════════════════════════════════════════════════
-ALIASES = {
-    "PO Dt":           ["po_dt","po_date","po date","order_date","date","inv_date"],
-    "PO No":           ["po_no","po","po_number","purchase_order","order_no","voucher_no","po no"],
-    "Supplier":        ["supplier","vendor","vendor_name","company","party","firm"],
-    "Item":            ["item","item_code","item_no","item code","part_no","part","sku","material_code"],
-    "HSN No":          ["hsn_no","hsn","hsn_code","hsn no","sac","sac_code"],
-    "Item Description":["item_description","item description","description","material","goods","desc","product"],
-    "Indent Dt":       ["indent_dt","indent_date","indent date","req_date","requisition_date"],
-    "Indent No":       ["indent_no","indent","indent_number","indent no","req_no","requisition_no"],
-    "UOM":             ["uom","unit","unit_of_measure","unit of measure","units"],
-    "Quantity":        ["quantity","qty","count","nos"],
-    "Rate":            ["rate","unit_price","price","unit_rate","unit price"],
-    "Material":        ["material","material_value","basic","basic_amount","material value"],
-    "Excise":          ["excise","excise_duty","ced","bed"],
-    "Discount":        ["discount","disc","rebate"],
-    "Tax":             ["tax","gst","vat","igst","cgst","sgst","taxes"],
-    "Freight":         ["freight","shipping","transport","delivery"],
-    "Others":          ["others","other","miscellaneous","misc","charges"],
-    "Net":             ["net","net_amount","total","amount","net amount","line_total","net_value"],
-}
+def sample_data() -> pd.DataFrame:
+    return load_sample()
 
-def parse_file(f) -> pd.DataFrame:
-    name = f.name.lower()
+def parse_upload(f, **opts) -> pd.DataFrame:
+    """parse_file() with read errors reported in the UI; an empty frame when the file can't be read."""
     try:
-        df = pd.read_csv(f) if name.endswith((".csv",".txt")) else pd.read_excel(f)
+        return parse_file(f, **opts)
+    except MemoryBudgetError as e:
+        budget = opts.get("mem_budget", STREAM_MEM_BUDGET)
+        print(f"[VendorIQ] Stream budget exceeded: {e}")
+        st.error(f"❌ File too large for the {budget/1e9:.1f} GB ingest budget — {e}.")
     except Exception as e:
         print(f"[VendorIQ] File read error: {e}"); traceback.print_exc()
         st.error("❌ Cannot read file — see terminal for details.")
-        return pd.DataFrame()
-    df.columns = [str(c).strip() for c in df.columns]
-    lc = {c.lower().strip(): c for c in df.columns}
-    rmap = {}
-    for target, aliases in ALIASES.items():
-        for a in aliases:
-            if a in lc: rmap[lc[a]] = target; break
-    df = df.rename(columns=rmap)
-    for col in ["PO Dt","PO No","Supplier","Item","HSN No","Item Description","Indent Dt","Indent No","UOM"]:
-        if col not in df.columns: df[col] = ""
-    for col in NUMERIC_COLS:
-        if col not in df.columns: df[col] = 0.0
-    df = clean_df(df)
-    mask = df["Net"] == 0
-    if mask.any():
-        df.loc[mask,"Net"] = (df.loc[mask,"Material"]+df.loc[mask,"Excise"]
-                              -df.loc[mask,"Discount"]+df.loc[mask,"Tax"]
-                              +df.loc[mask,"Freight"]+df.loc[mask,"Others"])
-    extras = [c for c in df.columns if c not in COLS]
-    return df[[c for c in COLS+extras if c in df.columns]]
-
-
-# ═══════════════════════════════════════════════════════════════
-#  CHART BUILDERS
-# ═══════════════════════════════════════════════════════════════
-def chart_supplier_bar(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("Supplier")["Net"].sum().reset_index().sort_values("Net",ascending=False).head(8)
-    g["L"] = g["Supplier"].str[:22]
-    fig = go.Figure(go.Bar(
-        x=g["L"], y=g["Net"],
-        marker=dict(color=g["Net"],colorscale=[[0,"#0ea5e9"],[1,"#6366f1"]],line=dict(width=0)),
-        customdata=g["Supplier"],
-        hovertemplate="<b>%{customdata}</b><br>₹%{y:,.0f}<extra></extra>",
-    ))
-    fig.update_traces(marker_cornerradius=5)
-    fig.update_layout(**_LAYOUT, height=240, bargap=0.3,
-                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
-    return fig
-
-def chart_material_bar(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("Item Description")["Net"].sum().reset_index().sort_values("Net",ascending=False).head(8)
-    g["L"] = g["Item Description"].str[:24]
-    fig = go.Figure(go.Bar(
-        x=g["L"], y=g["Net"],
-        marker=dict(color=g["Net"],colorscale=[[0,"#10b981"],[1,"#0ea5e9"]],line=dict(width=0)),
-        customdata=g["Item Description"],
-        hovertemplate="<b>%{customdata}</b><br>₹%{y:,.0f}<extra></extra>",
-    ))
-    fig.update_traces(marker_cornerradius=5)
-    fig.update_layout(**_LAYOUT, height=240, bargap=0.3,
-                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
-    return fig
-
-def chart_trend(df: pd.DataFrame):
-    try:
-        d = df.copy()
-        d["_dt"] = pd.to_datetime(d["PO Dt"], dayfirst=True, errors="coerce")
-        d = d.dropna(subset=["_dt"])
-        if d.empty: return None
-        d["Month"] = d["_dt"].dt.to_period("M").astype(str)
-        g = d.groupby("Month")["Net"].sum().reset_index().sort_values("Month")
-        fig = go.Figure(go.Scatter(
-            x=g["Month"], y=g["Net"], mode="lines+markers",
-            line=dict(color="#0ea5e9",width=2.4),
-            marker=dict(size=6,color="#0ea5e9",line=dict(color=_BG,width=2)),
-            fill="tozeroy", fillcolor="rgba(14,165,233,0.08)",
-            hovertemplate="<b>%{x}</b><br>₹%{y:,.0f}<extra></extra>",
-        ))
-        fig.update_layout(**_LAYOUT, height=210, xaxis=_ax(False), yaxis=_ax(tickprefix="₹"))
-        return fig
-    except Exception:
-        print("[VendorIQ] chart_trend error"); traceback.print_exc(); return None
-
-def chart_cost_breakdown(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("Supplier")[["Material","Tax","Freight","Others"]].sum().reset_index()
-    g["_total"] = g[["Material","Tax","Freight","Others"]].sum(axis=1)
-    g = g.sort_values("_total",ascending=False).head(8)
-    fig = go.Figure()
-    for col,color,label in [("Material","#0ea5e9","Material"),("Tax","#f59e0b","Tax"),
-                             ("Freight","#10b981","Freight"),("Others","#a78bfa","Others")]:
-        fig.add_trace(go.Bar(name=label, x=g["Supplier"].str[:18], y=g[col], marker_color=color,
-                             hovertemplate=f"<b>%{{x}}</b><br>{label}: ₹%{{y:,.0f}}<extra></extra>"))
-    fig.update_layout(**_LAYOUT, height=300, barmode="stack", bargap=0.24,
-                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
-    return fig
+    return pd.DataFrame()
+
+@st.cache_resource(show_spinner=False)
+def parse_cache() -> LRUCache:
+    """Process-wide cache of parsed uploads, shared by every session."""
+    return LRUCache(PARSE_CACHE_MAX_BYTES, sizeof=_nbytes_all)
+
+def parse_cached(f, **opts) -> pd.DataFrame:
+    """parse_file() keyed on (content hash, file type, parser options).
+    A re-submitted identical file costs only the hash. Treat the result as read-only."""
+    key = (file_digest(f), f.name.lower().rsplit(".",1)[-1], tuple(sorted(opts.items())))
+    cache = parse_cache()
+    with span("parse", file=f.name, bytes=f.size) as s:
+        df = cache.get(key)
+        s.note(cached=df is not None)
+        if df is None:
+            df = parse_upload(f, **opts)
+            df.attrs["source"] = dataset_key(*key)     # content identity, for the dataset registry
+            df.attrs["file"]   = f.name
+            if not df.empty: cache.put(key, df)
+        s.note(rows_out=len(df))
+    return df
 
-def chart_donut(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("Supplier")["Net"].sum().reset_index().sort_values("Net",ascending=False).head(10)
-    fig = go.Figure(go.Pie(
-        labels=g["Supplier"], values=g["Net"], hole=0.55,
-        marker=dict(colors=PALETTE, line=dict(color=_BG, width=2)),
-        textposition="inside", textinfo="percent",
-        hovertemplate="<b>%{label}</b><br>₹%{value:,.0f}<br>%{percent}<extra></extra>",
-    ))
-    layout = {**_LAYOUT, "height":300}
-    layout["legend"] = dict(orientation="v", font=dict(size=10), x=1.01, y=0.5)
-    fig.update_layout(**layout)
+@st.cache_resource(show_spinner=False)
+def ingest_pool():
+    """Worker processes for multi-file uploads, started once per server — spawned, so the server's
+    threads are not forked. None on a single CPU, where ingest_files() parses in-process."""
+    n = os.cpu_count() or 1
+    return ProcessPoolExecutor(max_workers=n, mp_context=multiprocessing.get_context("spawn")) if n > 1 else None
+
+def ingest_cached(files) -> tuple:
+    """ingest_files() over several uploads (or archives) → (merged frame, ingest report), cached
+    like parse_cached() on every file's content hash, in upload order. Uploads are copied to a temp
+    dir block by block so the worker processes can stream them."""
+    key = ("ingest",) + tuple((file_digest(f), f.name) for f in files)
+    cache = parse_cache()
+    with span("parse", files=len(files), bytes=sum(f.size for f in files)) as s:
+        hit = cache.get(key)
+        s.note(cached=hit is not None)
+        if hit is None:
+            try:
+                with tempfile.TemporaryDirectory(prefix="vendoriq-") as tmp:
+                    paths = [os.path.join(tmp, f"{i:03d}-{os.path.basename(f.name)}") for i, f in enumerate(files)]
+                    for f, p in zip(files, paths):
+                        f.seek(0)
+                        with open(p, "wb") as out: shutil.copyfileobj(f, out, 1 << 20)
+                        f.seek(0)
+                    df, report = ingest_files(paths, [f.name for f in files], pool=ingest_pool())
+            except Exception as e:
+                print(f"[VendorIQ] Multi-file ingest failed: {e}"); traceback.print_exc()
+                st.error("❌ Cannot read files — see terminal for details.")
+                return pd.DataFrame(), None
+            df.attrs["source"] = dataset_key(*key)
+            df.attrs["file"]   = f"{len(files)} files"
+            hit = (df, report)
+            if not df.empty: cache.put(key, hit)
+        s.note(rows_out=len(hit[0]))
+    return hit
+
+@st.cache_resource(show_spinner=False)
+def export_cache() -> LRUCache:
+    """Process-wide cache of finished export files, shared by every session."""
+    return LRUCache(EXPORT_CACHE_MAX_BYTES)
+
+@st.cache_resource(show_spinner=False)
+def report_stats() -> dict:
+    """(export name, state) → stats of the last Excel report written for it."""
+    return {}
+
+def deferred_export(name: str, df: pd.DataFrame, fmt: str, state, rows=None, sheets=None):
+    """Zero-arg callable for st.download_button(data=...): the file is only written when the
+    button is clicked, then kept under (name, state, fmt) — state carries the dataset version
+    and filters, so a repeat download of the same view is a lookup. `sheets` is a zero-arg
+    callable giving the extra (name, frame) sheets of an Excel report, also only run on click.
+    With instrumentation on, each click is recorded as its own "export" run."""
+    perf = perf_settings()   # read now — build() runs outside the script
+    def build():
+        cache, key = export_cache(), (name, state, fmt)
+        with recording("export", perf), span(f"export {name} {fmt}", rows_in=len(df) if rows is None else len(rows)) as s:
+            data = cache.get(key)
+            s.note(cached=data is not None)
+            if data is None:
+                try:
+                    if fmt == "xlsx":
+                        data, report_stats()[(name, state)] = write_excel_report(df, rows, sheets() if sheets else ())
+                    else:
+                        data = write_export(df, fmt, rows)
+                    cache.put(key, data)
+                except Exception:
+                    print(f"[VendorIQ] {fmt} export of {name} failed:"); traceback.print_exc()
+                    raise
+            s.note(bytes=len(data))
+        return data
+    return build
+
+@st.cache_resource(show_spinner=False)
+def dataset_store() -> DatasetStore:
+    return DatasetStore(STORE_DIR)
+
+@st.cache_resource(show_spinner=False)
+def figure_cache() -> LRUCache:
+    """Process-wide cache of built figures, sized by their serialised JSON."""
+    return LRUCache(FIG_CACHE_MAX_BYTES, sizeof=lambda fig: len(fig.to_json()) if fig is not None else 0)
+
+_MISS = object()
+
+def cached_figure(fn, df, state):
+    """fn(df) cached on (state, fn). `state` must identify df completely — the dataset version
+    plus the normalised filter state — so an unchanged chart costs one lookup on rerun.
+    df may be a zero-arg callable (a backend query), then only run on a miss."""
+    cache, key = figure_cache(), (state, fn.__name__)
+    with span(fn.__name__) as s:
+        fig = cache.get(key, _MISS)
+        s.note(cached=fig is not _MISS)
+        if fig is _MISS: fig = cache.put(key, build_figure(fn, df, s))
     return fig
 
-def chart_hbar(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("Item Description")["Net"].sum().reset_index().sort_values("Net",ascending=True).tail(10)
-    g["L"] = g["Item Description"].str[:32]
-    fig = go.Figure(go.Bar(
-        y=g["L"], x=g["Net"], orientation="h",
-        marker=dict(color=g["Net"],colorscale=[[0,"#6366f1"],[1,"#0ea5e9"]],line=dict(width=0)),
-        customdata=g["Item Description"],
-        hovertemplate="<b>%{customdata}</b><br>₹%{x:,.0f}<extra></extra>",
-    ))
-    fig.update_traces(marker_cornerradius=4)
-    # ✅ FIX: tickfont passed INTO _ax() as kwarg — no duplicate key TypeError
-    fig.update_layout(**_LAYOUT, height=320, bargap=0.22,
-                      xaxis=_ax(tickprefix="₹"),
-                      yaxis=_ax(False, tickfont=dict(size=9, color=_TICK)))
+def build_figure(fn, df, s=None):
+    """fn(df), resolving a callable df first; rows in/out (data rows, plotted marks) go on span s."""
+    d = df() if callable(df) else df
+    fig = fn(d)
+    if s is not None:
+        s.note(rows_in=d.n if isinstance(d, ScatterGrid) else len(d), rows_out=_marks(fig) if fig is not None else 0)
     return fig
 
-def chart_discount_tax(df: pd.DataFrame) -> go.Figure:
-    fig = go.Figure(go.Scatter(
-        x=df["Discount"], y=df["Tax"], mode="markers",
-        marker=dict(color=df["Net"],colorscale="Blues",size=7,opacity=0.75,
-                    line=dict(color="#0ea5e9",width=0.5),showscale=True,
-                    colorbar=dict(title="Net ₹",tickprefix="₹",tickfont=dict(size=9,color=_TICK))),
-        text=df["Supplier"],
-        hovertemplate="<b>%{text}</b><br>Discount: ₹%{x:,.0f}<br>Tax: ₹%{y:,.0f}<extra></extra>",
-    ))
-    fig.update_layout(**_LAYOUT, height=300,
-                      xaxis=_ax(title="Discount (₹)", tickprefix="₹"),
-                      yaxis=_ax(title="Tax (₹)", tickprefix="₹"))
-    return fig
+def _marks(fig) -> int:
+    """Points/bars drawn: x values per trace (labels for a pie)."""
+    return sum(len(v) for t in fig.data if (v := t.labels if t.type == "pie" else t.x) is not None)
 
-def chart_uom_bar(df: pd.DataFrame) -> go.Figure:
-    g = df.groupby("UOM")["Net"].sum().reset_index().sort_values("Net",ascending=False)
-    fig = go.Figure(go.Bar(
-        x=g["UOM"], y=g["Net"],
-        marker=dict(color=g["Net"],colorscale=[[0,"#f59e0b"],[1,"#ef4444"]],line=dict(width=0)),
-        hovertemplate="<b>%{x}</b><br>₹%{y:,.0f}<extra></extra>",
-    ))
-    fig.update_traces(marker_cornerradius=5)
-    fig.update_layout(**_LAYOUT, height=300, bargap=0.3,
-                      xaxis=_ax(False), yaxis=_ax(tickprefix="₹"))
-    return fig
+def draw_chart(fig, key):
+    with span(f"draw {key}"):
+        st.plotly_chart(fig, use_container_width=True, config={"displayModeBar":False}, key=key)
 
-def _render(fn, df, key):
-    """Safe chart render — errors → terminal only, never crash the UI."""
+def _render(fn, df, key, state=None):
+    """Safe chart render — errors → terminal only, never crash the UI.
+    With a `state` the figure goes through the figure cache."""
     try:
-        fig = fn(df)
-        if fig is not None:
-            st.plotly_chart(fig, use_container_width=True,
-                            config={"displayModeBar":False}, key=key)
+        if state is None:
+            with span(fn.__name__) as s: fig = build_figure(fn, df, s)
+        else: fig = cached_figure(fn, df, state)
+        if fig is not None: draw_chart(fig, key)
     except Exception:
         print(f"[VendorIQ] Chart error key={key}"); traceback.print_exc()
 
@@ -567,13 +481,409 @@ def _render(fn, df, key):
 # ═══════════════════════════════════════════════════════════════
 #  SESSION STATE
 # ═══════════════════════════════════════════════════════════════
+@st.cache_resource(show_spinner=False)
+def _dataset_versions():
+    """Process-wide counter naming datasets that have no content key."""
+    return itertools.count(1)
+
+@st.cache_resource(show_spinner=False)
+def dataset_registry() -> DatasetRegistry:
+    return DatasetRegistry(DATASET_STORE_MAX_BYTES)
+
+def set_dataset(df: pd.DataFrame, key=None, date_index=None, appended_from=None) -> bool:
+    """Make df the session's canonical frame under dataset `key` (a content key; None for an
+    anonymous one). See use_dataset()."""
+    if df.empty: return use_dataset("empty", None)
+    def build():
+        d = df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)   # index == row position
+        return d, date_index if date_index is not None or "_po_dt" not in d.columns else DateIndex(d["_po_dt"])
+    return use_dataset(key or f"anon-{next(_dataset_versions())}", build, appended_from)
+
+def use_dataset(key, build, appended_from=None) -> bool:
+    """Point the session at dataset `key` in the shared registry; build() → (df, date_index) only
+    runs when no session holds that key yet. The key doubles as the dataset version, so caches
+    keyed on it are shared by every session on the same data. `appended_from` is the row where an
+    append began (None for a full load), so those caches can tell an append from a replacement
+    via df_lineage. False (with an error shown) when the shared store is full."""
+    prev = st.session_state.get("df_version")
+    try:
+        ref = None if build is None else dataset_registry().acquire(key, build)
+    except MemoryBudgetError as e:
+        st.error(f"❌ Shared dataset memory is full ({DATASET_STORE_MAX_BYTES/1e9:.1f} GB) — {e}."); return False
+    st.session_state.dataset_ref = ref
+    st.session_state.df          = pd.DataFrame() if ref is None else ref.df
+    st.session_state.df_version  = key
+    st.session_state.df_lineage  = (prev, appended_from) if appended_from is not None else None
+    st.session_state.date_index  = None if ref is None else ref.date_index
+    return True
+
+def session_memory() -> dict:
+    """Bytes this session holds privately, by structure (the dataset itself is shared)."""
+    ss = st.session_state
+    return {"Search index": _held_bytes(ss.get("search_index")), "Spend cube": _held_bytes(ss.get("spend_cube")),
+            "Price index": _held_bytes(ss.get("price_index")), "Filter masks": _held_bytes(ss.get("filter_engine")),
+            "View cache": _held_bytes(ss.get("view_cache"))}
+
+def search_index() -> SearchIndex:
+    """The session dataset's SearchIndex — built on first search per df_version, or extended
+    with just the new rows when that version came from an append to the indexed one."""
+    si, ver, lin = st.session_state.get("search_index"), st.session_state.df_version, st.session_state.df_lineage
+    if si is None or si.version != ver:
+        df = st.session_state.df
+        with st.spinner("Indexing for search…"), span("search index", rows_in=len(df)):
+            if si is not None and lin and lin[0] == si.version and si.n == lin[1]: si.extend(df.iloc[lin[1]:])
+            else: si = SearchIndex(df)
+        si.version = ver; st.session_state.search_index = si
+    return si
+
+def spend_cube() -> pd.DataFrame:
+    """The session dataset's spend cube — built once per df_version, or extended with just
+    the new rows when that version came from an append to the cubed one."""
+    ver, lin = st.session_state.df_version, st.session_state.df_lineage
+    cached = st.session_state.get("spend_cube")
+    if cached is None or cached[0] != ver:
+        df = st.session_state.df
+        with span("spend cube", rows_in=len(df)) as s:
+            if cached is not None and lin and lin[0] == cached[0]: cube = extend_cube(cached[1], df.iloc[lin[1]:])
+            else: cube = build_cube(df)
+            s.note(rows_out=len(cube))
+        st.session_state.spend_cube = cached = (ver, cube)
+    return cached[1]
+
+def price_index() -> PriceIndex:
+    """The session dataset's PriceIndex — built on first use per df_version, or extended with
+    just the new rows (and their item groups recomputed) when that version came from an append."""
+    pi, ver, lin = st.session_state.get("price_index"), st.session_state.df_version, st.session_state.df_lineage
+    if pi is None or pi.version != ver:
+        df = st.session_state.df
+        with st.spinner("Computing item price statistics…"), span("price index", rows_in=len(df)) as s:
+            if pi is not None and lin and lin[0] == pi.version and pi.n == lin[1]: pi.extend(df.iloc[lin[1]:])
+            else: pi = PriceIndex(df)
+            s.note(rows_out=len(pi.keys))
+        pi.version = ver; st.session_state.price_index = pi
+    return pi
+
+def filter_engine() -> FilterEngine:
+    if "filter_engine" not in st.session_state: st.session_state.filter_engine = FilterEngine()
+    return st.session_state.filter_engine
+
+def row_positions(preds):
+    """Positions of the session dataset passing `preds`, via the session FilterEngine (None = all)."""
+    return filter_engine().rows(st.session_state.df_version, preds)
+
+def pandas_backend() -> PandasBackend:
+    """In-memory backend over the session dataset, sharing the session's search index, spend cube
+    and predicate masks."""
+    ss = st.session_state
+    return PandasBackend(ss.df, ss.df_version, ss.date_index, search_index, spend_cube, filter_engine())
+
+def query_backend():
+    """The backend KPIs, charts and the vendor summary are computed with — the session's choice
+    of engine ("engine"). The SQL engine scans the saved dataset's files when the session data is
+    exactly that saved dataset, else the in-memory frame; it is kept per dataset version."""
+    ss = st.session_state
+    if ss.get("engine") != "duckdb" or not sql_available() or ss.df.empty: return pandas_backend()
+    link = ss.get("stored_as")
+    on_disk = bool(link and link[1] == ss.df_version)
+    cached = ss.get("sql_backend")
+    if cached is None or cached[0] != (ss.df_version, on_disk):
+        src = dataset_store().files(link[0]) if on_disk else ss.df
+        try:
+            backend = DuckDBBackend(src)
+        except Exception as e:
+            print(f"[VendorIQ] SQL engine unavailable: {e}"); traceback.print_exc()
+            st.error("❌ SQL engine failed to start — using pandas; see terminal for details."); return pandas_backend()
+        ss.sql_backend = cached = ((ss.df_version, on_disk), backend)
+    return cached[1]
+
+def cached_view(name, state, build):
+    """Session cache of a view's computed results (vendor summary, formatted tables), keyed
+    like figures, so switching back to a view is a lookup."""
+    if "view_cache" not in st.session_state: st.session_state.view_cache = LRUCache(VIEW_CACHE_MAX_BYTES, sizeof=_nbytes_all)
+    cache, key = st.session_state.view_cache, (state, name)
+    out = cache.get(key, _MISS)
+    if out is _MISS: out = cache.put(key, build())
+    return out
+
+def sorted_rows(preds, state, col: str, ascending: bool) -> np.ndarray:
+    """Positions passing `preds` in col order. The full-dataset order is sorted once per
+    df_version; each filter state (identified by `state`) only masks it."""
+    base, ver = st.session_state.df, st.session_state.df_version
+    with span(f"sort {col}", rows_in=len(base)) as s:
+        order = cached_view(("order", col, ascending), ver, lambda: sort_order(base, col, ascending))
+        rows = cached_view(("rows", col, ascending), state, lambda: ordered_rows(order, row_positions(preds), len(base)))
+        s.note(rows_out=len(rows))
+    return rows
+
+def append_dataset(batch: pd.DataFrame) -> bool:
+    """Append rows already cleaned by parse_file(). Only the batch is cleaned/sorted; dtypes and
+    categories are reconciled with the existing frame and the date index is merged, not rebuilt.
+    The result is keyed by (current dataset, batch), so sessions appending the same file to the
+    same data share it too, and only the first one pays for the concat."""
+    base, src = st.session_state.df, batch.attrs.get("source")
+    if base.empty: return set_dataset(batch, src)
+    def merged():
+        idx = st.session_state.date_index
+        idx = idx.extend(batch["_po_dt"]) if idx is not None and "_po_dt" in batch.columns else None
+        return concat_frames([base, batch]), idx
+    key = dataset_key(st.session_state.df_version, src) if src else f"anon-{next(_dataset_versions())}"
+    return use_dataset(key, merged, appended_from=len(base))
+
+def open_stored(name: str) -> bool:
+    """Open saved dataset `name` from the DatasetStore. Only the first session to open a given
+    version reads the partitions; later ones share it through the registry."""
+    store = dataset_store(); meta = store.meta(name)
+    if meta is None: st.error(f"❌ Saved dataset '{name}' no longer exists."); return False
+    key = dataset_key("store", meta["name"], meta["created"], len(meta["partitions"]))
+    def build():
+        df = store.load(name)
+        return df, DateIndex(df["_po_dt"]) if "_po_dt" in df.columns else None
+    try:
+        if not use_dataset(key, build): return False
+    except Exception as e:
+        print(f"[VendorIQ] Opening saved dataset {name} failed: {e}"); traceback.print_exc()
+        st.error("❌ Cannot open saved dataset — see terminal for details."); return False
+    st.session_state.stored_as = (meta["name"], key)
+    return True
+
+def save_dataset(name: str):
+    """Write the session dataset to the store as `name`; its meta, or None (error shown)."""
+    try:
+        meta = dataset_store().save(name, st.session_state.df)
+    except Exception as e:
+        print(f"[VendorIQ] Saving dataset {name} failed: {e}"); traceback.print_exc()
+        st.error("❌ Cannot save dataset — see terminal for details."); return None
+    st.session_state.stored_as = (meta["name"], st.session_state.df_version)
+    return meta
+
+def persist_append(batch: pd.DataFrame):
+    """After append_dataset(): when the data appended to was opened from or saved to the store,
+    write the batch there too — its month partitions only. The saved dataset's meta, or None."""
+    link, lin = st.session_state.get("stored_as"), st.session_state.df_lineage
+    if not link or not lin or lin[0] != link[1]: return None
+    try:
+        meta = dataset_store().append(link[0], batch)
+    except Exception as e:
+        print(f"[VendorIQ] Appending to saved dataset {link[0]} failed: {e}"); traceback.print_exc()
+        st.error(f"❌ Rows added to this session but not saved to '{link[0]}' — see terminal for details."); return None
+    st.session_state.stored_as = (link[0], st.session_state.df_version)
+    return meta
+
 if "df" not in st.session_state:
-    st.session_state.df = pd.DataFrame()
+    set_dataset(pd.DataFrame())
+
+
+# ═══════════════════════════════════════════════════════════════
+#  PERFORMANCE SPANS  — opt-in; span() is a no-op while off
+# ═══════════════════════════════════════════════════════════════
+def perf_settings():
+    """(SpanRecorder kwargs, the session's log of finished runs) while instrumentation is on —
+    the performance panel is open or METRICS_LOG is set — else None."""
+    ss = st.session_state
+    if not (ss.get("show_perf") or METRICS_LOG): return None
+    if "perf_runs" not in ss: ss.perf_runs, ss.perf_session = deque(maxlen=PERF_RUNS_KEPT), os.urandom(4).hex()
+    return dict(memory=bool(ss.get("show_perf") and ss.get("perf_mem")), session=ss.perf_session), ss.perf_runs
+
+def finish_run(rec: SpanRecorder, runs: deque):
+    """Stop `rec`, keep it in the session's run log and append its spans to METRICS_LOG."""
+    rec.stop(); runs.appendleft(rec)
+    if METRICS_LOG:
+        try: rec.write(METRICS_LOG)
+        except OSError as e: print(f"[VendorIQ] Cannot write metrics to {METRICS_LOG}: {e}")
+
+@contextmanager
+def recording(run: str, perf):
+    """Record the block as its own run, with settings `perf` from perf_settings() (None = off)."""
+    if perf is None: yield None; return
+    rec = SpanRecorder(run, **perf[0]).start()
+    try:     yield rec
+    finally: finish_run(rec, perf[1])
+
+@st.fragment
+def perf_panel(runs: deque):
+    """Latency of the session's recent runs — full reruns, fragment reruns, exports — and the spans
+    of a chosen one. A fragment itself, so picking a run or refreshing leaves the page alone."""
+    runs = list(runs)
+    full = [r.seconds for r in runs if r.run == "rerun"]
+    part = [r.seconds for r in runs if r.run.startswith("fragment")]
+    st.markdown('<p style="color:#475569;font-size:10px;padding:0 2px">'
+                + (f'Full rerun · <b>{full[0]*1e3:,.0f} ms</b>' if full else "")
+                + (f' · fragment reruns · <b>{np.median(part)*1e3:,.0f} ms</b> median of {len(part)}' if part else "")
+                + (f' · peak RSS {runs[0].spans[-1]["rss_mb"]:,.0f} MB' if runs[0].spans and runs[0].spans[-1]["rss_mb"] else "")
+                + (f' · metrics → {METRICS_LOG}' if METRICS_LOG else "") + '</p>', unsafe_allow_html=True)
+    st.dataframe(pd.DataFrame({"At":[r.started.strftime("%H:%M:%S") for r in runs], "Run":[r.run for r in runs],
+                               "ms":[r.seconds*1e3 for r in runs], "Spans":[len(r.spans) for r in runs]}),
+                 use_container_width=True, hide_index=True, height=min(42+len(runs)*36, 220),
+                 column_config={"ms":st.column_config.NumberColumn("ms",format="%.1f")})
+    pick = st.selectbox("Spans of", range(len(runs)), label_visibility="collapsed",
+                        format_func=lambda i: f"{runs[i].run} · {runs[i].started:%H:%M:%S} · {runs[i].seconds*1e3:,.0f} ms")
+    st.dataframe(runs[pick].table(), use_container_width=True, hide_index=True,
+                 column_config={"span":st.column_config.TextColumn("Span",width=150),
+                                "ms":st.column_config.NumberColumn("ms",format="%.1f"), "at_ms":None, "rss_mb":None})
+    st.button("↻ Refresh", key="perf_refresh", help="Show runs recorded since — e.g. fragment reruns")
+
+_perf = perf_settings()
+# a recorder still active here belongs to the last run on this thread, cut short by st.rerun()
+# (flash()) or an error: its spans have unwound by now, so it is saved like any finished run
+_left = active_spans()
+if _left is not None:
+    if _perf and _left.seconds is None: _left.tags["cut_short"] = True; finish_run(_left, _perf[1])
+    else: _left.stop()
+_run  = SpanRecorder("rerun", **_perf[0]).start() if _perf else None
+
+def end_rerun():
+    """Close this rerun's recording and fill the sidebar panel (call before st.stop())."""
+    if _run is None: return
+    finish_run(_run, _perf[1])
+    if perf_box is not None:
+        with perf_box: perf_panel(_perf[1])
+
+
+# ═══════════════════════════════════════════════════════════════
+#  FRAGMENTS  — widget interactions rerun only their own part of the page
+# ═══════════════════════════════════════════════════════════════
+def fragment(fn):
+    """st.fragment whose own reruns are recorded as "fragment <name>" runs while instrumentation
+    is on; during a full rerun it is one span of that rerun. Fragment arguments are the ones of
+    the last full rerun, so anything that changes them (filters, dataset) needs a full rerun."""
+    @functools.wraps(fn)
+    def body(*args, **kw):
+        if active_spans() is not None:
+            with span(f"fragment {fn.__name__}"): return fn(*args, **kw)
+        with recording(f"fragment {fn.__name__}", perf_settings()): return fn(*args, **kw)
+    return st.fragment(body)
+
+def flash(msg: str):
+    """Show `msg` after a full rerun — for fragment actions that change the dataset. The run cut
+    short here is recorded when the next one starts."""
+    st.session_state.flash = msg; st.rerun()
+
+
+# ═══════════════════════════════════════════════════════════════
+#  PAGED TABLES
+# ═══════════════════════════════════════════════════════════════
+def _turn_page(key: str, step: int):
+    st.session_state[key] += step
+
+def paged_table(key: str, rows: np.ndarray, state, column_config: dict, max_height: int = 560):
+    """Grid over the session dataset's `rows` (already filtered and ordered) that takes and
+    serialises one page only. The page resets to 1 when `state` changes (new filters/sort)."""
+    base, n = st.session_state.df, len(rows)
+    pk, sk = f"{key}_page", f"{key}_size"
+    size  = st.session_state.get(sk, PAGE_SIZES[1])
+    pages = max(1, -(-n // size))
+    if st.session_state.get(f"{key}_state") != state or pk not in st.session_state:
+        st.session_state[pk], st.session_state[f"{key}_state"] = 1, state
+    elif st.session_state[pk] > pages: st.session_state[pk] = pages
+    page = st.session_state[pk]
+    lo, hi = (page-1)*size, min(page*size, n)
+    with span(f"table {key}", rows_in=n, rows_out=hi-lo):
+        view = base.take(rows[lo:hi])
+        st.dataframe(view, use_container_width=True, height=min(42+len(view)*36, max_height), hide_index=True,
+                     column_order=public_cols(view), column_config=column_config)
+    p1,p2,p3,p4,p5 = st.columns([1,1.1,1,1.3,4])
+    with p1: st.button("◀ Prev", key=f"{key}_prev", disabled=page <= 1, on_click=_turn_page, args=(pk,-1), use_container_width=True)
+    with p2: st.number_input("Page", min_value=1, max_value=pages, step=1, key=pk, label_visibility="collapsed")
+    with p3: st.button("Next ▶", key=f"{key}_next", disabled=page >= pages, on_click=_turn_page, args=(pk,1), use_container_width=True)
+    with p4: st.selectbox("Rows per page", PAGE_SIZES, index=1, key=sk, label_visibility="collapsed", format_func=lambda v: f"{v} / page")
+    with p5: st.markdown(f'<div class="tbl-info">Rows <strong>{min(lo+1,n):,}–{hi:,}</strong> of <strong>{n:,}</strong> · page {page:,} of {pages:,}</div>', unsafe_allow_html=True)
 
 
 # ═══════════════════════════════════════════════════════════════
 #  SIDEBAR
 # ═══════════════════════════════════════════════════════════════
+@fragment
+def import_panel():
+    """Uploads, their parse and ingest report. Uploading or picking sheets reruns only this;
+    Append / Replace change the dataset and rerun the page."""
+    uploads = st.file_uploader("Upload files", type=["csv","xlsx","xls","txt","zip","gz"], accept_multiple_files=True,
+                               label_visibility="collapsed", help="One file, several at once, or .zip / .gz archives of them")
+    if uploads:
+        report = None
+        if len(uploads) == 1 and not uploads[0].name.lower().endswith((".zip",".gz")):
+            uploaded, opts = uploads[0], {}
+            if not uploaded.name.lower().endswith((".csv",".txt")):
+                names = excel_sheet_names(uploaded)
+                if len(names) > 1:
+                    opts["sheets"] = tuple(st.multiselect("📑 Sheets", names, default=names[:1], key="f_sheets") or names[:1])
+            with st.spinner("Parsing file…"):
+                parsed = parse_cached(uploaded, **opts)
+        else:
+            with st.spinner(f"Parsing {len(uploads)} upload(s)…"):
+                parsed, report = ingest_cached(uploads)
+        pc = parse_cache().stats()
+        st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">Parse cache · {pc["hits"]} hits / {pc["misses"]} misses · {pc["entries"]} files · {pc["bytes"]/1e6:,.0f} MB</p>', unsafe_allow_html=True)
+        for t in parsed.attrs.get("sheets", []):
+            st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">📑 {t["sheet"]} · {t["rows"]:,} rows · {t["seconds"]:.2f}s</p>', unsafe_allow_html=True)
+        if report is not None:
+            bad = int((report["Error"] != "").sum())
+            st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">📚 {len(report)-bad} of {len(report)} files · {len(parsed):,} rows · {report["Seconds"].sum():.2f}s parsing</p>', unsafe_allow_html=True)
+            if bad: st.error(f"❌ {bad} file(s) could not be read — see the ingest report.")
+            with st.expander("Ingest report", expanded=bool(bad)):
+                st.dataframe(report, use_container_width=True, hide_index=True,
+                             column_config={"File":st.column_config.TextColumn("File",width=140),
+                                            "Seconds":st.column_config.NumberColumn("s",format="%.2f")})
+        if not parsed.empty:
+            c1,c2 = st.columns(2)
+            with c1:
+                if st.button("➕ Append", use_container_width=True) and append_dataset(parsed):
+                    saved = persist_append(parsed)
+                    flash(f"✅ {len(parsed):,} rows added" + (f" · saved to {saved['name']}" if saved else ""))
+            with c2:
+                if st.button("🔄 Replace", use_container_width=True) and set_dataset(parsed, parsed.attrs.get("source")):
+                    flash(f"✅ {len(parsed):,} rows loaded")
+
+
+@fragment
+def saved_datasets():
+    """Saved-dataset list, Save and Delete rerun only this; Open reruns the page."""
+    store = dataset_store()
+    saved = {m["name"]: m for m in store.list()}
+    if saved:
+        pick = st.selectbox("Saved dataset", list(saved), key="store_pick", label_visibility="collapsed",
+                            format_func=lambda n: f'{n} · {saved[n]["rows"]:,} rows · {len({p["month"] for p in saved[n]["partitions"]})} months')
+        s1,s2 = st.columns(2)
+        with s1:
+            if st.button("📂 Open", use_container_width=True) and open_stored(pick):
+                flash(f"✅ {saved[pick]['rows']:,} rows opened")
+        with s2:
+            if st.button("✖ Delete", use_container_width=True):
+                store.delete(pick)
+                if (st.session_state.get("stored_as") or ("",))[0] == pick: st.session_state.stored_as = None
+                st.rerun(scope="fragment")
+    if not st.session_state.df.empty:
+        name = st.text_input("Save as", placeholder="Dataset name…", key="store_name", label_visibility="collapsed")
+        if st.button("💾 Save Dataset", use_container_width=True, disabled=not name.strip()) and (meta := save_dataset(name)):
+            st.success(f"✅ Saved {meta['rows']:,} rows as {meta['name']}")
+        link = st.session_state.get("stored_as")
+        if link and link[1] == st.session_state.df_version:
+            st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">🗄️ {link[0]} · appends are saved to it as new month partitions</p>', unsafe_allow_html=True)
+    elif not saved:
+        st.markdown('<p style="color:#475569;font-size:12px;padding:4px 2px">Import data to save it here</p>', unsafe_allow_html=True)
+
+
+@fragment
+def memory_panel(df_all: pd.DataFrame):
+    """Memory report behind its toggle — opening it reruns only this."""
+    if st.toggle("💾 Memory usage", key="show_mem"):
+        rep = memory_report(df_all)
+        st.markdown(f'<p style="color:#475569;font-size:11px;padding:0 2px">{rep["Bytes"].sum()/1e6:,.1f} MB held · <b>{rep["Saved"].sum()/1e6:,.1f} MB</b> saved by compact storage</p>', unsafe_allow_html=True)
+        st.dataframe(rep[["Column","Dtype","Bytes","Saved"]], use_container_width=True, hide_index=True,
+                     column_config={"Bytes":st.column_config.NumberColumn("Bytes",format="%d"),
+                                    "Saved":st.column_config.NumberColumn("Saved",format="%d")})
+        reg, mine = dataset_registry(), session_memory()
+        st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">This session · {rep["Bytes"].sum()/1e6:,.1f} MB dataset (shared) + {sum(mine.values())/1e6:,.1f} MB private ('
+                    + ", ".join(f"{k.lower()} {v/1e6:,.1f}" for k,v in mine.items() if v) + ')</p>', unsafe_allow_html=True)
+        st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">Shared datasets · {reg.bytes/1e6:,.1f} of {reg.max_bytes/1e6:,.0f} MB · {reg.evictions} evicted</p>', unsafe_allow_html=True)
+        st.dataframe(reg.report(), use_container_width=True, hide_index=True,
+                     column_config={"Dataset":st.column_config.TextColumn("Dataset",width=90),
+                                    "Bytes":st.column_config.NumberColumn("Bytes",format="%d")})
+        caches = [("Parse cache", parse_cache()), ("Figure cache", figure_cache()), ("Export cache", export_cache())]
+        if "view_cache" in st.session_state: caches.append(("View cache", st.session_state.view_cache))
+        for label, c in caches:
+            cs = c.stats()
+            st.markdown(f'<p style="color:#475569;font-size:10px;padding:0 2px">{label} · {cs["hit_rate"]:.0%} hit rate ({cs["hits"]}/{cs["hits"]+cs["misses"]}) · {cs["entries"]} items · {cs["bytes"]/1e6:,.1f} of {cs["max_bytes"]/1e6:,.0f} MB</p>', unsafe_allow_html=True)
+
 with st.sidebar:
     st.markdown("""
     <div class="sb-brand">
@@ -582,49 +892,56 @@ with st.sidebar:
     </div>""", unsafe_allow_html=True)
 
     st.markdown('<div class="sb-section">📥 Import Data</div>', unsafe_allow_html=True)
-    uploaded = st.file_uploader("Upload file", type=["csv","xlsx","xls","txt"], label_visibility="collapsed")
-    if uploaded:
-        parsed = parse_file(uploaded)
-        if not parsed.empty:
-            c1,c2 = st.columns(2)
-            with c1:
-                if st.button("➕ Append", use_container_width=True):
-                    st.session_state.df = clean_df(pd.concat([st.session_state.df, parsed], ignore_index=True))
-                    st.success(f"✅ {len(parsed):,} rows added")
-            with c2:
-                if st.button("🔄 Replace", use_container_width=True):
-                    st.session_state.df = clean_df(parsed)
-                    st.success(f"✅ {len(parsed):,} rows loaded")
+    if (msg := st.session_state.pop("flash", None)): st.success(msg)
+    import_panel()
 
     qa1,qa2 = st.columns(2)
     with qa1:
-        if st.button("🎲 Sample Data", use_container_width=True):
-            st.session_state.df = load_sample()
+        if st.button("🎲 Sample Data", use_container_width=True) and set_dataset(sample_data(), "sample"):
             st.success("✅ 150 rows loaded")
     with qa2:
         st.download_button("📄 Template", data=make_template_csv(),
                            file_name="vendor_template.csv", mime="text/csv", use_container_width=True)
 
+    if store_available():
+        st.markdown("---")
+        st.markdown('<div class="sb-section">🗄️ Saved Datasets</div>', unsafe_allow_html=True)
+        saved_datasets()
+
     st.markdown("---")
     st.markdown('<div class="sb-section">🔽 Filters</div>', unsafe_allow_html=True)
 
     df_all = st.session_state.df
     if df_all.empty:
         st.markdown('<p style="color:#475569;font-size:12px;padding:4px 2px">Import data to enable filters</p>', unsafe_allow_html=True)
-        f_sup=[]; f_item=""; f_min=0.0; f_max=0.0
+        f_sup=[]; f_item=""; f_net=None; f_dates=None
     else:
+        f_dates = None
+        d_idx = st.session_state.date_index
+        if d_idx is not None and len(d_idx) and d_idx.min < d_idx.max:
+            rng = st.date_input("📅 PO Date", value=(d_idx.min, d_idx.max), min_value=d_idx.min,
+                                max_value=d_idx.max, format="DD/MM/YYYY", key="f_dates")
+            if len(rng) == 2 and tuple(rng) != (d_idx.min, d_idx.max): f_dates = tuple(rng)
         f_sup  = st.multiselect("🏢 Supplier", safe_sort(df_all["Supplier"]), default=[])
         f_item = st.text_input("📦 Item Description", placeholder="Search item description…", key="f_item_search")
         mn=float(df_all["Net"].min()); mx=float(df_all["Net"].max())
+        f_net = None
         if mn < mx:
             f_min,f_max = st.slider("💰 Net Amount (₹)", min_value=mn, max_value=mx, value=(mn,mx), format="₹%.0f")
-        else:
-            f_min,f_max = mn,mx
+            if (f_min,f_max) != (mn,mx): f_net = (f_min,f_max)
 
     st.markdown("---")
     if not df_all.empty:
         if st.button("🗑️ Clear All Data", use_container_width=True):
-            st.session_state.df = pd.DataFrame(); st.rerun()
+            set_dataset(pd.DataFrame()); st.rerun()
+        if sql_available():
+            st.selectbox("⚙️ Query engine", ["pandas","duckdb"], key="engine",
+                         format_func={"pandas":"⚙️ pandas · in memory","duckdb":"⚙️ DuckDB · SQL, out of core"}.get)
+        memory_panel(df_all)
+    perf_box = None
+    if st.toggle("⏱️ Performance", key="show_perf", help="Time each phase of every rerun and export"):
+        st.checkbox("Trace peak memory (slower)", key="perf_mem")
+        perf_box = st.container()   # filled by end_rerun() once the page has run
 
     st.markdown('<p style="font-size:9px;color:#1e293b;text-align:center;margin-top:14px">© 2024 VendorIQ · All rights reserved</p>', unsafe_allow_html=True)
 
@@ -659,7 +976,7 @@ with sc2:
     if st.session_state.df.empty:
         st.button("📤 Export", disabled=True, use_container_width=True)
     else:
-        st.download_button("📤 Export", data=st.session_state.df.to_csv(index=False).encode(),
+        st.download_button("📤 Export", data=deferred_export("dataset", st.session_state.df, "csv", st.session_state.df_version),
                            file_name=f"vendor_{datetime.today():%Y%m%d}.csv",
                            mime="text/csv", use_container_width=True, key="dl_global")
 with sc3:
@@ -669,25 +986,21 @@ with sc3:
 # ═══════════════════════════════════════════════════════════════
 #  BUILD FILTERED DATAFRAME
 # ═══════════════════════════════════════════════════════════════
-df = st.session_state.df.copy()
-if not df.empty:
-    if g_search.strip():
-        q = g_search.strip().lower()
-        mask = pd.Series(False, index=df.index)
-        for col in ["Supplier","Item Description","PO No","Item","HSN No","Indent No"]:
-            if col in df.columns:
-                mask |= df[col].astype(str).str.lower().str.contains(q, na=False)
-        df = df[mask]
-    if f_sup:   df = df[df["Supplier"].isin(f_sup)]
-    if f_item.strip():
-        df = df[df["Item Description"].astype(str).str.lower().str.contains(f_item.strip().lower(), na=False)]
-    if f_min != f_max: df = df[(df["Net"]>=f_min)&(df["Net"]<=f_max)]
+base = st.session_state.df
+flt = QueryFilters(f_dates, g_search.strip().lower(), tuple(sorted(f_sup)), f_item.strip().lower(), f_net)
+with span("filter", rows_in=len(base)) as _s:
+    q = query_backend()                  # KPIs, aggregate charts, vendor summary
+    g_preds = pandas_backend().preds(flt)   # the tables and exports page the in-memory frame
+    g_rows = row_positions(g_preds)      # positions in base (None = all); rows are only taken where a frame is needed
+    n_rows = len(base) if g_rows is None else len(g_rows)
+    _s.note(rows_out=n_rows)
+fstate = (st.session_state.df_version, flt)   # identifies g_rows and every aggregate of them
 
 
 # ═══════════════════════════════════════════════════════════════
 #  EMPTY STATE
 # ═══════════════════════════════════════════════════════════════
-if df.empty:
+if n_rows == 0:
     st.markdown("""
     <div class="empty-wrap">
       <span class="empty-icon">🏭</span>
@@ -697,264 +1010,321 @@ if df.empty:
         or upload your own CSV / Excel file.
       </div>
     </div>""", unsafe_allow_html=True)
-    st.stop()
+    end_rerun(); st.stop()
 
 
 # ═══════════════════════════════════════════════════════════════
 #  KPI CARDS
 # ═══════════════════════════════════════════════════════════════
-total_net=df["Net"].sum(); total_material=df["Material"].sum()
-total_tax=df["Tax"].sum(); total_discount=df["Discount"].sum()
-uniq_vendors=df["Supplier"].nunique()
+@fragment
+def kpi_strip(q, flt, fstate, n: int):
+    """The five KPI cards. No widgets: only full reruns (filter or data changes) redraw them."""
+    with span("kpis", rows_in=n):
+        kpi = cached_view("kpis", fstate, lambda: q.totals(flt))
+    total_net=kpi["Net"]; total_material=kpi["Material"]
+    total_tax=kpi["Tax"]; total_discount=kpi["Discount"]
+    uniq_vendors=kpi["Suppliers"]
+
+    st.markdown(f"""
+    <div class="kpi-row">
+      <div class="kpi-card kpi-c1">
+        <div class="kpi-top"><div class="kpi-label">Total Net Value</div><div class="kpi-icon kpi-i1">💰</div></div>
+        <div class="kpi-value">{fmt_inr(total_net)}</div><div class="kpi-sub">Total procurement spend</div>
+      </div>
+      <div class="kpi-card kpi-c2">
+        <div class="kpi-top"><div class="kpi-label">Material Value</div><div class="kpi-icon kpi-i2">🏗️</div></div>
+        <div class="kpi-value">{fmt_inr(total_material)}</div><div class="kpi-sub">Base material cost</div>
+      </div>
+      <div class="kpi-card kpi-c3">
+        <div class="kpi-top"><div class="kpi-label">Total Tax</div><div class="kpi-icon kpi-i3">🧾</div></div>
+        <div class="kpi-value">{fmt_inr(total_tax)}</div><div class="kpi-sub">GST / VAT collected</div>
+      </div>
+      <div class="kpi-card kpi-c4">
+        <div class="kpi-top"><div class="kpi-label">Total Discount</div><div class="kpi-icon kpi-i4">🏷️</div></div>
+        <div class="kpi-value">{fmt_inr(total_discount)}</div><div class="kpi-sub">Savings on orders</div>
+      </div>
+      <div class="kpi-card kpi-c5">
+        <div class="kpi-top"><div class="kpi-label">Unique Vendors</div><div class="kpi-icon kpi-i5">🏢</div></div>
+        <div class="kpi-value">{uniq_vendors}</div><div class="kpi-sub">Distinct suppliers</div>
+      </div>
+    </div>""", unsafe_allow_html=True)
 
-st.markdown(f"""
-<div class="kpi-row">
-  <div class="kpi-card kpi-c1">
-    <div class="kpi-top"><div class="kpi-label">Total Net Value</div><div class="kpi-icon kpi-i1">💰</div></div>
-    <div class="kpi-value">{fmt_inr(total_net)}</div><div class="kpi-sub">Total procurement spend</div>
-  </div>
-  <div class="kpi-card kpi-c2">
-    <div class="kpi-top"><div class="kpi-label">Material Value</div><div class="kpi-icon kpi-i2">🏗️</div></div>
-    <div class="kpi-value">{fmt_inr(total_material)}</div><div class="kpi-sub">Base material cost</div>
-  </div>
-  <div class="kpi-card kpi-c3">
-    <div class="kpi-top"><div class="kpi-label">Total Tax</div><div class="kpi-icon kpi-i3">🧾</div></div>
-    <div class="kpi-value">{fmt_inr(total_tax)}</div><div class="kpi-sub">GST / VAT collected</div>
-  </div>
-  <div class="kpi-card kpi-c4">
-    <div class="kpi-top"><div class="kpi-label">Total Discount</div><div class="kpi-icon kpi-i4">🏷️</div></div>
-    <div class="kpi-value">{fmt_inr(total_discount)}</div><div class="kpi-sub">Savings on orders</div>
-  </div>
-  <div class="kpi-card kpi-c5">
-    <div class="kpi-top"><div class="kpi-label">Unique Vendors</div><div class="kpi-icon kpi-i5">🏢</div></div>
-    <div class="kpi-value">{uniq_vendors}</div><div class="kpi-sub">Distinct suppliers</div>
-  </div>
-</div>""", unsafe_allow_html=True)
+
+kpi_strip(q, flt, fstate, n_rows)
 
 
 # ═══════════════════════════════════════════════════════════════
 #  OVERVIEW CHARTS
 # ═══════════════════════════════════════════════════════════════
-ch1,ch2 = st.columns(2)
-with ch1:
-    st.markdown('<div class="chart-card"><div class="chart-title">🏢 Top Suppliers by Net Value</div><div class="chart-sub">Total net spend per vendor</div>', unsafe_allow_html=True)
-    _render(chart_supplier_bar, df, "ov1")
-    st.markdown('</div>', unsafe_allow_html=True)
-with ch2:
-    st.markdown('<div class="chart-card"><div class="chart-title">📦 Top Items by Net Value</div><div class="chart-sub">Highest-value item descriptions</div>', unsafe_allow_html=True)
-    _render(chart_material_bar, df, "ov2")
-    st.markdown('</div>', unsafe_allow_html=True)
+@fragment
+def overview_charts(q, flt, fstate):
+    """The four overview charts; like the KPI strip, only full reruns redraw them."""
+    ch1,ch2 = st.columns(2)
+    with ch1:
+        st.markdown('<div class="chart-card"><div class="chart-title">🏢 Top Suppliers by Net Value</div><div class="chart-sub">Total net spend per vendor</div>', unsafe_allow_html=True)
+        _render(chart_supplier_bar, lambda: q.rollup(flt, ["Supplier"], top=8), "ov1", fstate)
+        st.markdown('</div>', unsafe_allow_html=True)
+    with ch2:
+        st.markdown('<div class="chart-card"><div class="chart-title">📦 Top Items by Net Value</div><div class="chart-sub">Highest-value item descriptions</div>', unsafe_allow_html=True)
+        _render(chart_material_bar, lambda: q.rollup(flt, ["Item Description"], top=8), "ov2", fstate)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    trend_fig = cached_figure(chart_trend, lambda: q.rollup(flt, ["_month"]), fstate)
+    if trend_fig:
+        st.markdown('<div class="chart-card"><div class="chart-title">📈 Monthly Spend Trend</div><div class="chart-sub">Net procurement value by PO month</div>', unsafe_allow_html=True)
+        draw_chart(trend_fig, "ov3")
+        st.markdown('</div>', unsafe_allow_html=True)
 
-trend_fig = chart_trend(df)
-if trend_fig:
-    st.markdown('<div class="chart-card"><div class="chart-title">📈 Monthly Spend Trend</div><div class="chart-sub">Net procurement value by PO month</div>', unsafe_allow_html=True)
-    st.plotly_chart(trend_fig, use_container_width=True, config={"displayModeBar":False}, key="ov3")
+    st.markdown('<div class="chart-card"><div class="chart-title">📊 Cost Breakdown by Supplier</div><div class="chart-sub">Material · Tax · Freight · Others stacked per vendor</div>', unsafe_allow_html=True)
+    _render(chart_cost_breakdown, lambda: q.rollup(flt, ["Supplier"], ["Material","Tax","Freight","Others"], top=8), "ov4", fstate)
     st.markdown('</div>', unsafe_allow_html=True)
 
-st.markdown('<div class="chart-card"><div class="chart-title">📊 Cost Breakdown by Supplier</div><div class="chart-sub">Material · Tax · Freight · Others stacked per vendor</div>', unsafe_allow_html=True)
-_render(chart_cost_breakdown, df, "ov4")
-st.markdown('</div>', unsafe_allow_html=True)
+
+overview_charts(q, flt, fstate)
 
 
 # ═══════════════════════════════════════════════════════════════
-#  TABS
+#  VIEWS
 # ═══════════════════════════════════════════════════════════════
-tab_rec, tab_vs, tab_an = st.tabs([f"📋  Records  ({len(df):,})", "🏢  Vendor Summary", "📊  Analytics"])
-
-
 # ─────────────────────────────────────────────────────────────
-#  TAB 1 : RECORDS
+#  VIEW 1 : RECORDS
 # ─────────────────────────────────────────────────────────────
-with tab_rec:
+@fragment
+def records_view(base, g_rows, g_preds, fstate):
+    """Records table: its search, supplier, sort and paging widgets rerun only this fragment."""
     tb1,tb2,tb3,tb4 = st.columns([3,2,1.8,1.2])
     with tb1:
         tbl_q = st.text_input("tbl_search", label_visibility="collapsed", placeholder="🔍  Filter table rows…", key="tbl_search")
     with tb2:
-        sup_opts = ["All Suppliers"]+safe_sort(df["Supplier"])
+        sup_opts = ["All Suppliers"]+cached_view("supplier_options", fstate, lambda: safe_sort(
+            base["Supplier"] if g_rows is None else base["Supplier"].take(g_rows)))
         sel_sup  = st.selectbox("Supplier filter", sup_opts, label_visibility="collapsed", key="sel_sup")
     with tb3:
         sort_by = st.selectbox("Sort by", ["Net ↓","Net ↑","PO Dt ↓","Supplier A-Z","Rate ↓","Material ↓"],
                                label_visibility="collapsed", key="sort_by")
     with tb4:
-        st.download_button("📤 Export", data=df.to_csv(index=False).encode(),
+        st.download_button("📤 Export", data=deferred_export("filtered", base, "csv", fstate, g_rows),
                            file_name=f"records_{datetime.today():%Y%m%d}.csv",
                            mime="text/csv", use_container_width=True, key="dl_tab1")
 
-    df_tbl = df.copy()
-    if tbl_q.strip():
-        q2=tbl_q.strip().lower(); m2=pd.Series(False,index=df_tbl.index)
-        for col in ["Supplier","Item Description","PO No","Item","HSN No"]:
-            if col in df_tbl.columns: m2 |= df_tbl[col].astype(str).str.lower().str.contains(q2,na=False)
-        df_tbl = df_tbl[m2]
-    if sel_sup!="All Suppliers": df_tbl=df_tbl[df_tbl["Supplier"]==sel_sup]
-
-    sort_map={"Net ↓":("Net",False),"Net ↑":("Net",True),"PO Dt ↓":("PO Dt",False),
+    sort_map={"Net ↓":("Net",False),"Net ↑":("Net",True),"PO Dt ↓":("_po_dt",False),
               "Supplier A-Z":("Supplier",True),"Rate ↓":("Rate",False),"Material ↓":("Material",False)}
-    sc_,sa_=sort_map.get(sort_by,("Net",False))
-    if sc_ in df_tbl.columns: df_tbl=df_tbl.sort_values(sc_,ascending=sa_)
-
-    st.markdown(f'<div class="tbl-info">Showing <strong>{len(df_tbl):,}</strong> of <strong>{len(df):,}</strong> records — Net Total: <strong>{fmt_inr(df_tbl["Net"].sum())}</strong></div>', unsafe_allow_html=True)
-
-    disp=df_tbl.copy()
-    for c in ["Rate","Material","Excise","Discount","Tax","Freight","Others","Net"]:
-        if c in disp.columns: disp[c]=disp[c].apply(fmt_inr_full)
-    if "Quantity" in disp.columns: disp["Quantity"]=disp["Quantity"].apply(lambda x:f"{int(x):,}")
-
-    st.dataframe(disp, use_container_width=True, height=min(42+len(disp)*36,560), hide_index=True,
-                 column_config={
-                     "PO Dt":st.column_config.TextColumn("📅 PO Dt",width=100),
-                     "PO No":st.column_config.TextColumn("📄 PO No",width=160),
-                     "Supplier":st.column_config.TextColumn("🏢 Supplier",width=200),
-                     "Item":st.column_config.TextColumn("🔖 Item",width=90),
-                     "HSN No":st.column_config.TextColumn("🔢 HSN",width=80),
-                     "Item Description":st.column_config.TextColumn("📦 Description",width=240),
-                     "Indent Dt":st.column_config.TextColumn("📅 Indent Dt",width=100),
-                     "Indent No":st.column_config.TextColumn("📋 Indent No",width=130),
-                     "UOM":st.column_config.TextColumn("📐 UOM",width=65),
-                     "Quantity":st.column_config.TextColumn("Qty",width=70),
-                     "Rate":st.column_config.TextColumn("💵 Rate",width=110),
-                     "Material":st.column_config.TextColumn("🏗️ Material",width=110),
-                     "Excise":st.column_config.TextColumn("Excise",width=90),
-                     "Discount":st.column_config.TextColumn("🏷️ Discount",width=100),
-                     "Tax":st.column_config.TextColumn("🧾 Tax",width=100),
-                     "Freight":st.column_config.TextColumn("🚚 Freight",width=100),
-                     "Others":st.column_config.TextColumn("Others",width=85),
-                     "Net":st.column_config.TextColumn("💰 Net",width=120),
-                 })
+    tbl_state = (fstate, tbl_q.strip().lower(), sel_sup)
+    rows = sorted_rows(g_preds + [
+        ("tbl_search",   tbl_q.strip().lower(), lambda: search_index().mask(tbl_q, TABLE_SEARCH_COLS)),
+        ("tbl_supplier", None if sel_sup=="All Suppliers" else sel_sup, lambda: (base["Supplier"]==sel_sup).to_numpy()),
+    ], tbl_state, *sort_map.get(sort_by,("Net",False)))
+
+    st.markdown(f'<div class="tbl-info">Showing <strong>{len(rows):,}</strong> of <strong>{len(base) if g_rows is None else len(g_rows):,}</strong> records — Net Total: <strong>{fmt_inr(base["Net"].to_numpy()[rows].sum())}</strong></div>', unsafe_allow_html=True)
+
+    paged_table("records", rows, (tbl_state, sort_by), {
+        "PO Dt":st.column_config.TextColumn("📅 PO Dt",width=100),
+        "PO No":st.column_config.TextColumn("📄 PO No",width=160),
+        "Supplier":st.column_config.TextColumn("🏢 Supplier",width=200),
+        "Item":st.column_config.TextColumn("🔖 Item",width=90),
+        "HSN No":st.column_config.TextColumn("🔢 HSN",width=80),
+        "Item Description":st.column_config.TextColumn("📦 Description",width=240),
+        "Indent Dt":st.column_config.TextColumn("📅 Indent Dt",width=100),
+        "Indent No":st.column_config.TextColumn("📋 Indent No",width=130),
+        "UOM":st.column_config.TextColumn("📐 UOM",width=65),
+        "Quantity":st.column_config.NumberColumn("Qty",width=70,format="%,d"),
+        "Rate":st.column_config.NumberColumn("💵 Rate",width=110,format=INR_FORMAT),
+        "Material":st.column_config.NumberColumn("🏗️ Material",width=110,format=INR_FORMAT),
+        "Excise":st.column_config.NumberColumn("Excise",width=90,format=INR_FORMAT),
+        "Discount":st.column_config.NumberColumn("🏷️ Discount",width=100,format=INR_FORMAT),
+        "Tax":st.column_config.NumberColumn("🧾 Tax",width=100,format=INR_FORMAT),
+        "Freight":st.column_config.NumberColumn("🚚 Freight",width=100,format=INR_FORMAT),
+        "Others":st.column_config.NumberColumn("Others",width=85,format=INR_FORMAT),
+        "Net":st.column_config.NumberColumn("💰 Net",width=120,format=INR_FORMAT),
+    })
 
 
 # ─────────────────────────────────────────────────────────────
-#  TAB 2 : VENDOR SUMMARY
+#  VIEW 2 : VENDOR SUMMARY
 # ─────────────────────────────────────────────────────────────
-with tab_vs:
-    vs = (df.groupby("Supplier")
-            .agg(Records=("Net","count"),Total_Net=("Net","sum"),
-                 Total_Material=("Material","sum"),Total_Tax=("Tax","sum"),
-                 Total_Discount=("Discount","sum"),Total_Freight=("Freight","sum"),
-                 Avg_Rate=("Rate","mean"))
-            .reset_index().sort_values("Total_Net",ascending=False))
-    vs["Share_%"]=(vs["Total_Net"]/vs["Total_Net"].sum()*100).round(1)
+@fragment
+def vendor_view(n_rows, q, flt, fstate):
+    """Vendor cards, the all-vendors table and its export."""
+    with span("vendor_summary", rows_in=n_rows) as s:
+        vs = cached_view("vendor_summary", fstate, lambda: vendor_summary(q.rollup(flt, ["Supplier"], VS_MEASURES)))
+        s.note(rows_out=len(vs))
 
     avatars=["🏗️","⚙️","🔩","🧪","🌲","🧵","🔬","💎","⚡","🛠️","🎯","🔧"]
     av_bgs=["rgba(14,165,233,0.14)","rgba(99,102,241,0.14)","rgba(16,185,129,0.14)",
             "rgba(245,158,11,0.14)","rgba(236,72,153,0.14)","rgba(167,139,250,0.14)"]
 
     top6=vs.head(6); cols=st.columns(3)
+    with span("format vendor cards", rows_in=len(top6)):
+        lbl={c:fmt_inr_array(top6[c], short=True) for c in ["Avg_Rate","Total_Net","Total_Tax","Total_Discount"]}
     for i,(_,row) in enumerate(top6.iterrows()):
         with cols[i%3]:
             st.markdown(f"""
             <div class="v-card" style="margin-bottom:12px">
               <div class="v-avatar" style="background:{av_bgs[i%len(av_bgs)]}">{avatars[i%len(avatars)]}</div>
               <div class="v-name" title="{row.Supplier}">{row.Supplier}</div>
-              <div class="v-loc">📋 {int(row.Records)} orders &nbsp;|&nbsp; Avg Rate: {fmt_inr(row.Avg_Rate)}</div>
+              <div class="v-loc">📋 {int(row.Records)} orders &nbsp;|&nbsp; Avg Rate: {lbl['Avg_Rate'][i]}</div>
               <div class="v-stats">
-                <div class="v-stat"><span class="v-stat-val" style="color:#38bdf8">{fmt_inr(row.Total_Net)}</span><div class="v-stat-lbl">Net Value</div></div>
+                <div class="v-stat"><span class="v-stat-val" style="color:#38bdf8">{lbl['Total_Net'][i]}</span><div class="v-stat-lbl">Net Value</div></div>
                 <div class="v-stat"><span class="v-stat-val" style="color:#34d399">{row["Share_%"]:.1f}%</span><div class="v-stat-lbl">Spend Share</div></div>
-                <div class="v-stat"><span class="v-stat-val" style="color:#f59e0b">{fmt_inr(row.Total_Tax)}</span><div class="v-stat-lbl">Total Tax</div></div>
-                <div class="v-stat"><span class="v-stat-val" style="color:#f472b6">{fmt_inr(row.Total_Discount)}</span><div class="v-stat-lbl">Discount</div></div>
+                <div class="v-stat"><span class="v-stat-val" style="color:#f59e0b">{lbl['Total_Tax'][i]}</span><div class="v-stat-lbl">Total Tax</div></div>
+                <div class="v-stat"><span class="v-stat-val" style="color:#f472b6">{lbl['Total_Discount'][i]}</span><div class="v-stat-lbl">Discount</div></div>
               </div>
             </div>""", unsafe_allow_html=True)
 
     st.markdown("<div style='height:14px'></div>", unsafe_allow_html=True)
     st.markdown("**📋 All Vendors**")
 
-    vd=vs.copy()
-    vd["Net Value"]=vd["Total_Net"].apply(fmt_inr_full)
-    vd["Material"]=vd["Total_Material"].apply(fmt_inr_full)
-    vd["Tax"]=vd["Total_Tax"].apply(fmt_inr_full)
-    vd["Discount"]=vd["Total_Discount"].apply(fmt_inr_full)
-    vd["Freight"]=vd["Total_Freight"].apply(fmt_inr_full)
-    vd["Avg Rate"]=vd["Avg_Rate"].apply(fmt_inr_full)
-    vd["Share"]=vd["Share_%"].apply(lambda x:f"{x:.1f}%")
-    vd=vd[["Supplier","Records","Net Value","Material","Tax","Discount","Freight","Avg Rate","Share"]]
-
-    st.dataframe(vd, use_container_width=True, height=min(42+len(vd)*36,480), hide_index=True,
-                 column_config={
-                     "Supplier":st.column_config.TextColumn("🏢 Supplier",width=220),
-                     "Records":st.column_config.NumberColumn("Records",width=80,format="%d"),
-                     "Net Value":st.column_config.TextColumn("💰 Net Value",width=130),
-                     "Material":st.column_config.TextColumn("🏗️ Material",width=130),
-                     "Tax":st.column_config.TextColumn("🧾 Tax",width=120),
-                     "Discount":st.column_config.TextColumn("🏷️ Discount",width=120),
-                     "Freight":st.column_config.TextColumn("🚚 Freight",width=110),
-                     "Avg Rate":st.column_config.TextColumn("Avg Rate",width=120),
-                     "Share":st.column_config.TextColumn("Share %",width=80),
-                 })
-    st.download_button("📤 Export Vendor Summary", data=vs.to_csv(index=False).encode(),
+    with span("table vendor_summary", rows_in=len(vs), rows_out=len(vs)):
+        st.dataframe(vs, use_container_width=True, height=min(42+len(vs)*36,480), hide_index=True,
+                     column_order=["Supplier","Records","Total_Net","Total_Material","Total_Tax","Total_Discount","Total_Freight","Avg_Rate","Share_%"],
+                     column_config={
+                         "Supplier":st.column_config.TextColumn("🏢 Supplier",width=220),
+                         "Records":st.column_config.NumberColumn("Records",width=80,format="%d"),
+                         "Total_Net":st.column_config.NumberColumn("💰 Net Value",width=130,format=INR_FORMAT),
+                         "Total_Material":st.column_config.NumberColumn("🏗️ Material",width=130,format=INR_FORMAT),
+                         "Total_Tax":st.column_config.NumberColumn("🧾 Tax",width=120,format=INR_FORMAT),
+                         "Total_Discount":st.column_config.NumberColumn("🏷️ Discount",width=120,format=INR_FORMAT),
+                         "Total_Freight":st.column_config.NumberColumn("🚚 Freight",width=110,format=INR_FORMAT),
+                         "Avg_Rate":st.column_config.NumberColumn("Avg Rate",width=120,format=INR_FORMAT),
+                         "Share_%":st.column_config.NumberColumn("Share %",width=80,format="%.1f%%"),
+                     })
+    st.download_button("📤 Export Vendor Summary", data=deferred_export("vendor_summary", vs, "csv", fstate),
                        file_name=f"vendor_summary_{datetime.today():%Y%m%d}.csv",
                        mime="text/csv", key="dl_vs")
 
 
 # ─────────────────────────────────────────────────────────────
-#  TAB 3 : ANALYTICS
+#  VIEW 3 : ANALYTICS
 # ─────────────────────────────────────────────────────────────
-with tab_an:
+@fragment
+def analytics_view(base, g_rows, q, flt, g_preds, fstate):
+    """Analytics charts, the pricing table (its paging reruns only this) and the export buttons."""
     ac1,ac2 = st.columns(2)
     with ac1:
         st.markdown('<div class="chart-card"><div class="chart-title">🍩 Vendor Spend Share</div><div class="chart-sub">Top 10 vendors by proportion of net spend</div>', unsafe_allow_html=True)
-        _render(chart_donut, df, "an1")
+        _render(chart_donut, lambda: q.rollup(flt, ["Supplier"], top=10), "an1", fstate)
         st.markdown('</div>', unsafe_allow_html=True)
     with ac2:
         st.markdown('<div class="chart-card"><div class="chart-title">📊 Top Items Ranked</div><div class="chart-sub">Highest-value items by net amount</div>', unsafe_allow_html=True)
-        _render(chart_hbar, df, "an2")
+        _render(chart_hbar, lambda: q.rollup(flt, ["Item Description"], top=10), "an2", fstate)
         st.markdown('</div>', unsafe_allow_html=True)
 
     ac3,ac4 = st.columns(2)
     with ac3:
-        st.markdown('<div class="chart-card"><div class="chart-title">💹 Discount vs Tax Analysis</div><div class="chart-sub">Each dot = one PO line · colour = Net value</div>', unsafe_allow_html=True)
-        _render(chart_discount_tax, df, "an3")
+        st.markdown('<div class="chart-card"><div class="chart-title">💹 Discount vs Tax Analysis</div><div class="chart-sub">Each dot = one PO line · colour = Net value · large selections show density plus extremes</div>', unsafe_allow_html=True)
+        _render(chart_discount_tax, lambda: q.scatter(flt), "an3", fstate)
         st.markdown('</div>', unsafe_allow_html=True)
     with ac4:
         st.markdown('<div class="chart-card"><div class="chart-title">🔢 Spend by UOM</div><div class="chart-sub">Net value grouped by unit of measure</div>', unsafe_allow_html=True)
-        _render(chart_uom_bar, df, "an4")
+        _render(chart_uom_bar, lambda: q.rollup(flt, ["UOM"]), "an4", fstate)
         st.markdown('</div>', unsafe_allow_html=True)
 
     st.markdown("**💎 Full Pricing Table — sorted by Net Value**")
-    ps=df.copy().sort_values("Net",ascending=False)
-    for c in ["Rate","Material","Excise","Discount","Tax","Freight","Others","Net"]:
-        if c in ps.columns: ps[c]=ps[c].apply(fmt_inr_full)
-    if "Quantity" in ps.columns:
-        ps["Quantity"]=ps["Quantity"].apply(lambda x:f"{int(float(x)):,}" if str(x).replace(".","",1).isdigit() else x)
-
-    show_cols=[c for c in COLS if c in ps.columns]
-    st.dataframe(ps[show_cols], use_container_width=True, height=400, hide_index=True,
-                 column_config={
-                     "PO Dt":st.column_config.TextColumn("📅 PO Dt",width=100),
-                     "PO No":st.column_config.TextColumn("📄 PO No",width=155),
-                     "Supplier":st.column_config.TextColumn("🏢 Supplier",width=195),
-                     "Item":st.column_config.TextColumn("🔖 Item",width=85),
-                     "HSN No":st.column_config.TextColumn("🔢 HSN",width=80),
-                     "Item Description":st.column_config.TextColumn("📦 Description",width=240),
-                     "Indent Dt":st.column_config.TextColumn("📅 Indent Dt",width=100),
-                     "Indent No":st.column_config.TextColumn("📋 Indent No",width=125),
-                     "UOM":st.column_config.TextColumn("📐 UOM",width=65),
-                     "Quantity":st.column_config.TextColumn("Qty",width=70),
-                     "Rate":st.column_config.TextColumn("💵 Rate",width=110),
-                     "Material":st.column_config.TextColumn("🏗️ Material",width=110),
-                     "Excise":st.column_config.TextColumn("Excise",width=90),
-                     "Discount":st.column_config.TextColumn("🏷️ Discount",width=100),
-                     "Tax":st.column_config.TextColumn("🧾 Tax",width=100),
-                     "Freight":st.column_config.TextColumn("🚚 Freight",width=95),
-                     "Others":st.column_config.TextColumn("Others",width=85),
-                     "Net":st.column_config.TextColumn("💰 Net",width=115),
-                 })
-
-    col_dl1,col_dl2,_=st.columns([1.2,1.2,4])
-    with col_dl1:
-        st.download_button("📥 Download CSV", data=df.to_csv(index=False).encode(),
-                           file_name=f"vendor_data_{datetime.today():%Y%m%d}.csv",
-                           mime="text/csv", key="dl_an_csv")
-    with col_dl2:
-        try:
-            buf=io.BytesIO()
-            with pd.ExcelWriter(buf,engine="openpyxl") as w: df.to_excel(w,index=False,sheet_name="VendorData")
-            st.download_button("📥 Download Excel", data=buf.getvalue(),
-                               file_name=f"vendor_data_{datetime.today():%Y%m%d}.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               key="dl_an_xlsx")
-        except Exception:
-            pass
+    paged_table("pricing", sorted_rows(g_preds, fstate, "Net", False), fstate, {
+        "PO Dt":st.column_config.TextColumn("📅 PO Dt",width=100),
+        "PO No":st.column_config.TextColumn("📄 PO No",width=155),
+        "Supplier":st.column_config.TextColumn("🏢 Supplier",width=195),
+        "Item":st.column_config.TextColumn("🔖 Item",width=85),
+        "HSN No":st.column_config.TextColumn("🔢 HSN",width=80),
+        "Item Description":st.column_config.TextColumn("📦 Description",width=240),
+        "Indent Dt":st.column_config.TextColumn("📅 Indent Dt",width=100),
+        "Indent No":st.column_config.TextColumn("📋 Indent No",width=125),
+        "UOM":st.column_config.TextColumn("📐 UOM",width=65),
+        "Quantity":st.column_config.NumberColumn("Qty",width=70,format="%,d"),
+        "Rate":st.column_config.NumberColumn("💵 Rate",width=110,format=INR_FORMAT),
+        "Material":st.column_config.NumberColumn("🏗️ Material",width=110,format=INR_FORMAT),
+        "Excise":st.column_config.NumberColumn("Excise",width=90,format=INR_FORMAT),
+        "Discount":st.column_config.NumberColumn("🏷️ Discount",width=100,format=INR_FORMAT),
+        "Tax":st.column_config.NumberColumn("🧾 Tax",width=100,format=INR_FORMAT),
+        "Freight":st.column_config.NumberColumn("🚚 Freight",width=95,format=INR_FORMAT),
+        "Others":st.column_config.NumberColumn("Others",width=85,format=INR_FORMAT),
+        "Net":st.column_config.NumberColumn("💰 Net",width=115,format=INR_FORMAT),
+    }, max_height=400)
+
+    # every file is written on click only, then served from the export cache
+    dl_formats=[("csv","📥 CSV"),("csv.gz","📥 CSV (gzip)")]+([("parquet","📥 Parquet")] if parquet_available() else [])+[("xlsx","📥 Excel report")]
+    for col,(fmt,label) in zip(st.columns([1.2]*len(dl_formats)+[6-1.2*len(dl_formats)]), dl_formats):
+        with col:
+            ext,mime=EXPORT_FORMATS[fmt]
+            st.download_button(label, data=deferred_export("filtered", base, fmt, fstate, g_rows, sheets=lambda: [
+                                   ("Vendor Summary", vendor_summary(q.rollup(flt, ["Supplier"], VS_MEASURES))),
+                                   ("Monthly Trend", monthly_trend(q.rollup(flt, ["_month"], ["Net","Material","Tax","Discount","Freight","_lines"]))),
+                                   ("Item Rollup", item_rollup(q.rollup(flt, ["Item Description","UOM"], ["Quantity","Net","Material","Tax","_lines","_rate_sum"])))]),
+                               file_name=f"vendor_data_{datetime.today():%Y%m%d}.{ext}",
+                               mime=mime, key=f"dl_an_{fmt}")
+    rs = report_stats().get(("filtered", fstate))
+    if rs: st.caption(f"Excel report: {rs['rows']:,} records · {rs['sheets']} sheets · {rs['seconds']:.1f}s "
+                      f"({rs['rows_per_s']:,.0f} rows/s) · {rs['bytes']/1e6:,.1f} MB"
+                      + (f" · peak {rs['peak_mb']:,.0f} MB traced" if rs.get("peak_mb") is not None else "")
+                      + (f" · process peak RSS {rs['rss_mb']:,.0f} MB" if rs.get("rss_mb") is not None else "")
+                      + (" · spooled to disk" if rs.get("spilled") else ""))
+
 
+# ─────────────────────────────────────────────────────────────
+#  VIEW 4 : PRICE ANOMALIES
+# ─────────────────────────────────────────────────────────────
+@fragment
+def anomaly_view(base, g_preds, fstate):
+    """Overpriced lines ranked by the excess paid over their item's typical rate. Rate statistics
+    come from the whole dataset; the flagged lines follow the sidebar filters."""
+    pa1,pa2 = st.columns([4,1.4])
+    with pa2:
+        z = st.select_slider("Flag above robust z", [2.5, 3.0, 3.5, 5.0, 8.0], value=PRICE_Z, key="pa_z",
+                             help="Robust z = 0.6745 × (rate − item median) / MAD. Higher flags fewer, more extreme lines.")
+    with span("price anomalies") as s:
+        pi = price_index()
+        lines = cached_view(("anomalies", z), fstate, lambda: pi.anomalies(base, row_positions(g_preds), z=z))
+        s.note(rows_in=pi.n, rows_out=len(lines))
+    with pa1:
+        st.markdown(f'<div class="tbl-info"><strong>{len(lines):,}</strong> overpriced lines in <strong>{lines["_group"].nunique():,}</strong> of {len(pi.keys):,} item groups — <strong>{fmt_inr(lines["Excess"].sum())}</strong> paid over typical rates</div>', unsafe_allow_html=True)
+    if lines.empty:
+        st.info("No line in the current selection is priced unusually high for its item."); return
+
+    st.markdown('<div class="chart-card"><div class="chart-title">🚩 Where the Excess Goes</div><div class="chart-sub">Items with the most excess spend · band = P10–P90 of their rates · ◆ = best supplier\'s median · dots = flagged lines</div>', unsafe_allow_html=True)
+    _render(chart_price_anomalies, lines, "pa1", (fstate, z))
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    st.markdown(f"**📋 Flagged Lines — ranked by excess paid**" + (f" (top {PRICE_TOP_LINES:,})" if len(lines) > PRICE_TOP_LINES else ""))
+    top = lines.head(PRICE_TOP_LINES)
+    with span("table price anomalies", rows_in=len(lines), rows_out=len(top)):
+        st.dataframe(top, use_container_width=True, height=min(42+len(top)*36,480), hide_index=True,
+                     column_order=["Supplier","Item","Item Description","UOM","PO No","PO Dt","Quantity","Rate","Typical Rate",
+                                   "vs Typical %","Robust Z","Best Rate","Best Supplier","vs Best %","Excess"],
+                     column_config={
+                         "Supplier":st.column_config.TextColumn("🏢 Supplier",width=190),
+                         "Item":st.column_config.TextColumn("🔖 Item",width=85),
+                         "Item Description":st.column_config.TextColumn("📦 Description",width=200),
+                         "UOM":st.column_config.TextColumn("📐 UOM",width=60),
+                         "PO No":st.column_config.TextColumn("📄 PO No",width=130),
+                         "PO Dt":st.column_config.TextColumn("📅 PO Dt",width=95),
+                         "Quantity":st.column_config.NumberColumn("Qty",width=70,format="%,d"),
+                         "Rate":st.column_config.NumberColumn("💵 Rate",width=105,format=INR_FORMAT),
+                         "Typical Rate":st.column_config.NumberColumn("Typical",width=105,format=INR_FORMAT),
+                         "vs Typical %":st.column_config.NumberColumn("vs Typical",width=90,format="+%.0f%%"),
+                         "Robust Z":st.column_config.NumberColumn("Robust z",width=75,format="%.1f"),
+                         "Best Rate":st.column_config.NumberColumn("Best Rate",width=105,format=INR_FORMAT),
+                         "Best Supplier":st.column_config.TextColumn("🏆 Best Supplier",width=180),
+                         "vs Best %":st.column_config.NumberColumn("vs Best",width=80,format="+%.0f%%"),
+                         "Excess":st.column_config.NumberColumn("💸 Excess",width=120,format=INR_FORMAT),
+                     })
+    st.download_button("📤 Export Flagged Lines", data=deferred_export("price_anomalies", lines, "csv", (fstate, z)),
+                       file_name=f"price_anomalies_{datetime.today():%Y%m%d}.csv",
+                       mime="text/csv", key="dl_pa")
+
+
+@fragment
+def views(base, g_rows, n_rows, q, flt, g_preds, fstate):
+    """The view selector and the chosen view. Switching views reruns only this fragment, and
+    each view is a fragment of its own, so its widgets rerun just that view."""
+    view = st.radio("View", ["rec","vs","an","pa"], horizontal=True, label_visibility="collapsed", key="view",
+                    format_func={"rec":f"📋  Records  ({n_rows:,})", "vs":"🏢  Vendor Summary", "an":"📊  Analytics",
+                                 "pa":"🚩  Price Anomalies"}.get)
+    if   view == "rec": records_view(base, g_rows, g_preds, fstate)
+    elif view == "vs":  vendor_view(n_rows, q, flt, fstate)
+    elif view == "an":  analytics_view(base, g_rows, q, flt, g_preds, fstate)
+    else:               anomaly_view(base, g_preds, fstate)
+
+views(base, g_rows, n_rows, q, flt, g_preds, fstate)
 
 # ═══════════════════════════════════════════════════════════════
 #  FOOTER
@@ -963,4 +1333,6 @@ st.markdown("""
 <div style="text-align:center;padding:24px 0 4px;font-size:10px;color:#1e293b;letter-spacing:0.3px">
   VendorIQ Intelligence Portal &nbsp;·&nbsp; Built with Streamlit
   &nbsp;·&nbsp; <span style="color:#0ea5e9">● Live</span>
-</div>""", unsafe_allow_html=True)
\ No newline at end of file
+</div>""", unsafe_allow_html=True)
+
+end_rerun()
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+from vendoriq_core import DatasetStore, synthetic_po
+
+
+def _batch():
+    return synthetic_po(300, seed=2, start="2025-04-01", end="2025-05-31")
+
+
+def test_append_with_other_text_dtypes_loads(tmp_path):
+    """save → append a batch whose text columns are categorical where the base is str (and the
+    reverse) → load."""
+    store = DatasetStore(str(tmp_path))
+    base = synthetic_po(1000, seed=1).astype({"PO No": "str", "Supplier": "str"})
+    store.save("plants", base)
+    store.append("plants", _batch().astype({"Item": "str"}))
+    df = store.load("plants")
+    assert len(df) == 1300
+    assert str(df["PO No"].dtype) == str(base["PO No"].dtype)
+    assert str(df["Item"].dtype) == "category"
+    assert set(_batch()["PO No"].astype(str)) <= set(df["PO No"])
+
+
+def test_load_store_with_mixed_part_types(tmp_path):
+    """A store whose parts were written with differing text dtypes (before appends were
+    conformed) still opens."""
+    store = DatasetStore(str(tmp_path))
+    store.save("legacy", synthetic_po(500, seed=1).astype({"PO No": "str"}))
+    store._write(store._dir("legacy"), store.meta("legacy"), _batch())   # unconformed part files
+    df = store.load("legacy")
+    assert len(df) == 800 and not isinstance(df["PO No"].dtype, pd.CategoricalDtype)
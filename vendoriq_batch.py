@@ -0,0 +1,114 @@
+"""
+VendorIQ batch reports — the portal's ingest and aggregations without Streamlit, for nightly jobs.
+
+    python vendoriq_batch.py plant_*.csv plant_*.xlsx -o reports/ -j 8 --export csv.gz
+    python vendoriq_batch.py fy2024_plants.zip plant_07.csv.gz -o reports/
+
+Files are parsed in parallel worker processes; every CSV/Excel file inside a .zip, and the file
+inside a .gz, counts as its own file and is decompressed as it is read. Each worker writes that file's vendor summary,
+monthly trend and item rollup (plus the cleaned records in every --export format) under
+<out>/<file stem>/ and sends back only the file's spend cube; the parent merges the cubes into
+the combined tables under <out>/all/ and writes batch_report.json.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+_t0 = time.perf_counter()
+from vendoriq_core import (EXPORT_FORMATS, METRICS_LOG, SpanRecorder, build_cube, ingest_entries,
+    ingest_entry, item_rollup, merge_cubes, monthly_trend, span, vendor_summary, write_export)
+IMPORT_SECONDS = time.perf_counter() - _t0   # every worker process pays this again under spawn
+
+
+def _write(path: str, data: bytes):
+    with open(path, "wb") as fh: fh.write(data)
+
+def _tables(df) -> dict:
+    """Report tables of PO rows or spend-cube cells, by output file name."""
+    return {"vendor_summary.csv": vendor_summary(df), "monthly_trend.csv": monthly_trend(df),
+            "item_rollup.csv": item_rollup(df)}
+
+def process_file(entry, out: str, exports=()) -> tuple:
+    """Worker: parse one PO file (an IngestEntry) and write its reports into `out`. Returns
+    (stats, spend cube); the cube is None when the file could not be processed. Per-phase
+    timings go in stats["spans"] (and to METRICS_LOG when set)."""
+    t0 = time.perf_counter()
+    stats = dict(file=entry.name, out=out, rows=0, seconds=0.0, error=None)
+    with SpanRecorder("batch", file=entry.name) as rec:
+        df, ingest = ingest_entry(entry)          # a read failure is reported there
+        stats["error"], cube = ingest["Error"] or None, None
+        if df is not None:
+            try:
+                os.makedirs(out, exist_ok=True)
+                for name, table in _tables(df).items(): _write(os.path.join(out, name), write_export(table, "csv"))
+                for fmt in exports:
+                    with span(f"export {fmt}", rows_in=len(df)):
+                        _write(os.path.join(out, f"records.{EXPORT_FORMATS[fmt][0]}"), write_export(df, fmt))
+                stats.update(rows=len(df), columns=df.attrs.get("aliases", {}), unmapped=df.attrs.get("unmapped", []))
+                with span("spend cube", rows_in=len(df)): cube = build_cube(df)
+            except Exception as e:
+                print(f"[VendorIQ] {entry.name} failed: {e}", file=sys.stderr); traceback.print_exc()
+                stats["error"] = f"{type(e).__name__}: {e}"
+    stats["seconds"] = round(time.perf_counter()-t0, 3)
+    stats["spans"] = [{k: r[k] for k in ("span", "ms", "rows_in", "rows_out")} for r in sorted(rec.spans, key=lambda r: r["at_ms"])]
+    if METRICS_LOG:
+        try: rec.write(METRICS_LOG)
+        except OSError as e: print(f"[VendorIQ] Cannot write metrics to {METRICS_LOG}: {e}", file=sys.stderr)
+    return stats, cube
+
+def _out_dirs(names, root: str) -> list:
+    """One output directory per input, named by file stem (numbered when stems repeat)."""
+    seen, dirs = {}, []
+    for p in names:
+        stem = os.path.basename(p).split(".")[0] or "file"
+        seen[stem] = seen.get(stem, 0) + 1
+        dirs.append(os.path.join(root, stem if seen[stem] == 1 else f"{stem}-{seen[stem]}"))
+    return dirs
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Parse PO files in parallel and write VendorIQ report tables.")
+    ap.add_argument("files", nargs="+", help="CSV/TXT/XLSX purchase-order files, or .zip/.gz archives of them")
+    ap.add_argument("-o", "--out", default="vendoriq_reports", help="output directory (default: %(default)s)")
+    ap.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="worker processes (default: CPU count)")
+    ap.add_argument("--export", action="append", default=[], choices=list(EXPORT_FORMATS),
+                    help="also write each file's cleaned records in this format (repeatable)")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    entries, results = [], []
+    for p in args.files:
+        try:    found = ingest_entries(p)
+        except Exception as e: found = []; print(f"[VendorIQ] {p}: cannot list ({e})", file=sys.stderr)
+        if not found: results.append((dict(file=p, out=None, rows=0, seconds=0.0, error="no CSV/Excel file to read"), None))
+        entries += found
+    print(f"[VendorIQ] vendoriq_core imported in {IMPORT_SECONDS:.2f}s · {len(entries)} file(s) on {args.workers} worker(s)")
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(entries)))) as pool:
+        jobs = [pool.submit(process_file, e, d, tuple(args.export)) for e, d in zip(entries, _out_dirs([e.name for e in entries], args.out))]
+        for job in as_completed(jobs):
+            stats, cube = job.result()
+            results.append((stats, cube))
+            print(f"[VendorIQ] {stats['file']}: " + (f"FAILED ({stats['error']})" if stats["error"] else
+                  f"{stats['rows']:,} rows in {stats['seconds']:.2f}s → {stats['out']}"))
+
+    cubes = [c for _, c in results if c is not None]
+    if cubes:
+        combined = os.path.join(args.out, "all")
+        os.makedirs(combined, exist_ok=True)
+        for name, table in _tables(merge_cubes(cubes)).items(): _write(os.path.join(combined, name), write_export(table, "csv"))
+    files = sorted((s for s, _ in results), key=lambda s: s["file"])
+    report = dict(import_seconds=round(IMPORT_SECONDS, 3), seconds=round(time.perf_counter()-t0, 3),
+                  workers=args.workers, rows=sum(s["rows"] for s in files),
+                  failed=sum(bool(s["error"]) for s in files), files=files)
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "batch_report.json"), "w", encoding="utf-8") as fh: json.dump(report, fh, indent=1)
+    print(f"[VendorIQ] {report['rows']:,} rows from {len(files)-report['failed']}/{len(files)} file(s) "
+          f"in {report['seconds']:.1f}s → {args.out}")
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
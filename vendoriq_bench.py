@@ -0,0 +1,175 @@
+"""
+VendorIQ benchmark suite — times the data path on synthetic_po() data at several sizes and saves
+the results as JSON, so runs can be compared for regressions.
+
+    python vendoriq_bench.py                                  # 10k / 100k / 1M rows
+    python vendoriq_bench.py -n 100000 -n 5000000 --excel-max 200000
+    python vendoriq_bench.py --compare bench_results/base.json   # exit status 1 on a regression
+
+Each case is timed best-of --repeat (once when a run takes over 2 s). Excel cases and the scalar
+fmt_inr_full() loop are skipped above --excel-max / --scalar-max rows. Before timing, the vectorised
+formatters are checked string for string against the scalar ones on rounding ties and unit
+boundaries; a mismatch fails the run.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from vendoriq_core import (DateIndex, FilterEngine, SearchIndex, build_cube, chart_cost_breakdown,
+    chart_discount_tax, chart_donut, chart_hbar, chart_material_bar, chart_supplier_bar, chart_trend,
+    chart_uom_bar, clean_df, fmt_inr, fmt_inr_array, fmt_inr_full, parquet_available, parse_file, PriceIndex, synthetic_po,
+    vendor_summary, write_excel_report, write_export, COLS, TEXT_COLS)
+
+CHARTS = [chart_supplier_bar, chart_material_bar, chart_trend, chart_cost_breakdown,
+          chart_donut, chart_hbar, chart_discount_tax, chart_uom_bar]
+
+# binary ties (0.125), decimal "ties" just below .5 (2.675), carries across units (99999.995),
+# and what the digit arithmetic can't take: non-finite, -0.0, amounts past int64 in paise
+FORMAT_EDGES = [0, 0.005, 0.015, 0.125, 0.5, 1.005, 1.5, 2.5, 2.675, 32.5, 999.5, 999.949999, 999.95, 1000,
+                99_999.5, 99_999.99, 99_999.995, 9_999_999.995, 1e7, 1e12+0.125, -0.004, -0.5, -2.675,
+                float("inf"), float("-inf"), float("nan"), -0.0, 1e15, 9.2e16, 1e17, -1e17, 1e300]
+
+
+def check_formatters(seed: int = 0) -> list:
+    """(value, array string, scalar string) for each value where fmt_inr_array(), full or short,
+    differs from fmt_inr_full() / fmt_inr(): FORMAT_EDGES, every k/8 up to 500, half-paise and
+    half-rupee values, and lognormal amounts."""
+    rng = np.random.default_rng(seed)
+    v = np.concatenate([FORMAT_EDGES, np.arange(4000)/8, rng.integers(0, 10**9, 20_000)/100 + 0.005,
+                        rng.integers(0, 10**6, 20_000) + 0.5, np.round(rng.lognormal(8, 3, 50_000), 2)])
+    bad = []
+    for short, scalar in ((False, fmt_inr_full), (True, fmt_inr)):
+        arr = fmt_inr_array(v, short=short)
+        bad += [(float(x), str(a), b) for x, a in zip(v, arr) if a != (b := scalar(x))]
+    return bad
+
+def _upload(data: bytes, name: str) -> io.BytesIO:
+    f = io.BytesIO(data); f.name = name
+    return f
+
+def _time(fn, setup=None, repeat: int = 3) -> float:
+    """Best wall time of fn(setup()) — setup is not timed."""
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        best = min(best, time.perf_counter() - t0)
+        if best > 2: break
+    return best
+
+def cases(n: int, args):
+    """(case, setup or None, fn) for one size. Later cases reuse what earlier ones produced."""
+    st = {}
+    yield "synthetic_po", None, lambda: st.update(df=synthetic_po(n, seed=args.seed))
+    df = st["df"]
+    yield "export csv",    None, lambda: st.update(csv=write_export(df, "csv"))
+    yield "export csv.gz", None, lambda: write_export(df, "csv.gz")
+    if parquet_available():
+        yield "export parquet", None, lambda: write_export(df, "parquet")
+    if n <= args.excel_max:
+        yield "export xlsx", None, lambda: st.update(xlsx=write_excel_report(df)[0])
+    yield "parse_file csv",        None, lambda: parse_file(_upload(st["csv"], "po.csv"))
+    yield "parse_file csv stream", None, lambda: parse_file(_upload(st["csv"], "po.csv"), stream=True)
+    if "xlsx" in st:
+        yield "parse_file xlsx", None, lambda: parse_file(_upload(st["xlsx"], "po.xlsx"))
+    raw = pd.read_csv(io.BytesIO(st["csv"]), usecols=COLS, dtype={c: str for c in TEXT_COLS})
+    yield "clean_df", lambda: raw.copy(), clean_df
+    yield "DateIndex build",   None, lambda: st.update(di=DateIndex(df["_po_dt"]))
+    yield "SearchIndex build", None, lambda: st.update(si=SearchIndex(df))
+    yield "search cold",   lambda: st["si"]._recent.clear(), lambda _: st["si"].mask("steel")   # no earlier query to refine
+    yield "search refine", None, lambda: st["si"].mask("steel r")
+    sups = tuple(df["Supplier"].cat.categories[:5])
+    lo, hi = df["_po_dt"].quantile([0.25, 0.75])
+    preds = lambda net: [
+        ("dates",    (lo, hi), lambda: st["di"].mask(lo, hi)),
+        ("search",   "steel",  lambda: st["si"].mask("steel")),
+        ("supplier", sups,     lambda: df["Supplier"].isin(sups).to_numpy()),
+        ("net",      net,      lambda: df["Net"].between(*net).to_numpy()),
+    ]
+    yield "filter pipeline cold",       lambda: FilterEngine(), lambda fe: df.take(fe.rows("v", preds((1e3, 1e6))))
+    fe = FilterEngine(); fe.rows("v", preds((1e3, 1e6)))
+    yield "filter pipeline one change", None, lambda: df.take(fe.rows("v", preds((2e3, 1e6))))
+    yield "build_cube", None, lambda: build_cube(df)
+    yield "vendor_summary", None, lambda: vendor_summary(df)
+    yield "PriceIndex build", None, lambda: st.update(pi=PriceIndex(df))
+    cut = n - n//100
+    yield "PriceIndex extend 1%", lambda: PriceIndex(df.iloc[:cut].reset_index(drop=True)), lambda pi: pi.extend(df.iloc[cut:])
+    yield "price anomalies", None, lambda: st["pi"].anomalies(df)
+    for fn in CHARTS:
+        yield fn.__name__, None, lambda fn=fn: fn(df)
+    if n <= args.scalar_max:
+        yield "fmt_inr_full table", None, lambda: [fmt_inr_full(v) for v in df["Net"].to_numpy()]
+    yield "fmt_inr_array table", None, lambda: fmt_inr_array(df["Net"].to_numpy())
+
+def run(args) -> dict:
+    results = []
+    for n in args.rows:
+        for case, setup, fn in cases(n, args):
+            s = _time(fn, setup, args.repeat)
+            results.append(dict(case=case, rows=n, seconds=round(s, 5), rows_per_s=round(n/s) if s else None))
+            print(f"[VendorIQ] {n:>11,} rows · {case:<28} {s*1e3:>10.1f} ms · {n/max(s,1e-9):>14,.0f} rows/s", flush=True)
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: commit = None
+    meta = dict(timestamp=datetime.now().isoformat(timespec="seconds"), commit=commit, python=platform.python_version(),
+                pandas=pd.__version__, numpy=np.__version__, machine=platform.machine(), cpus=os.cpu_count(),
+                peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024),
+                args={k: v for k, v in vars(args).items() if k not in ("compare", "out")})
+    return dict(meta=meta, results=results)
+
+def compare(new: dict, base: dict, threshold: float) -> list:
+    """Cases at least `threshold` slower than in `base` (ignoring ones under 10 ms in both)."""
+    old = {(r["case"], r["rows"]): r["seconds"] for r in base["results"]}
+    slow = []
+    print(f"[VendorIQ] vs {base['meta'].get('commit')} ({base['meta']['timestamp']}):")
+    for r in new["results"]:
+        b = old.get((r["case"], r["rows"]))
+        if b is None: continue
+        ratio = r["seconds"] / b if b else float("inf")
+        flag = ratio > 1 + threshold and max(b, r["seconds"]) >= 0.01
+        if flag: slow.append(dict(r, base_seconds=b, ratio=round(ratio, 2)))
+        print(f"    {r['rows']:>11,} · {r['case']:<28} {b*1e3:>10.1f} → {r['seconds']*1e3:>10.1f} ms  ×{ratio:5.2f}{'  ← slower' if flag else ''}")
+    return slow
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the VendorIQ data path on synthetic PO data.")
+    ap.add_argument("-n", "--rows", type=int, action="append", help="dataset size (repeatable; default 10k, 100k, 1M)")
+    ap.add_argument("--repeat", type=int, default=3, help="timed runs per case, best kept (default: %(default)s)")
+    ap.add_argument("--excel-max", type=int, default=200_000, help="largest size for the Excel cases (default: %(default)s)")
+    ap.add_argument("--scalar-max", type=int, default=1_000_000, help="largest size for the fmt_inr_full loop (default: %(default)s)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-o", "--out", help="results file (default: bench_results/bench_<timestamp>.json)")
+    ap.add_argument("--compare", help="earlier results file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.25, help="slowdown counted as a regression (default: %(default)s = 25%%)")
+    args = ap.parse_args(argv)
+    args.rows = args.rows or [10_000, 100_000, 1_000_000]
+
+    bad = check_formatters(args.seed)
+    if bad:
+        print(f"[VendorIQ] fmt_inr_array differs from the scalar formatters on {len(bad)} value(s), e.g. {bad[:3]}"); return 1
+    res = run(args)
+    out = args.out or os.path.join("bench_results", f"bench_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh: json.dump(res, fh, indent=1)
+    print(f"[VendorIQ] {len(res['results'])} results → {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh: slow = compare(res, json.load(fh), args.threshold)
+        res["regressions"] = slow
+        with open(out, "w", encoding="utf-8") as fh: json.dump(res, fh, indent=1)
+        if slow:
+            print(f"[VendorIQ] {len(slow)} regression(s) over {args.threshold:.0%}"); return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2027 @@
+"""
+VendorIQ data layer — ingestion, ALIASES mapping, cleaning, aggregations, formatting, exports,
+the dataset store, query backends and figure builders. No Streamlit: importing this module has
+no side effects, so batch jobs (vendoriq_batch.py) and the portal (app3.py) share one code path.
+Heavy optional dependencies (pyarrow, duckdb, openpyxl, calamine) are imported on first use, and
+plotly only inside the chart builders, so batch jobs that never draw a chart don't load it.
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import hashlib
+import shutil
+import tempfile
+import threading
+import weakref
+import zipfile
+import importlib.util
+import traceback
+import tracemalloc
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from datetime import datetime
+try:
+    import resource                      # peak RSS for spans; not on Windows
+except ImportError:
+    resource = None
+
+# ═══════════════════════════════════════════════════════════════
+#  CONSTANTS
+# ═══════════════════════════════════════════════════════════════
+COLS = [
+    "PO Dt","PO No","Supplier","Item","HSN No","Item Description",
+    "Indent Dt","Indent No","UOM","Quantity","Rate",
+    "Material","Excise","Discount","Tax","Freight","Others","Net",
+]
+DATE_COLS    = {"PO Dt":"_po_dt", "Indent Dt":"_indent_dt"}   # display string → hidden datetime64 column
+SEARCH_COLS  = ["Supplier","Item Description","PO No","Item","HSN No","Indent No"]
+CUBE_DIMS     = ["Supplier","Item Description","UOM","_month"]
+CUBE_MEASURES = ["Net","Material","Tax","Discount","Freight","Others","Quantity","_lines","_rate_sum"]
+TABLE_SEARCH_COLS = ["Supplier","Item Description","PO No","Item","HSN No"]
+TEXT_COLS    = ["PO Dt","PO No","Supplier","Item","HSN No","Item Description","Indent Dt","Indent No","UOM"]
+NUMERIC_COLS = ["Quantity","Rate","Material","Excise","Discount","Tax","Freight","Others","Net"]
+INR_FORMAT   = "₹%,.2f"   # grid-side display of raw amounts, same text as fmt_inr_full()
+PALETTE = ["#0ea5e9","#6366f1","#10b981","#f59e0b","#ec4899",
+           "#a78bfa","#38bdf8","#34d399","#fb923c","#f472b6"]
+_BG   = "#0d1528"
+_GRID = "rgba(56,189,248,0.07)"
+_TICK = "#475569"
+_LAYOUT = dict(
+    paper_bgcolor=_BG, plot_bgcolor=_BG,
+    font=dict(family="DM Sans", color=_TICK, size=11),
+    margin=dict(t=10, b=10, l=10, r=10),
+    legend=dict(bgcolor="rgba(0,0,0,0)", font=dict(size=10, color=_TICK)),
+)
+
+PARSE_CACHE_MAX_BYTES  = 2_000_000_000   # parsed frames kept across reruns (LRU)
+STREAM_THRESHOLD_BYTES =    64_000_000   # CSV/TXT uploads above this are read in chunks
+STREAM_MEM_BUDGET      = 1_500_000_000   # peak bytes a chunked parse may hold
+MASK_CACHE_MAX_BYTES   =   256_000_000   # per-session cache of filter predicate masks
+FIG_CACHE_MAX_BYTES    =   200_000_000   # built Plotly figures kept across reruns (LRU)
+DATASET_STORE_MAX_BYTES = 4_000_000_000  # datasets held once per process and shared by sessions
+VIEW_CACHE_MAX_BYTES   =   300_000_000   # per-session cache of view results (summaries, row orders)
+EXPORT_CACHE_MAX_BYTES =   500_000_000   # finished export files kept across reruns (LRU)
+SCATTER_WEBGL_ROWS     =         5_000   # Discount vs Tax: above this many lines draw with WebGL
+SCATTER_DENSITY_ROWS   =        50_000   # … above this, bin into a density grid plus extreme points
+SCATTER_BINS           =            80   # density grid cells per axis
+SCATTER_EXTREMES       =           300   # lines kept as points per tail of each measure (Discount, Tax, Net) in density mode
+EXPORT_CHUNK_ROWS      =       200_000   # CSV exports are rendered this many rows at a time
+XLSX_CHUNK_ROWS        =        20_000   # rows materialised at once by the streaming Excel writer
+XLSX_SPOOL_MAX_BYTES   =    64_000_000   # a workbook being written stays in memory up to this, then spills to disk
+EXCEL_MAX_ROWS         =     1_048_576   # Excel's hard sheet limit, header row included
+INGEST_POOL_MIN_BYTES  =     8_000_000   # multi-file ingest below this many bytes parses in-process
+PAGE_SIZES             = [50, 100, 250, 500, 1000]   # rows per page in the paged tables; 100 by default
+CATEGORY_MAX_RATIO     = 0.5             # text columns with distinct/rows ≤ this are stored as categoricals
+PERF_RUNS_KEPT         =            20   # finished span recordings kept per session for the performance panel
+PRICE_MIN_LINES        =             5   # item × UOM groups with fewer priced lines are not scored
+PRICE_Z                =           3.5   # robust z of a rate above its group median that flags it as overpriced
+PRICE_MAD_FLOOR        =          0.01   # MAD is taken as at least this share of the median (fixed-price items)
+PRICE_TOP_LINES        =           500   # flagged lines kept in the ranked table
+METRICS_LOG = os.environ.get("VENDORIQ_METRICS", "")   # JSON-lines file every span is appended to ("" = off)
+STORE_DIR = os.environ.get("VENDORIQ_STORE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendoriq_store")
+
+def _ax(grid=True, **kw):
+    """Axis config. Pass overrides (incl. tickfont) via **kw to avoid duplicate-key TypeError."""
+    base = dict(
+        showgrid=grid, gridcolor=_GRID, zeroline=False,
+        linecolor="rgba(56,189,248,0.08)",
+        tickfont=dict(size=10, color=_TICK),
+    )
+    base.update(kw)
+    return base
+
+
+# ═══════════════════════════════════════════════════════════════
+#  HELPERS
+# ═══════════════════════════════════════════════════════════════
+def fmt_inr(n) -> str:
+    try:
+        n = float(n)
+        if n != n: return "₹0"
+    except (TypeError, ValueError):
+        return "₹0"
+    if   n >= 1_00_00_000: return f"₹{n/1_00_00_000:.2f}Cr"
+    elif n >= 1_00_000:    return f"₹{n/1_00_000:.2f}L"
+    elif n >= 1_000:       return f"₹{n/1_000:.1f}K"
+    else:                  return f"₹{n:,.0f}"
+
+def fmt_inr_full(n) -> str:
+    try:    return f"₹{float(n):,.2f}"
+    except: return "₹0.00"
+
+def _fixed(x: np.ndarray, decimals: int, group: bool = False) -> np.ndarray:
+    """f"{x:,.{decimals}f}" (commas only with group=True) over a non-negative float array. Digits
+    are pulled out arithmetically into a zero-padded (rows × chars) code-point matrix, so the
+    separators sit at fixed columns; leading zeros are stripped at the end. Rounding is Python's:
+    half-even on the exact binary value. x*10**d is itself rounded, so the few products within
+    two ulps of a .5 are settled by formatting those values in Python."""
+    y = x*10**decimals
+    q = np.rint(y)
+    near = np.flatnonzero(np.abs(np.abs(y - np.trunc(y)) - 0.5) <= 2*np.spacing(y))
+    q = q.astype(np.int64)
+    if len(near): q[near] = [int(f"{v:.{decimals}f}".replace(".", "")) for v in x[near]]
+    if not len(q): return q.astype(str)
+    w = max(len(str(q.max())), decimals+1)
+    if group: w += -(w-decimals) % 3
+    ints = w-decimals
+    seps = {i + i//3 - 1: "," for i in range(3, ints, 3)} if group else {}
+    if decimals: seps[ints + len(seps)] = "."
+    width = w + len(seps)
+    chars = np.full((len(q), width), ord("0"), dtype=np.uint32, order="F")   # column writes below
+    for col, ch in seps.items(): chars[:, col] = ord(ch)
+    # low digits first, in 9-digit uint32 halves (int64 division is several times slower)
+    cols = np.setdiff1d(np.arange(width), list(seps))[::-1]
+    for half, cs in ((q % 10**9, cols[:9]), (q // 10**9, cols[9:])):
+        r = half.astype(np.uint32) if half.max() < 2**32 else half
+        for col in cs:
+            if not r.any(): break
+            chars[:, col] += r % 10
+            r //= 10
+    out = np.char.lstrip(np.ascontiguousarray(chars).view(f"U{width}").ravel(), "0,")
+    return np.where(np.char.startswith(out, "."), np.char.add("0", out), out) if decimals else np.where(out == "", "0", out)
+
+FMT_VECTOR_MAX = 1e15   # above this, amounts in paise no longer fit the int64 digit arithmetic
+
+def fmt_inr_array(values, short: bool = False) -> np.ndarray:
+    """Vectorized fmt_inr_full (or fmt_inr with short=True, lakh/crore units) over a whole column;
+    same strings as the scalar versions for every input. The few the digit arithmetic can't
+    take — NaN/non-numeric, ±inf, -0.0 and amounts past FMT_VECTOR_MAX — go through the scalar one."""
+    s = pd.Series(values, copy=False)
+    v = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    odd = ~(np.abs(v) < FMT_VECTOR_MAX) | ((v == 0) & np.signbit(v))
+    if not odd.any(): return _fmt_inr_vec(v, short)
+    out = _fmt_inr_vec(np.where(odd, 0.0, v), short).astype(object)
+    out[odd] = [(fmt_inr if short else fmt_inr_full)(x) for x in s.to_numpy()[odd]]
+    return out.astype(str)
+
+def _fmt_inr_vec(v: np.ndarray, short: bool) -> np.ndarray:
+    a = np.abs(v)
+    if not short: return np.char.add(np.where(v < 0, "₹-", "₹"), _fixed(a, 2, group=True))
+    # like fmt_inr, negatives never take a unit
+    unit  = np.select([v >= 1_00_00_000, v >= 1_00_000, v >= 1_000], [3, 2, 1], 0)
+    parts = [(unit == 0, np.char.add(np.where(v[unit == 0] < 0, "₹-", "₹"), _fixed(a[unit == 0], 0, group=True)))]
+    for u, (div, dec, sfx) in enumerate([(1_000, 1, "K"), (1_00_000, 2, "L"), (1_00_00_000, 2, "Cr")], 1):
+        m = unit == u
+        if m.any(): parts.append((m, np.char.add(np.char.add("₹", _fixed(a[m]/div, dec)), sfx)))
+    out = np.empty(len(v), dtype=f"U{max(p.dtype.itemsize//4 for _, p in parts)}")
+    for m, p in parts: out[m] = p
+    return out
+
+def clean_df(df: pd.DataFrame) -> pd.DataFrame:
+    for c in TEXT_COLS:
+        # categoricals come from compact_df() and are already clean
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].fillna("").astype(str).str.strip().replace({"nan":"","None":"","NaN":""})
+    for c in NUMERIC_COLS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
+    return df
+
+_OBJECT_STR = pd.Series(["x"]).astype(str).dtype == object   # pandas < 3 keeps text as Python objects
+
+def compact_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Canonical compact storage, applied in place: text columns with few distinct values become
+    categoricals, integral numerics take the smallest int dtype. Amounts with paise stay float64 —
+    float32 would make the KPI totals drift."""
+    n = len(df)
+    if not n: return df
+    for c in df.columns:
+        s = df[c]
+        if c in NUMERIC_COLS:
+            if s.dtype == "float64" or pd.api.types.is_integer_dtype(s.dtype):
+                df[c] = pd.to_numeric(s, downcast="integer")
+        elif s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+            if s.nunique(dropna=False) <= CATEGORY_MAX_RATIO*n: df[c] = s.astype("category")
+    return df
+
+def concat_frames(frames) -> pd.DataFrame:
+    """pd.concat that reconciles every frame to the first one's column dtypes: columns categorical
+    there stay categorical (union of categories) instead of falling back to object."""
+    frames = [f for f in frames if len(f)] or list(frames)[:1]
+    if len(frames) < 2: return frames[0].reset_index(drop=True) if frames else pd.DataFrame()
+    base, recast = frames[0], {}
+    for c in base.columns:
+        if isinstance(base[c].dtype, pd.CategoricalDtype):
+            cats = base[c].cat.categories
+            for f in frames[1:]:
+                if c not in f.columns: continue
+                s = f[c]
+                new = s.cat.categories if isinstance(s.dtype, pd.CategoricalDtype) else pd.Index(s.dropna().unique())
+                cats = cats.union(new.astype(cats.dtype)) if len(new.difference(cats)) else cats
+            recast[c] = pd.CategoricalDtype(cats)
+        elif not pd.api.types.is_numeric_dtype(base[c].dtype):
+            recast[c] = base[c].dtype
+    frames = [f.astype({c:t for c,t in recast.items() if c in f.columns and f[c].dtype != t}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column memory of the compact frame vs. the same column as plain strings / float64."""
+    rows = []
+    for c in df.columns:
+        s = df[c]; now = int(s.memory_usage(deep=True, index=False))
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            codes  = s.cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(s.cat.categories))
+            cats   = s.cat.categories.astype(str)
+            # what clean_df's astype(str) would hold: Python objects (pandas < 3) or Arrow utf-8
+            per    = [sys.getsizeof(x)+8 for x in cats] if _OBJECT_STR else [len(x.encode())+4 for x in cats]
+            plain  = int(np.dot(counts, per))
+        elif pd.api.types.is_numeric_dtype(s.dtype):
+            plain = 8*len(s)
+        else:
+            plain = now
+        rows.append(dict(Column=c, Dtype=str(s.dtype), Bytes=now, Plain=plain, Saved=plain-now))
+    return pd.DataFrame(rows)
+
+DATE_FORMATS = ["%d/%m/%Y","%d-%m-%Y","%d.%m.%Y","%d/%m/%y","%d-%b-%Y","%d-%b-%y",
+                "%Y-%m-%d","%Y-%m-%d %H:%M:%S","%d/%m/%Y %H:%M:%S","%m/%d/%Y"]
+
+def _infer_date_format(values: pd.Index):
+    """One strptime format that parses a sample of the column, or None (mixed formats)."""
+    sample = values[values != ""][:500]
+    if not len(sample): return None
+    guess = pd.tseries.api.guess_datetime_format(sample[0], dayfirst=True)
+    for fmt in dict.fromkeys([*DATE_FORMATS, guess]):
+        if fmt and pd.to_datetime(sample, format=fmt, errors="coerce").notna().all(): return fmt
+    return None
+
+def parse_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """Add datetime64 companions of the DATE_COLS display strings, in place.
+    Only distinct values are parsed, with the format inferred once per column."""
+    for src, dst in DATE_COLS.items():
+        if src not in df.columns: continue
+        codes, uniques = pd.factorize(df[src], use_na_sentinel=True)
+        uniques = pd.Index(uniques).astype(str)
+        fmt = _infer_date_format(uniques)
+        if fmt: parsed = pd.to_datetime(uniques, format=fmt, errors="coerce")
+        else:   parsed = pd.to_datetime(uniques, dayfirst=True, format="mixed", errors="coerce")
+        df[dst] = pd.DatetimeIndex(parsed).take(codes, allow_fill=True, fill_value=pd.NaT)
+    return df
+
+class DateIndex:
+    """Row positions ordered by a datetime column, so a date-range lookup is two binary searches."""
+    def __init__(self, dt: pd.Series):
+        v = dt.to_numpy(dtype="datetime64[ns]")
+        pos = np.flatnonzero(~np.isnat(v))
+        order = np.argsort(v[pos], kind="stable")
+        self.rows, self.values, self.n = pos[order], v[pos][order], len(v)
+
+    def __len__(self): return len(self.values)
+
+    @property
+    def min(self): return pd.Timestamp(self.values[0]).date()
+    @property
+    def max(self): return pd.Timestamp(self.values[-1]).date()
+
+    def positions(self, start, end) -> np.ndarray:
+        """Row positions with start ≤ date ≤ end (whole days)."""
+        lo = np.searchsorted(self.values, np.datetime64(pd.Timestamp(start), "ns"), "left")
+        hi = np.searchsorted(self.values, np.datetime64(pd.Timestamp(end)+pd.Timedelta(days=1), "ns"), "left")
+        return self.rows[lo:hi]
+
+    def mask(self, start, end) -> np.ndarray:
+        m = np.zeros(self.n, dtype=bool); m[self.positions(start, end)] = True
+        return m
+
+    def extend(self, dt: pd.Series) -> "DateIndex":
+        """Index for these rows followed by `dt`'s rows: sorts only the new batch and merges it in."""
+        new = DateIndex(dt)
+        at  = np.searchsorted(self.values, new.values, "right")
+        out = DateIndex.__new__(DateIndex)
+        out.values = np.insert(self.values, at, new.values)
+        out.rows   = np.insert(self.rows, at, new.rows + self.n)
+        out.n      = self.n + new.n
+        return out
+
+def _ranges(starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(s, s+l) for each (s, l), without a Python loop."""
+    total = int(lens.sum())
+    if not total: return np.zeros(0, dtype=np.int64)
+    shift = starts - np.concatenate(([0], np.cumsum(lens)[:-1]))
+    return np.repeat(shift, lens) + np.arange(total)
+
+def _csr(keys: np.ndarray, vals: np.ndarray, nkeys: int):
+    """Group vals by integer key → (vals ordered by key, offsets of length nkeys+1)."""
+    order = np.argsort(keys, kind="stable")
+    off = np.zeros(nkeys+1, dtype=np.int64); off[1:] = np.cumsum(np.bincount(keys, minlength=nkeys))
+    return vals[order], off
+
+class SearchIndex:
+    """Trigram index over the distinct lowercased values of the searchable columns.
+    A query is matched against distinct values — trigram candidates, then an exact substring
+    check — and mapped to rows through per-column posting lists, so its cost follows the number
+    of matches, not rows. A query that extends an earlier one only re-checks that one's matches."""
+    def __init__(self, df: pd.DataFrame, cols=SEARCH_COLS):
+        self.cols    = [c for c in cols if c in df.columns]
+        self.n       = 0
+        self.version = None
+        self.vocab   = pd.Index([], dtype=str)                # vid → lowercased value
+        self.grams   = pd.Index([], dtype=str)                # gid → trigram
+        self._gram   = (np.zeros(0, np.int32), np.zeros(1, np.int64))                      # vids by gid
+        self._post   = {c:(np.zeros(0, np.int32), np.zeros(1, np.int64)) for c in self.cols}  # rows by vid
+        self._recent = OrderedDict()                          # query → matching vids
+        self.extend(df)
+
+    def extend(self, batch: pd.DataFrame):
+        """Index rows appended after the ones already indexed."""
+        per_col = {}
+        for c in self.cols:
+            codes, uniq = pd.factorize(batch[c])
+            per_col[c] = (codes, pd.Index(uniq).astype(str).str.lower())
+        seen = pd.Index(pd.unique(np.concatenate([low.to_numpy() for _,low in per_col.values()]))) if per_col else self.vocab
+        fresh = seen[(seen != "") & (self.vocab.get_indexer(seen) < 0)]
+        if len(fresh):
+            base = len(self.vocab); self.vocab = self.vocab.append(fresh)
+            self._add_grams(fresh, base)
+        V = len(self.vocab)
+        for c,(codes,low) in per_col.items():
+            vid = np.append(self.vocab.get_indexer(low), -1)[codes]       # code -1 (NaN) → -1
+            ok  = np.flatnonzero(vid >= 0)
+            rows, off = self._post[c]
+            old = np.repeat(np.arange(len(off)-1, dtype=np.int32), np.diff(off))
+            # existing postings are already grouped by vid, so the stable sort is a linear merge
+            self._post[c] = _csr(np.concatenate([old, vid[ok].astype(np.int32)]),
+                                 np.concatenate([rows, (ok + self.n).astype(np.int32)]), V)
+        self.n += len(batch); self._recent.clear()
+        return self
+
+    def _add_grams(self, fresh: pd.Index, base: int):
+        s = pd.Series(fresh.to_numpy(), dtype=str)
+        lens = s.str.len().to_numpy()
+        gids, vids = [], []
+        for k in range(int(lens.max(initial=0)) - 2):
+            sel = np.flatnonzero(lens >= k+3)
+            codes, uniq = pd.factorize(s.iloc[sel].str.slice(k, k+3))
+            uniq = pd.Index(uniq)
+            new = uniq[self.grams.get_indexer(uniq) < 0]
+            if len(new): self.grams = self.grams.append(new)
+            gids.append(self.grams.get_indexer(uniq)[codes]); vids.append(sel + base)
+        if not gids: return
+        old_v, off = self._gram
+        old_g = np.repeat(np.arange(len(off)-1), np.diff(off))
+        self._gram = _csr(np.concatenate([old_g, *gids]), np.concatenate([old_v, *vids]).astype(np.int32), len(self.grams))
+
+    def _match_values(self, q: str) -> np.ndarray:
+        prev = max((p for p in self._recent if p in q), key=len, default=None)
+        if prev is not None:
+            cand = self._recent[prev]
+        elif len(q) >= 3:
+            gids = self.grams.get_indexer(list({q[i:i+3] for i in range(len(q)-2)}))
+            if (gids < 0).any(): cand = np.zeros(0, np.int32)
+            else:
+                vids, off = self._gram
+                lists = sorted((vids[off[g]:off[g+1]] for g in gids), key=len)
+                cand = np.unique(lists[0])
+                for l in lists[1:]:
+                    if len(l) > 8*len(cand): break        # cheaper to verify than to intersect
+                    cand = np.intersect1d(cand, l)
+        else:
+            cand = np.arange(len(self.vocab))
+        hit = cand[np.asarray(self.vocab[cand].str.contains(q, regex=False), dtype=bool)] if len(cand) else cand
+        self._recent[q] = hit
+        if len(self._recent) > 16: self._recent.popitem(last=False)
+        return hit
+
+    def mask(self, q: str, cols=None) -> np.ndarray:
+        """Boolean row mask: any of `cols` contains q (case-insensitive, literal — not a regex)."""
+        vids = self._match_values(q.strip().lower())
+        m = np.zeros(self.n, dtype=bool)
+        for c in (cols or self.cols):
+            if c not in self._post: continue
+            rows, off = self._post[c]
+            m[rows[_ranges(off[vids], off[vids+1]-off[vids])]] = True
+        return m
+
+class FilterEngine:
+    """Boolean masks per filter predicate, cached on (df_version, predicate, value) and ANDed
+    together — changing one filter reuses every other predicate's mask. Rows are taken from
+    the dataset once, at the end, and not at all when no predicate is active."""
+    def __init__(self, max_bytes: int = MASK_CACHE_MAX_BYTES):
+        self.cache = LRUCache(max_bytes)
+
+    def mask(self, version, name, value, build) -> np.ndarray:
+        key = (version, name, value)
+        m = self.cache.get(key)
+        if m is None: m = self.cache.put(key, np.asarray(build(), dtype=bool))
+        return m
+
+    def rows(self, version, preds):
+        """Positions passing every active predicate — preds are (name, value, build) with a
+        falsy value meaning inactive. None when nothing is active (keep every row)."""
+        masks = [self.mask(version, name, value, build) for name, value, build in preds if value]
+        if not masks: return None
+        return np.flatnonzero(np.logical_and.reduce(masks) if len(masks) > 1 else masks[0])
+
+def _cat_contains(s: pd.Series, q: str) -> np.ndarray:
+    """Case-insensitive literal contains, evaluated once per category for categoricals."""
+    q = q.strip().lower()
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        hit = np.append(s.cat.categories.astype(str).str.lower().str.contains(q, regex=False), False)
+        return hit[s.cat.codes.to_numpy()]
+    return s.astype(str).str.lower().str.contains(q, regex=False).to_numpy()
+
+def _rollup(d: pd.DataFrame) -> pd.DataFrame:
+    return (d.groupby(CUBE_DIMS, observed=True, dropna=False, sort=False)[CUBE_MEASURES]
+             .sum().reset_index())
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """Spend rollup at Supplier × Item Description × UOM × PO month grain. Measures keep their
+    row names (plus _lines and _rate_sum for counts and Avg_Rate), so the chart builders and
+    vendor_summary() read cube cells exactly like PO rows."""
+    month = df["_po_dt"].dt.to_period("M") if "_po_dt" in df.columns else pd.Series(pd.NaT, index=df.index, dtype="period[M]")
+    d = df[["Supplier","Item Description","UOM","Net","Material","Tax","Discount","Freight","Others","Quantity"]]
+    return _rollup(d.assign(_month=month, _lines=1, _rate_sum=df["Rate"]))
+
+def extend_cube(cube: pd.DataFrame, batch: pd.DataFrame) -> pd.DataFrame:
+    """Cube after appending `batch`: only the batch is aggregated, then merged cell-wise."""
+    return merge_cubes([cube, build_cube(batch)])
+
+def merge_cubes(cubes) -> pd.DataFrame:
+    """One cube from cubes built over separate row sets (e.g. one per file)."""
+    return _rollup(concat_frames(list(cubes)))
+
+def _whole_months(start, end) -> bool:
+    return pd.Timestamp(start).day == 1 and (pd.Timestamp(end) + pd.Timedelta(days=1)).day == 1
+
+def cube_view(cube: pd.DataFrame, dates=None, suppliers=(), item="") -> pd.DataFrame:
+    """Cube cells matching filters that push down to its dimensions (dates must be whole months)."""
+    m = np.ones(len(cube), dtype=bool)
+    if dates:     m &= cube["_month"].between(pd.Period(dates[0], "M"), pd.Period(dates[1], "M")).to_numpy()
+    if suppliers: m &= cube["Supplier"].isin(suppliers).to_numpy()
+    if item:      m &= _cat_contains(cube["Item Description"], item)
+    return cube if m.all() else cube[m]
+
+def vendor_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-supplier totals, from PO rows or from spend-cube cells."""
+    if "_lines" in df.columns:
+        vs = df.groupby("Supplier", observed=True).agg(
+                 Records=("_lines","sum"),Total_Net=("Net","sum"),
+                 Total_Material=("Material","sum"),Total_Tax=("Tax","sum"),
+                 Total_Discount=("Discount","sum"),Total_Freight=("Freight","sum"),
+                 _rate_sum=("_rate_sum","sum"))
+        vs["Avg_Rate"] = vs.pop("_rate_sum")/vs["Records"]
+    else:
+        vs = df.groupby("Supplier", observed=True).agg(
+                 Records=("Net","count"),Total_Net=("Net","sum"),
+                 Total_Material=("Material","sum"),Total_Tax=("Tax","sum"),
+                 Total_Discount=("Discount","sum"),Total_Freight=("Freight","sum"),
+                 Avg_Rate=("Rate","mean"))
+    vs = vs.reset_index().sort_values("Total_Net",ascending=False)
+    vs["Share_%"]=(vs["Total_Net"]/vs["Total_Net"].sum()*100).round(1)
+    return vs
+
+def month_of(df: pd.DataFrame) -> pd.Series:
+    """PO month per row (period[M], NaT when unknown), from PO rows or from spend-cube cells."""
+    if "_month" in df.columns: return df["_month"]
+    if "_po_dt" in df.columns: return df["_po_dt"].dt.to_period("M")
+    return pd.to_datetime(df["PO Dt"], dayfirst=True, errors="coerce").dt.to_period("M")
+
+def monthly_trend(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-PO-month totals, from PO rows or from spend-cube cells."""
+    month = month_of(df); ok = month.notna().to_numpy()
+    d = df.loc[ok, ["Net","Material","Tax","Discount","Freight"]]
+    d.insert(0, "Records", df.loc[ok,"_lines"] if "_lines" in df.columns else 1)
+    g = d.groupby(month[ok]).sum()
+    return g.set_axis(g.index.astype(str).rename("Month")).reset_index()
+
+def item_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Per Item Description × UOM totals, from PO rows or from spend-cube cells."""
+    keys = ["Item Description","UOM"]
+    if "_lines" in df.columns:
+        g = df.groupby(keys, observed=True).agg(Records=("_lines","sum"),Quantity=("Quantity","sum"),
+                Net=("Net","sum"),Material=("Material","sum"),Tax=("Tax","sum"),_rate_sum=("_rate_sum","sum"))
+        g["Avg_Rate"] = g.pop("_rate_sum")/g["Records"]
+    else:
+        g = df.groupby(keys, observed=True).agg(Records=("Net","count"),Quantity=("Quantity","sum"),
+                Net=("Net","sum"),Material=("Material","sum"),Tax=("Tax","sum"),Avg_Rate=("Rate","mean"))
+    return g.reset_index().sort_values("Net",ascending=False)
+
+def public_cols(df: pd.DataFrame) -> list:
+    """Columns meant for display/export — hidden helper columns start with '_'."""
+    return [c for c in df.columns if not str(c).startswith("_")]
+
+def sort_order(df: pd.DataFrame, col: str, ascending: bool = True) -> np.ndarray:
+    """Row positions of df in sort_values(col) order (stable, missing last), int32 when it fits.
+    Needs the RangeIndex set_dataset() guarantees."""
+    if col not in df.columns: return np.arange(len(df), dtype=np.int32)
+    pos = df[col].sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+    return pos.astype(np.int32) if len(df) < 2**31 else pos
+
+def ordered_rows(order: np.ndarray, rows, n: int) -> np.ndarray:
+    """The positions in `rows` (None = all n rows) arranged in `order` — one O(n) pass over a
+    precomputed order instead of a sort per filter state."""
+    if rows is None: return order
+    keep = np.zeros(n, dtype=bool); keep[rows] = True
+    return order[keep[order]]
+
+def safe_sort(series: pd.Series) -> list:
+    if isinstance(series.dtype, pd.CategoricalDtype):      # present categories, not every row
+        codes = series.cat.codes.to_numpy()
+        present = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)) > 0
+        series = pd.Series(series.cat.categories[present])
+    return sorted(series.dropna().astype(str).replace("", pd.NA).dropna().unique().tolist())
+
+def make_template_csv() -> bytes:
+    header = ",".join(COLS) + "\n"
+    row = "01/04/2024,PO-00001,Vendor Name,ITM-001,72071190,Item Description,28/03/2024,IN-00001,NOS,10,5000,50000,0,500,8910,1500,250,60160\n"
+    return (header + row).encode()
+
+
+# ═══════════════════════════════════════════════════════════════
+#  BOUNDED LRU CACHE
+# ═══════════════════════════════════════════════════════════════
+def _nbytes(obj) -> int:
+    if isinstance(obj, pd.DataFrame): return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)): return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray): return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, memoryview)): return len(obj)
+    return sys.getsizeof(obj)
+
+def _nbytes_all(obj) -> int:
+    return sum(map(_nbytes, obj)) if isinstance(obj, tuple) else _nbytes(obj)
+
+def _held_bytes(obj) -> int:
+    """Bytes of the frames/arrays held by obj — through tuples, dicts and plain objects'
+    attributes (indexes, cubes, engines); an LRUCache counts its tracked bytes."""
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index, np.ndarray, bytes)): return _nbytes(obj)
+    if isinstance(obj, LRUCache): return obj.bytes
+    if isinstance(obj, (tuple, list)): return sum(map(_held_bytes, obj))
+    if isinstance(obj, dict): return sum(map(_held_bytes, obj.values()))
+    if hasattr(obj, "__dict__"): return _held_bytes(vars(obj))
+    return 0
+
+class LRUCache:
+    """Thread-safe LRU map bounded by total byte size, with hit/miss counters."""
+    def __init__(self, max_bytes: int, sizeof=_nbytes):
+        self.max_bytes = max_bytes
+        self._sizeof   = sizeof
+        self._data     = OrderedDict()   # key -> (value, nbytes)
+        self._lock     = threading.Lock()
+        self.bytes = self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1; return default
+            self._data.move_to_end(key); self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        n = self._sizeof(value)
+        with self._lock:
+            if key in self._data: self.bytes -= self._data.pop(key)[1]
+            if n > self.max_bytes: return value          # would evict everything — don't keep it
+            self._data[key] = (value, n); self.bytes += n
+            while self.bytes > self.max_bytes:
+                _,(_,old) = self._data.popitem(last=False)
+                self.bytes -= old; self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear(); self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(entries=len(self._data), bytes=self.bytes, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        hit_rate=self.hits/lookups if lookups else 0.0)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  PHASE SPANS  — opt-in timing of parse / filter / chart / export
+# ═══════════════════════════════════════════════════════════════
+_span_local   = threading.local()    # .rec: the SpanRecorder active on this thread
+_trace_lock   = threading.Lock()
+_trace        = dict(users=0, ours=False)   # recorders needing tracemalloc; whether we started it
+_metrics_lock = threading.Lock()
+
+def _peak_rss_mb():
+    if resource is None: return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss     # bytes on macOS
+    return round(kb / (1e6 if sys.platform == "darwin" else 1e3), 1)
+
+class _NoSpan:
+    """What span() returns while no recorder is active: a shared do-nothing context."""
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def note(self, **info): pass
+
+_NO_SPAN = _NoSpan()
+
+class Span:
+    """One timed phase of a SpanRecorder. `info` (rows_in, rows_out, anything else) is copied into
+    the record; note() adds to it from inside the block."""
+    __slots__ = ("rec", "name", "info", "t0", "mem0", "peak_seen", "outer_peak")
+    def __init__(self, rec, name: str, info: dict):
+        self.rec, self.name, self.info = rec, name, info
+
+    def note(self, **info): self.info.update(info)
+
+    def __enter__(self):
+        rec = self.rec
+        if rec.memory:
+            # the traced peak is process-wide: restart it here and hand the outer span's peak so
+            # far back to it on exit, so nested spans each see their own
+            self.mem0, self.outer_peak = tracemalloc.get_traced_memory()
+            self.peak_seen = 0; tracemalloc.reset_peak()
+        rec._stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1, rec = time.perf_counter(), self.rec
+        rec._stack.pop()
+        row = dict(span=self.name, depth=len(rec._stack), at_ms=round((self.t0-rec.t0)*1e3, 2),
+                   ms=round((t1-self.t0)*1e3, 3), rows_in=None, rows_out=None)
+        row.update(self.info)
+        if rec.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.peak_seen)
+            row["peak_mb"] = round((peak-self.mem0)/1e6, 2)
+            if rec._stack: rec._stack[-1].peak_seen = max(rec._stack[-1].peak_seen, self.outer_peak, peak)
+        row["rss_mb"] = _peak_rss_mb()
+        if exc_type is not None: row["error"] = exc_type.__name__
+        rec.spans.append(row)
+        return False
+
+class SpanRecorder:
+    """Phase timings of one run — a portal rerun, a deferred export, a batch file. While started
+    it is the active recorder of its thread, and every span() block on that thread records wall
+    time, rows in/out, the process's peak RSS and, with memory=True, the peak of traced Python
+    allocations above the span's start. Tracing is process-wide (other sessions' allocations are
+    counted too) and slows allocation-heavy code, so it is separate from plain timing."""
+    def __init__(self, run: str, memory: bool = False, **tags):
+        self.run, self.memory, self.tags = run, memory, tags
+        self.spans, self._stack = [], []
+        self.started, self.t0, self.seconds = None, None, None
+
+    def start(self) -> "SpanRecorder":
+        if self.memory:
+            with _trace_lock:
+                if not tracemalloc.is_tracing(): tracemalloc.start(); _trace["ours"] = True
+                _trace["users"] += 1
+        self.started, self.t0 = datetime.now(), time.perf_counter()
+        _span_local.rec = self
+        return self
+
+    def stop(self) -> "SpanRecorder":
+        if getattr(_span_local, "rec", None) is self: _span_local.rec = None
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.t0
+            if self.memory:
+                with _trace_lock:
+                    _trace["users"] -= 1
+                    if not _trace["users"] and _trace["ours"]: tracemalloc.stop(); _trace["ours"] = False
+        return self
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop(); return False
+
+    def table(self) -> pd.DataFrame:
+        """Spans in start order, names indented by nesting depth."""
+        t = pd.DataFrame(sorted(self.spans, key=itemgetter("at_ms")))
+        if t.empty: return t
+        t["span"] = ["  "*d + n for d, n in zip(t.pop("depth"), t["span"])]
+        return t.astype({"rows_in": "Int64", "rows_out": "Int64"})
+
+    def write(self, path: str):
+        """Append one JSON line per span (with run, start time and tags) to `path`."""
+        head = dict(ts=self.started.isoformat(timespec="milliseconds"), run=self.run,
+                    run_ms=round((self.seconds or 0)*1e3, 2), pid=os.getpid(), **self.tags)
+        lines = "".join(json.dumps({**head, **r}, default=str) + "\n" for r in self.spans)
+        with _metrics_lock, open(path, "a", encoding="utf-8") as fh: fh.write(lines)
+
+def span(name: str, **info):
+    """`with span("parse", rows_in=n) as s: …; s.note(rows_out=m)` — timed on this thread's
+    active SpanRecorder, or a shared no-op (one attribute lookup) when none is."""
+    rec = getattr(_span_local, "rec", None)
+    return _NO_SPAN if rec is None else Span(rec, name, info)
+
+def active_spans():
+    """The SpanRecorder active on this thread, or None."""
+    return getattr(_span_local, "rec", None)
+
+def stop_spans():
+    """Detach whatever recorder is active on this thread (one left over by an aborted run)."""
+    _span_local.rec = None
+
+@contextmanager
+def traced_peak():
+    """Yields a dict whose "peak_mb" is set on exit to the block's peak traced allocation (None
+    unless tracemalloc is tracing). Like a Span, it hands the outer peak back to the enclosing span."""
+    out = {"peak_mb": None}
+    if not tracemalloc.is_tracing(): yield out; return
+    mem0, outer = tracemalloc.get_traced_memory(); tracemalloc.reset_peak()
+    try: yield out
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        out["peak_mb"] = round((peak-mem0)/1e6, 2)
+        rec = active_spans()
+        if rec is not None and rec.memory and rec._stack: rec._stack[-1].peak_seen = max(rec._stack[-1].peak_seen, outer, peak)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  SHARED DATASET REGISTRY
+# ═══════════════════════════════════════════════════════════════
+class DatasetRef:
+    """A session's handle on a registry dataset. Dropping the last reference to the handle
+    (dataset replaced, session gone) releases it in the registry."""
+    __slots__ = ("key", "df", "date_index", "__weakref__")
+    def __init__(self, key, df, date_index):
+        self.key, self.df, self.date_index = key, df, date_index
+
+class DatasetRegistry:
+    """Process-wide, content-addressed datasets: sessions that load the same data share one
+    frame (and its DateIndex) instead of holding a copy each. Entries count live DatasetRefs;
+    past max_bytes the least recently used unreferenced entries are evicted, and a dataset that
+    still would not fit is refused with MemoryBudgetError. Frames are shared read-only."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._sets     = OrderedDict()   # key -> {"df", "date_index", "bytes", "refs"}
+        self._lock     = threading.Lock()
+        self.bytes = self.evictions = 0
+
+    def acquire(self, key, build) -> DatasetRef:
+        """Handle on dataset `key`; build() → (df, date_index) runs only when the key is new.
+        Lookup, insert and the ref count happen under one lock hold, so an entry can't be evicted
+        between being found and being counted; only build() runs unlocked."""
+        with self._lock:
+            e = self._take(key)
+        if e is None:
+            df, date_index = build()
+            n = _nbytes(df) + _held_bytes(date_index)
+            with self._lock:
+                e = self._take(key)                # another session may have registered it meanwhile
+                if e is None:
+                    self._evict(self.max_bytes - n)
+                    if self.bytes + n > self.max_bytes:
+                        raise MemoryBudgetError(f"{n/1e6:,.0f} MB needed, {(self.max_bytes-self.bytes)/1e6:,.0f} MB free "
+                                                f"with {len(self._sets)} dataset(s) in use")
+                    e = self._sets[key] = dict(df=df, date_index=date_index, bytes=n, refs=1)
+                    self.bytes += n
+        ref = DatasetRef(key, e["df"], e["date_index"])
+        weakref.finalize(ref, self._release, key)
+        return ref
+
+    def _take(self, key):
+        """Entry `key` with one more ref and marked most recently used, or None (lock held)."""
+        e = self._sets.get(key)
+        if e is not None: e["refs"] += 1; self._sets.move_to_end(key)
+        return e
+
+    def _release(self, key):
+        with self._lock:
+            e = self._sets.get(key)
+            if e is not None: e["refs"] -= 1
+            self._evict(self.max_bytes)
+
+    def _evict(self, limit: int):
+        """Drop unreferenced entries, least recently used first, until bytes ≤ limit (lock held)."""
+        for key in [k for k, e in self._sets.items() if e["refs"] <= 0]:
+            if self.bytes <= limit: break
+            self.bytes -= self._sets.pop(key)["bytes"]; self.evictions += 1
+
+    def report(self) -> pd.DataFrame:
+        """One row per held dataset: key, rows, bytes and the number of sessions using it."""
+        with self._lock:
+            rows = [(k, len(e["df"]), e["bytes"], e["refs"]) for k, e in reversed(self._sets.items())]
+        return pd.DataFrame(rows, columns=["Dataset","Rows","Bytes","Sessions"])
+
+
+# ═══════════════════════════════════════════════════════════════
+#  SAMPLE DATA
+# ═══════════════════════════════════════════════════════════════
+def load_sample() -> pd.DataFrame:
+    import random
+    random.seed(42)
+    suppliers = ["Tata Steel Ltd","Reliance Industries","Mahindra Logistics",
+                 "Bosch India Pvt Ltd","Siemens Ltd","L&T Engineering",
+                 "BHEL Corporation","Wipro Infrastructure","HCL Manufacturing","Infosys Supply"]
+    items     = ["Cold Rolled Sheets","Hot Rolled Coils","Stainless Steel Pipes",
+                 "Aluminium Extrusions","Copper Cables","PVC Conduits",
+                 "MS Angles","GI Sheets","Carbon Steel Rods","Mild Steel Plates"]
+    hsns = ["7209","7208","7306","7601","8544","3917","7216","7210","7213","7211"]
+    uoms = ["MT","NOS","KG","MTR","SET","BOX","PCS","LTR","RLL","CTN"]
+    rows = []
+    for i in range(150):
+        si=random.randint(0,9); ii=random.randint(0,9)
+        qty=random.randint(10,500); rate=random.randint(200,6000)
+        mat=qty*rate; tax=round(mat*0.18,2); disc=round(mat*0.03,2)
+        frgt=random.randint(500,6000); oth=random.randint(100,1500)
+        net=round(mat+tax-disc+frgt+oth,2)
+        d=random.randint(1,28); m=random.randint(1,12); y=random.choice([2023,2024])
+        rows.append({
+            "PO Dt":f"{d:02d}/{m:02d}/{y}","PO No":f"PO-{2000+i:05d}",
+            "Supplier":suppliers[si],"Item":f"ITM-{1000+ii:04d}",
+            "HSN No":hsns[ii],"Item Description":items[ii],
+            "Indent Dt":f"{d:02d}/{m:02d}/{y}","Indent No":f"IN-{3000+i:05d}",
+            "UOM":uoms[random.randint(0,9)],
+            "Quantity":qty,"Rate":rate,"Material":mat,"Excise":0,
+            "Discount":disc,"Tax":tax,"Freight":frgt,"Others":oth,"Net":net,
+        })
+    return parse_dates(compact_df(clean_df(pd.DataFrame(rows))))
+
+_SYN_FIRMS  = ["Tata","Reliance","Mahindra","Bosch","Siemens","Larsen","BHEL","Wipro","Jindal","Godrej",
+               "Kirloskar","Thermax","Bharat","Hindalco","Vedanta","Ashok","Adani","Birla","Essar","Polycab"]
+_SYN_TRADES = ["Steel","Industries","Logistics","Engineering","Infra","Metals","Cables","Polymers","Supply","Traders"]
+_SYN_FORMS  = ["Ltd","Pvt Ltd","Corporation","& Co","LLP"]
+_SYN_GOODS  = ["Cold Rolled Sheets","Hot Rolled Coils","Stainless Steel Pipes","Aluminium Extrusions","Copper Cables",
+               "PVC Conduits","MS Angles","GI Sheets","Carbon Steel Rods","Mild Steel Plates","Hex Bolts","Gate Valves",
+               "Ball Bearings","Welding Electrodes","Hydraulic Hoses","Paint Primer","Gaskets","Cable Trays"]
+_SYN_UOMS   = ["MT","NOS","KG","MTR","SET","BOX","PCS","LTR","RLL","CTN"]
+_SYN_GST    = np.array([0.05, 0.12, 0.18, 0.18, 0.18, 0.28])
+
+def _id_labels(prefix: str, ids: np.ndarray, width: int) -> np.ndarray:
+    """prefix + zero-padded ids as a fixed-width str array, built as one code-point matrix."""
+    ids = np.asarray(ids, dtype=np.int64)
+    p = np.frombuffer(prefix.encode("utf-32-le"), dtype=np.uint32)
+    m = np.empty((len(ids), len(p)+width), dtype=np.uint32)
+    m[:, :len(p)] = p
+    for k in range(len(p)+width-1, len(p)-1, -1):
+        m[:, k] = ids % 10 + 48; ids = ids // 10
+    return m.view(f"<U{len(p)+width}").ravel()
+
+def _names(parts: list, k: int) -> list:
+    """k distinct names from the cross product of word lists (numbered once it is exhausted)."""
+    sizes = [len(p) for p in parts]; total = int(np.prod(sizes))
+    out = []
+    for i in range(k):
+        j, words = i % total, []
+        for p, sz in zip(parts, sizes): words.append(p[j % sz]); j //= sz
+        out.append(" ".join(words) + (f" {i // total + 1}" if i >= total else ""))
+    return out
+
+def synthetic_po(rows: int, suppliers: int = 60, items: int = 500, start="2020-04-01", end="2025-03-31",
+                 seed: int = 0, outliers: float = 0.002) -> pd.DataFrame:
+    """Vectorised synthetic PO lines in the COLS schema, cleaned and compact like parse_file() output.
+    POs of 1–5 lines are numbered in date order; supplier and item popularity is skewed (Zipf-like);
+    each item has a base rate, UOM and HSN, each supplier a price level, and an `outliers` share of
+    lines is priced 1.8–4× too high."""
+    rng, n = np.random.default_rng(seed), int(rows)
+    days = pd.date_range(start, end, freq="D")
+    day_txt = days.strftime("%d/%m/%Y").to_numpy(dtype=str)
+    po = np.repeat(np.arange(n//2 + 1), rng.integers(1, 6, n//2 + 1))[:n]
+    n_po = int(po[-1]) + 1 if n else 0
+    zipf = lambda k: (w := 1/np.arange(1, k+1)**0.8) / w.sum()
+    po_day = np.sort(rng.integers(0, len(days), n_po))
+    po_sup = rng.choice(suppliers, n_po, p=zipf(suppliers))
+    ind_day = np.maximum(po_day - rng.integers(1, 31, n_po), 0)
+    item = rng.choice(items, n, p=zipf(items))
+    base = np.round(rng.lognormal(np.log(400), 1.1, items), 2)
+    level = rng.normal(1.0, 0.06, suppliers).clip(0.8, 1.25)
+    sup = po_sup[po]
+    rate = base[item] * level[sup] * rng.lognormal(0, 0.08, n)
+    spike = rng.random(n) < outliers
+    rate[spike] *= rng.uniform(1.8, 4.0, int(spike.sum()))
+    rate = np.round(rate, 2)
+    qty  = rng.integers(1, 500, n, dtype=np.int16)
+    mat  = np.round(qty * rate, 2)
+    disc = np.round(mat * rng.choice([0, 0, 0.02, 0.03, 0.05], n), 2)
+    tax  = np.round((mat - disc) * _SYN_GST[rng.integers(0, len(_SYN_GST), items)][item], 2)
+    frgt = rng.integers(0, 4, n, dtype=np.int16) * rng.integers(200, 2500, n, dtype=np.int16)
+    oth  = np.where(rng.random(n) < 0.1, rng.integers(100, 1500, n, dtype=np.int16), np.int16(0))
+    cat  = pd.Categorical.from_codes
+    hsn_codes = rng.integers(0, 60, items)
+    df = pd.DataFrame({
+        "PO Dt":            cat(po_day[po], day_txt),
+        "PO No":            cat(po, _id_labels("PO-", np.arange(n_po), 8)),
+        "Supplier":         cat(sup, _names([_SYN_FIRMS, _SYN_TRADES, _SYN_FORMS], suppliers)),
+        "Item":             cat(item, _id_labels("ITM-", np.arange(items), 5)),
+        "HSN No":           cat(hsn_codes[item], _id_labels("", 7200 + np.arange(60), 4)),
+        "Item Description": cat(item, _names([_SYN_GOODS, [f"Gr-{g}" for g in range(1, 21)]], items)),
+        "Indent Dt":        cat(ind_day[po], day_txt),
+        "Indent No":        cat(po, _id_labels("IND-", np.arange(n_po), 8)),
+        "UOM":              cat(rng.integers(0, len(_SYN_UOMS), items)[item], _SYN_UOMS),
+        "Quantity": qty, "Rate": rate, "Material": mat, "Excise": np.zeros(n, dtype=np.int8),
+        "Discount": disc, "Tax": tax, "Freight": frgt, "Others": oth,
+        "Net": np.round(mat - disc + tax + frgt + oth, 2),
+    })
+    return parse_dates(df)   # built in compact_df()'s dtypes already
+
+
+# ═══════════════════════════════════════════════════════════════
+#  FILE PARSER
+# ═══════════════════════════════════════════════════════════════
+ALIASES = {
+    "PO Dt":           ["po_dt","po_date","po date","order_date","date","inv_date"],
+    "PO No":           ["po_no","po","po_number","purchase_order","order_no","voucher_no","po no"],
+    "Supplier":        ["supplier","vendor","vendor_name","company","party","firm"],
+    "Item":            ["item","item_code","item_no","item code","part_no","part","sku","material_code"],
+    "HSN No":          ["hsn_no","hsn","hsn_code","hsn no","sac","sac_code"],
+    "Item Description":["item_description","item description","description","material","goods","desc","product"],
+    "Indent Dt":       ["indent_dt","indent_date","indent date","req_date","requisition_date"],
+    "Indent No":       ["indent_no","indent","indent_number","indent no","req_no","requisition_no"],
+    "UOM":             ["uom","unit","unit_of_measure","unit of measure","units"],
+    "Quantity":        ["quantity","qty","count","nos"],
+    "Rate":            ["rate","unit_price","price","unit_rate","unit price"],
+    "Material":        ["material","material_value","basic","basic_amount","material value"],
+    "Excise":          ["excise","excise_duty","ced","bed"],
+    "Discount":        ["discount","disc","rebate"],
+    "Tax":             ["tax","gst","vat","igst","cgst","sgst","taxes"],
+    "Freight":         ["freight","shipping","transport","delivery"],
+    "Others":          ["others","other","miscellaneous","misc","charges"],
+    "Net":             ["net","net_amount","total","amount","net amount","line_total","net_value"],
+}
+
+class MemoryBudgetError(MemoryError):
+    """A streamed parse would hold more than its configured memory budget."""
+
+def _alias_map(columns) -> dict:
+    """Source column → canonical COLS name. The canonical name itself matches first,
+    then ALIASES in order."""
+    lc = {c.lower().strip(): c for c in columns}
+    rmap = {}
+    for target, aliases in ALIASES.items():
+        for a in [target.lower(), *aliases]:
+            if a in lc: rmap[lc[a]] = target; break
+    return rmap
+
+def _mapped(df: pd.DataFrame, header, amap: dict) -> pd.DataFrame:
+    """Record on df which source headers were mapped (attrs "aliases") and which were dropped ("unmapped")."""
+    df.attrs["aliases"], df.attrs["unmapped"] = amap, [str(c) for c in header if c not in amap]
+    return df
+
+def _finish(df: pd.DataFrame) -> pd.DataFrame:
+    """Fill missing schema columns, clean, back-fill Net and order columns as COLS + extras."""
+    for col in TEXT_COLS:
+        if col not in df.columns: df[col] = ""
+    for col in NUMERIC_COLS:
+        if col not in df.columns: df[col] = 0.0
+    df = clean_df(df)
+    mask = df["Net"] == 0
+    if mask.any():
+        df.loc[mask,"Net"] = (df.loc[mask,"Material"]+df.loc[mask,"Excise"]
+                              -df.loc[mask,"Discount"]+df.loc[mask,"Tax"]
+                              +df.loc[mask,"Freight"]+df.loc[mask,"Others"])
+    extras = [c for c in df.columns if c not in COLS]
+    return df[[c for c in COLS+extras if c in df.columns]]
+
+def _file_size(f) -> int:
+    size = getattr(f, "size", None)
+    if size is None:
+        pos = f.tell(); size = f.seek(0, 2); f.seek(pos)
+    return size
+
+def read_csv_stream(f, mem_budget: int = STREAM_MEM_BUDGET, first_chunk: int = 20_000) -> pd.DataFrame:
+    """Chunked CSV ingest for very large exports.
+    Reads only the columns that map to ALIASES with a typed dtype spec, cleans and back-fills
+    Net per chunk, and sizes later chunks so the retained frame plus one working chunk stays
+    within `mem_budget`. Raises MemoryBudgetError when the cleaned data alone would not fit."""
+    f.seek(0)
+    raw = {str(c).strip(): c for c in pd.read_csv(f, nrows=0).columns}
+    rmap = {raw[src]: tgt for src, tgt in _alias_map(raw).items()}
+    usecols = list(rmap) or None
+    # amounts are read straight to float64; a file with text in those columns is re-read as str
+    # and left to clean_df's coercion, exactly like the whole-file path
+    for num_dtype in ("float64", str):
+        dtype = {raw: (num_dtype if tgt in NUMERIC_COLS else str) for raw, tgt in rmap.items()}
+        f.seek(0)
+        try:
+            return _mapped(_read_chunks(f, usecols, dtype, rmap, mem_budget, first_chunk), raw, _alias_map(raw))
+        except ValueError:
+            if num_dtype is str: raise
+            print("[VendorIQ] Non-numeric amounts in stream — re-reading amount columns as text")
+
+def _read_chunks(f, usecols, dtype, rmap, mem_budget, first_chunk) -> pd.DataFrame:
+    parts, held, rows = [], 0, first_chunk
+    with pd.read_csv(f, usecols=usecols, dtype=dtype, iterator=True) as reader:
+        while True:
+            try:    chunk = reader.get_chunk(rows)
+            except StopIteration: break
+            part = compact_df(_finish(chunk.rename(columns=rmap)))
+            nb = _nbytes(part); held += nb
+            # the final concat briefly holds every part plus the result
+            if 2*held > mem_budget:
+                raise MemoryBudgetError(f"cleaned data passed {held/1e6:,.0f} MB "
+                                        f"(budget {mem_budget/1e6:,.0f} MB) after {sum(map(len,parts))+len(part):,} rows")
+            parts.append(part)
+            # a raw chunk costs ~4× its cleaned size while parsing; keep that to 1/8 of the budget
+            rows = max(first_chunk, int(mem_budget / 32 / max(nb/max(len(part),1), 1)))
+    if not parts: return _finish(pd.DataFrame(columns=list(rmap.values())))
+    return concat_frames(parts)   # union categories, so text columns stay categorical
+
+def _excel_engine(name: str) -> str:
+    """Fastest installed reader: calamine (Rust) if present, else openpyxl / xlrd."""
+    if importlib.util.find_spec("python_calamine"): return "calamine"
+    return "xlrd" if name.lower().endswith(".xls") else "openpyxl"
+
+def excel_sheet_names(f) -> list:
+    f.seek(0)
+    try:
+        if _excel_engine(f.name) == "openpyxl":
+            import openpyxl
+            wb = openpyxl.load_workbook(f, read_only=True)
+            try:     return wb.sheetnames
+            finally: wb.close()
+        return pd.ExcelFile(f, engine=_excel_engine(f.name)).sheet_names
+    finally:
+        f.seek(0)
+
+def _sheet_from_rows(rows) -> pd.DataFrame:
+    """Build a frame from streamed row tuples, keeping only columns that map to ALIASES."""
+    header = next(rows, None)
+    if header is None: return pd.DataFrame()
+    pos  = {str(c).strip(): i for i,c in enumerate(header) if c is not None}
+    keep = [(pos[src], tgt) for src,tgt in _alias_map(pos).items()]
+    if not keep: return pd.DataFrame()
+    width, idx = len(header), [i for i,_ in keep]
+    pick = itemgetter(*idx) if len(idx) > 1 else (lambda r, i=idx[0]: (r[i],))
+    pad  = (None,)*width
+    recs = [pick(r if len(r) >= width else (r+pad)[:width]) for r in rows]
+    df = pd.DataFrame.from_records(recs, columns=[t for _,t in keep]).dropna(how="all")
+    return _mapped(df, pos, _alias_map(pos))
+
+def _sheet_from_pandas(xf: "pd.ExcelFile", sheet) -> pd.DataFrame:
+    head = {str(c).strip(): c for c in xf.parse(sheet, nrows=0).columns}
+    rmap = {head[src]: tgt for src,tgt in _alias_map(head).items()}
+    if not rmap: return pd.DataFrame()
+    df = xf.parse(sheet, usecols=lambda c: c in rmap).rename(columns=rmap)
+    return _mapped(df, head, _alias_map(head))
+
+def read_excel_fast(f, sheets=None) -> pd.DataFrame:
+    """Excel ingest. Streams rows in openpyxl read-only mode (or uses calamine when installed),
+    keeps only the columns that map to ALIASES and stacks the chosen sheets — the first sheet
+    by default — adding a "Sheet" column when more than one is read.
+    Per-sheet timings are left in df.attrs["sheets"]."""
+    engine = _excel_engine(f.name)
+    f.seek(0)
+    if engine == "openpyxl":
+        import openpyxl
+        book = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        names, read = book.sheetnames, lambda s: _sheet_from_rows(book[s].iter_rows(values_only=True))
+    else:
+        book = pd.ExcelFile(f, engine=engine)
+        names, read = book.sheet_names, lambda s: _sheet_from_pandas(book, s)
+    wanted = names[:1] if not sheets else [s for s in names if s in sheets]
+    parts, timings, aliases, unmapped = [], [], {}, {}
+    try:
+        for s in wanted:
+            t0 = time.perf_counter()
+            raw = read(s)
+            aliases.update(raw.attrs.get("aliases", {}))
+            unmapped.update(dict.fromkeys(raw.attrs.get("unmapped", [])))
+            part = _finish(raw)
+            if len(wanted) > 1: part["Sheet"] = s
+            parts.append(part)
+            timings.append(dict(sheet=s, rows=len(part), seconds=round(time.perf_counter()-t0, 3)))
+    finally:
+        book.close()
+    df = pd.concat(parts, ignore_index=True) if parts else _finish(pd.DataFrame())
+    df.attrs["sheets"] = timings
+    return _mapped(df, [*aliases, *unmapped], aliases)
+
+def parse_file(f, stream=None, mem_budget: int = STREAM_MEM_BUDGET, sheets=None) -> pd.DataFrame:
+    """Read a CSV/TXT/Excel file (anything with .name/.read/.seek) into the COLS schema.
+    CSV/TXT larger than STREAM_THRESHOLD_BYTES (or stream=True) go through read_csv_stream();
+    Excel goes through read_excel_fast() for the chosen `sheets` (first sheet by default).
+    The source header → COLS mapping that was applied is left in df.attrs["aliases"], the
+    source columns that matched nothing in df.attrs["unmapped"].
+    Raises MemoryBudgetError when a streamed CSV would not fit `mem_budget`."""
+    name = f.name.lower()
+    is_csv = name.endswith((".csv",".txt"))
+    if stream is None: stream = is_csv and _file_size(f) > STREAM_THRESHOLD_BYTES
+    with span("read " + ("excel" if not is_csv else "csv stream" if stream else "csv")) as s:
+        if   not is_csv: df = read_excel_fast(f, sheets)
+        elif stream:     df = read_csv_stream(f, mem_budget)
+        else:
+            df = pd.read_csv(f)
+            df.columns = [str(c).strip() for c in df.columns]
+            amap, header = _alias_map(df.columns), list(df.columns)
+            df = _mapped(_finish(df.rename(columns=amap)), header, amap)
+        s.note(rows_out=len(df))
+    with span("compact", rows_in=len(df)):
+        return parse_dates(compact_df(df))
+
+def file_digest(f) -> str:
+    """Content hash of an uploaded file; leaves the stream rewound."""
+    h = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    f.seek(0)
+    return h.hexdigest()
+
+def dataset_key(*parts) -> str:
+    """Registry key for a dataset derived from `parts` (content hashes, parent keys, options)."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+# ─── many files and archives at once ─────────────────────────
+INGEST_EXTS = (".csv", ".txt", ".xlsx", ".xls")
+IngestEntry = namedtuple("IngestEntry", "path member name")   # member: inside a .zip ("" otherwise); name: for reports
+INGEST_REPORT_COLS = ["File","Rows","Mapped","Unmapped","Seconds","Error"]
+
+def ingest_entries(path: str, name: str = None) -> list:
+    """The parseable files in `path` (shown as `name`): the file itself, the file inside a .gz,
+    or every CSV/Excel member of a .zip — hidden and __MACOSX entries skipped."""
+    name = name or os.path.basename(path)
+    low = name.lower()
+    if low.endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            return [IngestEntry(path, m.filename, f"{name}/{m.filename}") for m in zf.infolist()
+                    if not m.is_dir() and m.filename.lower().endswith(INGEST_EXTS)
+                    and not any(p.startswith((".", "__MACOSX")) for p in m.filename.split("/"))]
+    if low.endswith(INGEST_EXTS) or low.endswith(tuple(e + ".gz" for e in INGEST_EXTS)):
+        return [IngestEntry(path, "", name)]
+    return []
+
+def _gz_size(path: str) -> int:
+    """Uncompressed size from a gzip trailer (modulo 4 GB) — no decompression."""
+    with open(path, "rb") as fh:
+        fh.seek(-4, 2); return int.from_bytes(fh.read(4), "little")
+
+@contextmanager
+def open_entry(e: IngestEntry):
+    """(binary stream, uncompressed size) of an ingest entry. The stream is named like the file
+    inside; .zip members and .gz files are decompressed as they are read, except Excel, which
+    needs random access and is read into memory (an .xlsx is compressed already)."""
+    with ExitStack() as stack:
+        if e.member:
+            zf = stack.enter_context(zipfile.ZipFile(e.path))
+            size, fh = zf.getinfo(e.member).file_size, stack.enter_context(zf.open(e.member))
+            fh.name = os.path.basename(e.member)
+        elif e.path.lower().endswith(".gz"):
+            size, fh = _gz_size(e.path), stack.enter_context(gzip.open(e.path, "rb"))
+            fh.name = os.path.basename(e.name)[:-3]
+        else:
+            size, fh = os.path.getsize(e.path), stack.enter_context(open(e.path, "rb"))
+        if fh.name != e.path and not fh.name.lower().endswith((".csv",".txt")):
+            data = io.BytesIO(fh.read()); data.name = fh.name; fh = data
+        yield fh, size
+
+def ingest_entry(e: IngestEntry, **opts) -> tuple:
+    """Worker: parse one entry (its header mapped through ALIASES on its own) and tag its rows
+    with a "Source File" column. Returns (frame or None on failure, ingest report row)."""
+    t0 = time.perf_counter()
+    rep = dict(File=e.name, Rows=0, Mapped=0, Unmapped="", Seconds=0.0, Error="")
+    try:
+        with open_entry(e) as (fh, size):
+            df = parse_file(fh, stream=size > STREAM_THRESHOLD_BYTES, **opts)
+        df["Source File"] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [e.name])
+        rep.update(Rows=len(df), Mapped=len(df.attrs.get("aliases", {})), Unmapped=", ".join(df.attrs.get("unmapped", [])))
+    except Exception as ex:
+        print(f"[VendorIQ] Ingest of {e.name} failed: {ex}"); traceback.print_exc()
+        rep["Error"], df = f"{type(ex).__name__}: {ex}", None
+    rep["Seconds"] = round(time.perf_counter()-t0, 3)
+    return df, rep
+
+def ingest_files(paths, names=None, pool=None, workers: int = None, **opts) -> tuple:
+    """Parse many PO files and .zip/.gz archives of them → (one frame, ingest report frame with a
+    row per file, unreadable inputs included, in input order). Each file is parsed by ingest_entry(); with several files and at least
+    INGEST_POOL_MIN_BYTES on disk they run in worker processes — `pool`, or one of `workers`
+    made for the call. Frames are merged in input order by concat_frames() and re-compacted, so
+    text columns stay categorical across files."""
+    names = names or [os.path.basename(p) for p in paths]
+    entries, slots, on_disk = [], [], 0   # slots: per input, its failure row or how many entries it gave
+    for p, n in zip(paths, names):
+        try:
+            found = ingest_entries(p, n); size = os.path.getsize(p)
+        except (OSError, zipfile.BadZipFile) as ex:
+            found, why = [], f"{type(ex).__name__}: {ex}"
+        else:
+            why = "not a CSV/Excel file or a .zip/.gz of them"
+        if not found: slots.append(dict(File=n, Rows=0, Mapped=0, Unmapped="", Seconds=0.0, Error=why))
+        else: on_disk += size; slots.append(len(found))
+        entries += found
+    with span("ingest", files=len(entries)) as s:
+        job = partial(ingest_entry, **opts)
+        parallel = len(entries) > 1 and on_disk >= INGEST_POOL_MIN_BYTES
+        results = None
+        if parallel and (pool is not None or (workers or os.cpu_count() or 1) > 1):
+            try:
+                if pool is not None: results = list(pool.map(job, entries))
+                else:
+                    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(entries))) as own:
+                        results = list(own.map(job, entries))
+            except BrokenProcessPool as ex:
+                print(f"[VendorIQ] Ingest workers failed ({ex}) — parsing in-process")
+        if results is None: results = [job(e) for e in entries]
+        frames = [d for d, _ in results if d is not None]
+        df = compact_df(concat_frames(frames)) if frames else pd.DataFrame()
+        s.note(rows_out=len(df), parallel=parallel)
+    rows = iter(r for _, r in results)
+    report = [r for slot in slots for r in ([slot] if isinstance(slot, dict) else islice(rows, slot))]
+    return df, pd.DataFrame(report, columns=INGEST_REPORT_COLS)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  EXPORTS
+# ═══════════════════════════════════════════════════════════════
+EXPORT_FORMATS = {   # format → (file extension, MIME type)
+    "csv":     ("csv",     "text/csv"),
+    "csv.gz":  ("csv.gz",  "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "xlsx":    ("xlsx",    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+def parquet_available() -> bool:
+    return bool(importlib.util.find_spec("pyarrow") or importlib.util.find_spec("fastparquet"))
+
+def _export_chunks(df: pd.DataFrame, rows=None, size: int = EXPORT_CHUNK_ROWS):
+    """Public columns of df (or of its `rows` positions) in `size`-row slices — at least one,
+    so an empty export still gets its header."""
+    cols = public_cols(df)
+    n = len(df) if rows is None else len(rows)
+    for lo in range(0, max(n, 1), size):
+        yield (df.iloc[lo:lo+size] if rows is None else df.take(rows[lo:lo+size]))[cols]
+
+_XML_ILLEGAL = r"[\x00-\x08\x0b\x0c\x0e-\x1f]"   # control characters XML 1.0 forbids
+
+def _inline_cells(t: pd.Series) -> pd.Series:
+    esc = (t.str.replace("&","&amp;",regex=False).str.replace("<","&lt;",regex=False)
+            .str.replace(">","&gt;",regex=False).str.replace(_XML_ILLEGAL,"",regex=True))
+    return '<c t="inlineStr"><is><t xml:space="preserve">' + esc + '</t></is></c>'
+
+def _xml_cells(s: pd.Series) -> np.ndarray:
+    """One column as SpreadsheetML <c> elements, built with whole-column string ops — numbers as
+    values (floats in the #,##0.00 style), text as inline strings, categoricals escaped once per
+    category, missing as empty cells."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cells = np.append(_inline_cells(pd.Series(s.cat.categories.astype(str))).to_numpy(dtype=object), "<c/>")
+        return cells[s.cat.codes.to_numpy()]
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        style = ' s="1"' if pd.api.types.is_float_dtype(s) else ""
+        cells = (f"<c{style}><v>" + s.astype(str) + "</v></c>").to_numpy(dtype=object)
+        ok = np.isfinite(s.to_numpy(dtype=float))
+        return cells if ok.all() else np.where(ok, cells, "<c/>")
+    return _inline_cells(s.astype(str).where(s.notna(), "")).to_numpy(dtype=object)
+
+def _xml_rows(frame: pd.DataFrame) -> list:
+    """frame's rows as SpreadsheetML <row> strings."""
+    if frame.empty or not len(frame.columns): return []
+    cols = [_xml_cells(s) for _, s in frame.items()]
+    cols[0] = "<row>" + cols[0]; cols[-1] = cols[-1] + "</row>"
+    return list(map("".join, zip(*cols)))
+
+_XLSX_NS    = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+_XLSX_REL   = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_CT    = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+_XML_DECL   = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_XLSX_STYLES = (_XML_DECL + f'<styleSheet {_XLSX_NS}><fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>')
+
+class XlsxStreamWriter:
+    """Minimal streaming .xlsx writer. Each sheet goes straight into its own zip entry as row XML,
+    one sheet open at a time, so memory holds only the rows being written plus the compressed
+    output. Typed cells and one amount number format; no shared strings, widths or formulas."""
+    def __init__(self, fh):
+        self.zf    = zipfile.ZipFile(fh, "w", zipfile.ZIP_DEFLATED, compresslevel=1)
+        self.names = []
+        self._ws   = None
+
+    def add_sheet(self, name: str, columns):
+        self._end_sheet()
+        self.names.append(name[:31])
+        self._ws = self.zf.open(f"xl/worksheets/sheet{len(self.names)}.xml", "w", force_zip64=True)
+        self._ws.write(f"{_XML_DECL}<worksheet {_XLSX_NS}><sheetData>".encode())
+        self.write(_xml_rows(pd.DataFrame([[str(c) for c in columns]], dtype=object)))
+
+    def write(self, xml_rows: list):
+        self._ws.write("".join(xml_rows).encode())
+
+    def _end_sheet(self):
+        if self._ws is None: return
+        self._ws.write(b"</sheetData></worksheet>"); self._ws.close(); self._ws = None
+
+    def close(self):
+        self._end_sheet()
+        n, esc = len(self.names), lambda v: v.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;").replace('"',"&quot;")
+        self.zf.writestr("[Content_Types].xml", _XML_DECL +
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{_XLSX_CT}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{_XLSX_CT}.styles+xml"/>' +
+            "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{_XLSX_CT}.worksheet+xml"/>' for i in range(1, n+1)) +
+            "</Types>")
+        self.zf.writestr("_rels/.rels", _XML_DECL +
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_XLSX_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        self.zf.writestr("xl/workbook.xml", _XML_DECL + f'<workbook {_XLSX_NS} xmlns:r="{_XLSX_REL}"><sheets>' +
+            "".join(f'<sheet name="{esc(nm)}" sheetId="{i}" r:id="rId{i}"/>' for i, nm in enumerate(self.names, 1)) +
+            "</sheets></workbook>")
+        self.zf.writestr("xl/_rels/workbook.xml.rels", _XML_DECL +
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' +
+            "".join(f'<Relationship Id="rId{i}" Type="{_XLSX_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, n+1)) +
+            f'<Relationship Id="rId{n+1}" Type="{_XLSX_REL}/styles" Target="styles.xml"/></Relationships>')
+        self.zf.writestr("xl/styles.xml", _XLSX_STYLES)
+        self.zf.close()
+
+def write_excel_report(df: pd.DataFrame, rows=None, sheets=(), out=None) -> tuple:
+    """Streamed workbook: the records of df (or its `rows` positions) split into "Records",
+    "Records 2", … at Excel's row limit, then one sheet per (name, frame) in `sheets`. Records are
+    rendered XLSX_CHUNK_ROWS at a time, so working memory stays flat however many rows go out.
+    The workbook is written to `out` (a binary file) and (None, stats) returned; without one it
+    is spooled — in memory up to XLSX_SPOOL_MAX_BYTES, on disk past that — and read back once
+    as (bytes, stats). stats has peak_mb (traced, when tracemalloc is on) and the process's rss_mb."""
+    t0, fh = time.perf_counter(), out if out is not None else tempfile.SpooledTemporaryFile(XLSX_SPOOL_MAX_BYTES)
+    try:
+        with traced_peak() as mem:
+            written, n_rec = _write_workbook(fh, df, rows, sheets)
+        secs = time.perf_counter() - t0
+        stats = dict(rows=written, sheets=n_rec + len(sheets), seconds=secs, rows_per_s=written/secs if secs else 0.0,
+                     bytes=fh.tell(), peak_mb=mem["peak_mb"], rss_mb=_peak_rss_mb(),
+                     spilled=out is None and bool(getattr(fh, "_rolled", False)))
+        print(f"[VendorIQ] Excel report: {written:,} records on {n_rec} sheet(s) + {len(sheets)} summary sheet(s), "
+              f"{secs:.1f}s ({stats['rows_per_s']:,.0f} rows/s), {stats['bytes']/1e6:,.1f} MB"
+              + (f", peak {stats['peak_mb']:,.0f} MB traced" if stats["peak_mb"] is not None else "")
+              + (" (spooled to disk)" if stats["spilled"] else ""))
+        if out is not None: return None, stats
+        fh.seek(0)
+        return fh.read(), stats
+    finally:
+        if out is None: fh.close()
+
+def _write_workbook(fh, df: pd.DataFrame, rows, sheets) -> tuple:
+    """write_excel_report()'s sheets into fh → (records written, records sheets)."""
+    xw, cols, per_sheet = XlsxStreamWriter(fh), public_cols(df), EXCEL_MAX_ROWS - 1
+    xw.add_sheet("Records", cols)
+    used, n_rec, written = 0, 1, 0
+    for chunk in _export_chunks(df, rows, XLSX_CHUNK_ROWS):
+        xml = _xml_rows(chunk)
+        while xml:
+            if used == per_sheet:
+                n_rec += 1; used = 0
+                xw.add_sheet(f"Records {n_rec}", cols)
+            part, xml = xml[:per_sheet-used], xml[per_sheet-used:]
+            xw.write(part); used += len(part)
+        written += len(chunk)
+    for name, frame in sheets:
+        xw.add_sheet(name, frame.columns); xw.write(_xml_rows(frame))
+    xw.close()
+    return written, n_rec
+
+def write_export(df: pd.DataFrame, fmt: str, rows=None) -> bytes:
+    """df (or its `rows` positions) as an export file in one of EXPORT_FORMATS. CSV is rendered
+    chunk by chunk straight into the (optionally gzip) output, so only one slice of text is held."""
+    buf = io.BytesIO()
+    if fmt in ("csv", "csv.gz"):
+        raw  = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6, mtime=0) if fmt == "csv.gz" else buf
+        text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        for i, chunk in enumerate(_export_chunks(df, rows)): chunk.to_csv(text, header=i == 0, index=False)
+        text.flush(); text.detach()
+        if raw is not buf: raw.close()
+    elif fmt == "parquet":
+        (df if rows is None else df.take(rows))[public_cols(df)].to_parquet(buf, index=False)
+    elif fmt == "xlsx":
+        return write_excel_report(df, rows)[0]
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return buf.getvalue()
+
+# ═══════════════════════════════════════════════════════════════
+#  DATASET STORE
+# ═══════════════════════════════════════════════════════════════
+def store_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+def store_name(name: str) -> str:
+    """Dataset name usable as a directory name: letters, digits and -_. kept, the rest → _."""
+    s = "".join(ch if ch.isalnum() or ch in "-_ ." else "_" for ch in str(name).strip()).strip(". ")
+    return s[:80] or "dataset"
+
+def _widen(old: str, new) -> str:
+    """Stored dtype name after appending a column of dtype `new` (numeric promotion only)."""
+    try: return str(np.result_type(np.dtype(old), new)) if pd.api.types.is_numeric_dtype(new) else old
+    except TypeError: return old
+
+def _conform(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """df with its text columns recast to the stored text dtypes in `schema` — categorical where
+    the dataset stores categoricals, plain strings where it doesn't — so every part file of a
+    dataset has the same Arrow type per column."""
+    recast = {c: ("category" if t == "category" else t) for c, t in schema.items()
+              if c in df.columns and not pd.api.types.is_numeric_dtype(df[c].dtype) and str(df[c].dtype) != t
+              and (t == "category" or isinstance(df[c].dtype, pd.CategoricalDtype))}
+    return df.astype(recast) if recast else df
+
+def _decode_mixed(tables: list) -> list:
+    """Tables whose columns are dictionary-encoded in some parts and plain in others (stores
+    written before appends were conformed) with those columns decoded, so they concatenate."""
+    import pyarrow as pa
+    kinds = {}
+    for t in tables:
+        for f in t.schema: kinds.setdefault(f.name, set()).add(pa.types.is_dictionary(f.type))
+    mixed = [n for n, k in kinds.items() if len(k) > 1]
+    if not mixed: return tables
+    def decode(t):
+        for n in mixed:
+            i = t.schema.get_field_index(n)
+            if i >= 0 and pa.types.is_dictionary(t.schema.field(i).type):
+                t = t.set_column(i, n, t.column(i).cast(pa.large_string()))
+        return t
+    return [decode(t) for t in tables]
+
+class DatasetStore:
+    """Cleaned datasets on disk: one directory per dataset holding zstd Parquet part files in
+    one directory per PO month (month=YYYY-MM, month=unknown for undated rows) and meta.json
+    with the schema, the ALIASES in effect, each source file's header mapping and the partition
+    list. Appends only add part files for the batch's months; nothing written is rewritten."""
+    def __init__(self, root: str):
+        self.root, self._lock = root, threading.Lock()
+
+    def _dir(self, name: str) -> str:
+        return os.path.join(self.root, store_name(name))
+
+    def meta(self, name: str):
+        try:
+            with open(os.path.join(self._dir(name), "meta.json"), encoding="utf-8") as fh: return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def list(self) -> list:
+        """meta of every saved dataset, most recently updated first."""
+        if not os.path.isdir(self.root): return []
+        metas = [self.meta(n) for n in os.listdir(self.root) if not n.startswith(".")]
+        return sorted((m for m in metas if m), key=lambda m: m["updated"], reverse=True)
+
+    def save(self, name: str, df: pd.DataFrame) -> dict:
+        """Write df as dataset `name`, replacing any saved under that name. The new copy is built
+        beside the old one and swapped in, so a reader never sees a half-written dataset."""
+        name, now = store_name(name), datetime.now().isoformat(timespec="seconds")
+        meta = dict(name=name, created=now, updated=now, rows=0, schema={}, aliases=ALIASES, sources=[], partitions=[])
+        with self._lock:
+            tmp, old, final = os.path.join(self.root, f".new-{name}"), os.path.join(self.root, f".old-{name}"), self._dir(name)
+            for d in (tmp, old): shutil.rmtree(d, ignore_errors=True)
+            self._write(tmp, meta, df)
+            if os.path.exists(final): os.replace(final, old)
+            os.replace(tmp, final)
+            shutil.rmtree(old, ignore_errors=True)
+        return meta
+
+    def append(self, name: str, batch: pd.DataFrame) -> dict:
+        """Add batch to dataset `name` as new part files in its months' partitions."""
+        with self._lock:
+            meta = self.meta(name)
+            if meta is None: raise KeyError(f"no saved dataset {name!r}")
+            self._write(self._dir(name), meta, _conform(batch, meta["schema"]))
+        return meta
+
+    def _write(self, path: str, meta: dict, df: pd.DataFrame):
+        import pyarrow as pa, pyarrow.parquet as pq
+        t0, seq = time.perf_counter(), len(meta["partitions"])
+        codes, months = pd.factorize(month_of(df), sort=True)   # NaT → -1
+        labels = [str(m) for m in months]
+        for code, pos in pd.Series(codes).groupby(codes).indices.items():
+            part = df.take(pos)
+            for c in part.columns:   # each part file's dictionaries hold only the categories it uses
+                if isinstance(part[c].dtype, pd.CategoricalDtype): part[c] = part[c].cat.remove_unused_categories()
+            month = labels[code] if code >= 0 else "unknown"
+            rel = f"month={month}/part-{seq:05d}.parquet"; seq += 1
+            os.makedirs(os.path.join(path, f"month={month}"), exist_ok=True)
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False), os.path.join(path, rel), compression="zstd")
+            meta["partitions"].append(dict(month=month, file=rel, rows=len(part), bytes=os.path.getsize(os.path.join(path, rel))))
+        for c in df.columns:
+            old = meta["schema"].get(c)
+            meta["schema"][c] = str(df[c].dtype) if old is None else _widen(old, df[c].dtype)
+        meta["sources"].append(dict(file=df.attrs.get("file"), source=df.attrs.get("source"), rows=len(df),
+                                    columns=df.attrs.get("aliases", {}), added=datetime.now().isoformat(timespec="seconds")))
+        meta["rows"] += len(df); meta["updated"] = meta["sources"][-1]["added"]
+        with open(os.path.join(path, "meta.json.tmp"), "w", encoding="utf-8") as fh: json.dump(meta, fh, indent=1)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))   # the partition list commits the write
+        print(f"[VendorIQ] Store: {len(df):,} rows → {meta['name']} in {len(set(codes.tolist()))} month partition(s), "
+              f"{time.perf_counter()-t0:.1f}s")
+
+    def load(self, name: str, months=None) -> pd.DataFrame:
+        """Dataset `name` as written — memory-mapped Parquet straight into the stored dtypes, no
+        parsing or cleaning. `months` ("YYYY-MM"/"unknown" labels) reads only those partitions.
+        Rows come back in month order."""
+        import pyarrow as pa, pyarrow.parquet as pq
+        meta, path = self.meta(name), self._dir(name)
+        if meta is None: raise KeyError(f"no saved dataset {name!r}")
+        parts = sorted((p for p in meta["partitions"] if months is None or p["month"] in months), key=itemgetter("month", "file"))
+        if not parts: return pd.DataFrame({c: pd.Series(dtype=t) for c, t in meta["schema"].items()})
+        tables = _decode_mixed([pq.read_table(os.path.join(path, p["file"]), memory_map=True) for p in parts])
+        return _conform(pa.concat_tables(tables, promote_options="permissive").to_pandas(), meta["schema"])
+
+    def delete(self, name: str):
+        with self._lock: shutil.rmtree(self._dir(name), ignore_errors=True)
+
+    def files(self, name: str) -> str:
+        """Glob of dataset `name`'s part files, for engines that scan them directly."""
+        return os.path.join(self._dir(name), "month=*", "*.parquet")
+
+# ═══════════════════════════════════════════════════════════════
+#  QUERY BACKENDS
+# ═══════════════════════════════════════════════════════════════
+# KPIs, the aggregate charts and the vendor summary ask a backend for small aggregated frames
+# shaped like PO rows / cube cells (same column names, plus _lines/_rate_sum/_month), so the
+# chart builders and vendor_summary() read them unchanged. The paged tables and exports still
+# take rows from the in-memory frame through PandasBackend.preds().
+SCATTER_COLS = ["Supplier","Discount","Tax","Net"]
+VS_MEASURES  = ["Net","Material","Tax","Discount","Freight","_lines","_rate_sum"]   # what vendor_summary() reads
+ScatterGrid  = namedtuple("ScatterGrid", "n points x y z")   # density-mode Discount vs Tax: extremes + binned bulk
+
+class QueryFilters(namedtuple("QueryFilters", "dates search suppliers item net", defaults=(None, "", (), "", None))):
+    """The global filters, normalised (search/item stripped and lower-cased, suppliers sorted).
+    Hashable, so it doubles as a cache key."""
+    __slots__ = ()
+
+    @property
+    def cube_ok(self) -> bool:
+        """Every active filter pushes down to the spend cube's dimensions."""
+        return not self.search and self.net is None and (not self.dates or _whole_months(*self.dates))
+
+def density_grid(df: pd.DataFrame) -> ScatterGrid:
+    """The SCATTER_EXTREMES largest and smallest lines per measure (Discount, Tax, Net) as points,
+    the rest binned into a SCATTER_BINS² count grid."""
+    x, y = df["Discount"].to_numpy(dtype=float), df["Tax"].to_numpy(dtype=float)
+    ext = np.unique(np.concatenate([_tail_rows(v, SCATTER_EXTREMES) for v in (x, y, df["Net"].to_numpy(dtype=float))]))
+    bulk = np.ones(len(df), dtype=bool); bulk[ext] = False
+    h, xe, ye = np.histogram2d(x[bulk], y[bulk], bins=SCATTER_BINS)
+    return ScatterGrid(len(df), df[SCATTER_COLS].take(ext), (xe[:-1]+xe[1:])/2, (ye[:-1]+ye[1:])/2, np.where(h > 0, h, np.nan).T)
+
+def _measure(d: pd.DataFrame, m: str):
+    """Measure column m of cube cells or PO rows (where each row is one line at its own Rate)."""
+    if m in d.columns: return d[m]
+    return np.ones(len(d), dtype=np.int64) if m == "_lines" else d["Rate"]
+
+class PandasBackend:
+    """In-memory engine over one dataset version: rows through cached predicate masks (FilterEngine),
+    and the spend cube instead of rows whenever the filters push down to it."""
+    name = "pandas"
+
+    def __init__(self, df: pd.DataFrame, version, date_index=None, search=None, cube=None, masks=None):
+        # search() → SearchIndex and cube() → spend cube are built lazily, on first use
+        self.df, self.version, self.date_index = df, version, date_index
+        self._search, self._cube, self.masks = search or (lambda: SearchIndex(df)), cube or (lambda: build_cube(df)), masks or FilterEngine()
+
+    def preds(self, f: QueryFilters) -> list:
+        """FilterEngine predicates for f: (name, value, mask builder), falsy value = inactive."""
+        if self.df.empty: return []
+        df = self.df
+        return [
+            ("dates",    f.dates,     lambda: self.date_index.mask(*f.dates)),
+            ("search",   f.search,    lambda: self._search().mask(f.search)),
+            ("supplier", f.suppliers, lambda: df["Supplier"].isin(f.suppliers).to_numpy()),
+            ("item",     f.item,      lambda: self._search().mask(f.item, ["Item Description"])),
+            ("net",      f.net,       lambda: df["Net"].between(*f.net).to_numpy()),
+        ]
+
+    def rows(self, f: QueryFilters):
+        """Positions passing f (None = every row)."""
+        return self.masks.rows(self.version, self.preds(f))
+
+    def _source(self, f: QueryFilters) -> pd.DataFrame:
+        if f.cube_ok and not self.df.empty: return cube_view(self._cube(), f.dates, f.suppliers, f.item)
+        rows = self.rows(f)
+        return self.df if rows is None else self.df.take(rows)
+
+    def totals(self, f: QueryFilters) -> dict:
+        d = self._source(f)
+        return dict(Records=int(d["_lines"].sum()) if "_lines" in d.columns else len(d),
+                    **{m: float(d[m].sum()) for m in ("Net","Material","Tax","Discount")},
+                    Suppliers=int(d["Supplier"].nunique()))
+
+    def rollup(self, f: QueryFilters, dims, measures=("Net",), top=None, by=None) -> pd.DataFrame:
+        """Sums of `measures` per `dims` ("_month" = PO month), optionally only the `top` groups
+        by the sum of `by` (default: the measures)."""
+        d = self._source(f)
+        cols = {m: _measure(d, m) for m in measures}
+        keys = [month_of(d).rename("_month") if k == "_month" else d[k] for k in dims]
+        g = pd.DataFrame(cols, index=d.index).groupby(keys, observed=True, sort=False, dropna=False).sum()
+        if top: g = g.loc[g[list(by or measures)].sum(axis=1).nlargest(top).index]
+        return g.reset_index()
+
+    def scatter(self, f: QueryFilters) -> pd.DataFrame:
+        rows, d = self.rows(f), self.df[SCATTER_COLS]
+        return d if rows is None else d.take(rows)
+
+def sql_available() -> bool:
+    return importlib.util.find_spec("duckdb") is not None
+
+def _sql_name(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+class DuckDBBackend:
+    """Embedded SQL engine (duckdb, optional). Scans a saved dataset's Parquet part files on disk —
+    out of core, pruning PO-month partitions by the date filter — or an in-memory frame through
+    Arrow. Filters, grouping and top-N run inside the engine; only the aggregated result is
+    returned. One connection per backend, used under a lock."""
+    name = "duckdb"
+
+    def __init__(self, source):
+        import duckdb
+        self.con, self._lock = duckdb.connect(), threading.Lock()
+        self.partitioned = not isinstance(source, pd.DataFrame)
+        if self.partitioned:
+            path = str(source).replace("'", "''")
+            self.con.execute(f"CREATE VIEW po AS SELECT * FROM read_parquet('{path}', hive_partitioning=true, union_by_name=true)")
+        else:
+            self.con.register("po", source)
+        self.columns = [r[0] for r in self.con.execute("DESCRIBE po").fetchall()]
+
+    def _query(self, sql: str, params=()) -> pd.DataFrame:
+        with self._lock: return self.con.execute(sql, list(params)).df()
+
+    def _where(self, f: QueryFilters):
+        conds, params = [], []
+        if f.dates:
+            start, end = pd.Timestamp(f.dates[0]), pd.Timestamp(f.dates[1]) + pd.Timedelta(days=1)
+            conds.append("_po_dt >= ? AND _po_dt < ?"); params += [start, end]
+            if self.partitioned:   # skips whole month=… directories
+                conds.append("month BETWEEN ? AND ?"); params += [f"{start:%Y-%m}", f"{end - pd.Timedelta(days=1):%Y-%m}"]
+        if f.search:
+            cols = [c for c in SEARCH_COLS if c in self.columns]
+            conds.append("(" + " OR ".join(f"contains(lower(CAST({_sql_name(c)} AS VARCHAR)), ?)" for c in cols) + ")")
+            params += [f.search]*len(cols)
+        if f.suppliers:
+            conds.append(f'CAST("Supplier" AS VARCHAR) IN ({",".join("?"*len(f.suppliers))})'); params += list(f.suppliers)
+        if f.item:
+            conds.append('contains(lower(CAST("Item Description" AS VARCHAR)), ?)'); params.append(f.item)
+        if f.net:
+            conds.append('"Net" BETWEEN ? AND ?'); params += list(f.net)
+        return (" WHERE " + " AND ".join(conds) if conds else ""), params
+
+    def totals(self, f: QueryFilters) -> dict:
+        where, params = self._where(f)
+        r = self._query(f'SELECT COUNT(*) AS Records, SUM("Net") AS Net, SUM("Material") AS Material, SUM("Tax") AS Tax, '
+                        f'SUM("Discount") AS Discount, COUNT(DISTINCT "Supplier") AS Suppliers FROM po{where}', params).iloc[0]
+        return {k: (int(v) if k in ("Records","Suppliers") else float(v)) if pd.notna(v) else 0 for k, v in r.items()}
+
+    def rollup(self, f: QueryFilters, dims, measures=("Net",), top=None, by=None) -> pd.DataFrame:
+        where, params = self._where(f)
+        agg = {"_lines": "COUNT(*)", "_rate_sum": 'SUM("Rate")'}
+        keys = ["date_trunc('month', _po_dt) AS _month" if k == "_month" else _sql_name(k) for k in dims]
+        sums = [f"{agg.get(m, f'SUM({_sql_name(m)})')} AS {_sql_name(m)}" for m in measures]
+        sql = f"SELECT {', '.join(keys + sums)} FROM po{where} GROUP BY ALL"
+        if top: sql += f" ORDER BY {' + '.join(agg.get(m, f'SUM({_sql_name(m)})') for m in (by or measures))} DESC LIMIT {int(top)}"
+        g = self._query(sql, params)
+        if "_month" in g.columns: g["_month"] = g["_month"].dt.to_period("M")
+        return g
+
+    def scatter(self, f: QueryFilters):
+        """PO lines up to SCATTER_DENSITY_ROWS; beyond that a ScatterGrid computed in the engine."""
+        where, params = self._where(f)
+        cols = ", ".join(map(_sql_name, SCATTER_COLS))
+        n = int(self._query(f"SELECT COUNT(*) AS n FROM po{where}", params).iloc[0, 0])
+        if n <= SCATTER_DENSITY_ROWS: return self._query(f"SELECT {cols} FROM po{where}", params)
+        k = SCATTER_EXTREMES
+        tails = [(m, o) for m in ("Discount","Tax","Net") for o in ("ASC", "DESC")]
+        points = self._query(" UNION ".join(f'(SELECT {cols} FROM po{where} ORDER BY "{m}" {o} LIMIT {k})'
+                                            for m, o in tails), params*len(tails))
+        # the bulk is every line between the (k+1)-th smallest and (k+1)-th largest value of each measure
+        cut = [self._query(f'SELECT "{m}" FROM po{where} ORDER BY "{m}" {o} LIMIT 1 OFFSET {k}', params).iloc[0, 0]
+               for m, o in tails]
+        bulk = (where + " AND " if where else " WHERE ") + " AND ".join(f'"{m}" BETWEEN ? AND ?' for m in ("Discount","Tax","Net"))
+        bp = params + [float(c) for c in cut]
+        lo_x, hi_x, lo_y, hi_y = self._query(f'SELECT MIN("Discount"), MAX("Discount"), MIN("Tax"), MAX("Tax") FROM po{bulk}', bp).iloc[0].astype(float)
+        (lo_x, hi_x), (lo_y, hi_y) = [(lo-0.5, hi+0.5) if lo == hi else (lo, hi) for lo, hi in ((lo_x, hi_x), (lo_y, hi_y))]
+        B = SCATTER_BINS
+        cells = self._query(f'SELECT LEAST(CAST(floor(("Discount"-?)/?*{B}) AS INTEGER), {B-1}) AS bx, '
+                            f'LEAST(CAST(floor(("Tax"-?)/?*{B}) AS INTEGER), {B-1}) AS by, COUNT(*) AS c FROM po{bulk} GROUP BY ALL',
+                            [lo_x, hi_x-lo_x, lo_y, hi_y-lo_y] + bp)
+        h = np.full((B, B), np.nan); h[cells["by"].to_numpy(), cells["bx"].to_numpy()] = cells["c"].to_numpy()
+        xe, ye = np.linspace(lo_x, hi_x, B+1), np.linspace(lo_y, hi_y, B+1)
+        return ScatterGrid(n, points, (xe[:-1]+xe[1:])/2, (ye[:-1]+ye[1:])/2, h)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  PRICE ANOMALIES  — robust rate statistics per item × UOM
+# ═══════════════════════════════════════════════════════════════
+_RATE_BITS = 40                        # sort key = group << 40 | rate in paise (rates up to ₹1e10)
+_RATE_MASK = (1 << _RATE_BITS) - 1
+PRICE_STATS = ["Lines","Suppliers","P10","P25","Median","P75","P90","MAD","Best Rate"]
+
+def _labels(s: pd.Series, index: pd.Index) -> tuple:
+    """(codes of s's values in `index`, index grown by the values it did not have yet)."""
+    codes, uniq = pd.factorize(s)
+    uniq = pd.Index(uniq).astype(str)
+    index = index.append(uniq[index.get_indexer(uniq) < 0]) if len(uniq) else index
+    return np.append(index.get_indexer(uniq), -1)[codes], index
+
+def _sorted_quantile(v: np.ndarray, lo: np.ndarray, cnt: np.ndarray, q: float) -> np.ndarray:
+    """q-quantile (linear interpolation) of runs v[lo:lo+cnt] that are each sorted ascending."""
+    f = (cnt - 1) * q
+    i = lo + np.floor(f).astype(np.int64)
+    return v[i] + (f - np.floor(f)) * (v[np.minimum(i+1, lo+cnt-1)] - v[i])
+
+def _paise(v: np.ndarray) -> np.ndarray:
+    return np.rint(np.minimum(v, _RATE_MASK/100) * 100).astype(np.int64)
+
+class PriceIndex:
+    """Rate statistics per purchase group — Item × UOM, or Item Description × UOM for lines without
+    an item code. Priced lines (Rate > 0) are kept sorted by (group, rate) in one int64 key array,
+    so each group is a contiguous sorted run and its median, percentiles and MAD are index
+    arithmetic. An append sorts only the new batch, merges it in, and recomputes the groups it
+    touched. The best rate of a group is the lowest per-supplier median."""
+    def __init__(self, df: pd.DataFrame):
+        self.n, self.version = 0, None
+        self.keys      = pd.MultiIndex.from_arrays([[], [], []], names=["Item","Item Description","UOM"])
+        self.desc      = np.zeros(0, dtype=object)              # gid → description of its first line
+        self.suppliers = pd.Index([], dtype=str)
+        self.gid = np.zeros(0, np.int32); self.sid = np.zeros(0, np.int32)   # per row (-1 = not priced)
+        self.key = np.zeros(0, np.int64); self.pos = np.zeros(0, np.int64)   # sorted (group, rate) → row
+        self.stats = {c: np.zeros(0) for c in PRICE_STATS}
+        self.best_sid = np.zeros(0, np.int32)
+        self.extend(df)
+
+    def _groups(self, batch: pd.DataFrame) -> np.ndarray:
+        """Group id of each batch row, adding groups not seen before."""
+        col = lambda c: batch[c] if c in batch.columns else pd.Series("", index=batch.index)
+        ic, iu = pd.factorize(col("Item")); dc, du = pd.factorize(col("Item Description")); uc, uu = pd.factorize(col("UOM"))
+        iu, du, uu = (pd.Index(u).astype(str).to_numpy(dtype=object) for u in (iu, du, uu))
+        blank = np.append(iu == "", True)[ic]                   # no item code → group by description
+        k1, k2 = np.where(blank, -1, ic), np.where(blank, dc, -1)
+        codes, uniq = pd.factorize(((k1+1) * (len(du)+1) + (k2+1)) * (len(uu)+1) + (uc+1))
+        uniq = np.asarray(uniq)
+        u, rest = uniq % (len(uu)+1) - 1, uniq // (len(uu)+1)
+        d, i = rest % (len(du)+1) - 1, rest // (len(du)+1) - 1
+        pick = lambda lab, k: np.where(k >= 0, np.append(lab, "")[k], "")
+        labels = pd.MultiIndex.from_arrays([pick(iu, i), pick(du, d), pick(uu, u)], names=self.keys.names)
+        at = self.keys.get_indexer(labels)
+        if (fresh := at < 0).any():
+            first = np.empty(len(uniq), np.int64); first[codes[::-1]] = np.arange(len(codes))[::-1]
+            self.keys = self.keys.append(labels[fresh])
+            self.desc = np.concatenate([self.desc, np.append(du, "")[dc[first]][fresh]])
+            for c in PRICE_STATS: self.stats[c] = np.append(self.stats[c], np.full(fresh.sum(), np.nan))
+            self.best_sid = np.append(self.best_sid, np.full(fresh.sum(), -1, np.int32))
+            at = self.keys.get_indexer(labels)
+        return at[codes].astype(np.int32)
+
+    def extend(self, batch: pd.DataFrame):
+        """Add rows appended after the ones already indexed; only the groups they touch are recomputed."""
+        gid = self._groups(batch)
+        rate = batch["Rate"].to_numpy(dtype=float) if "Rate" in batch.columns else np.zeros(len(batch))
+        gid[~(rate > 0)] = -1                                    # unpriced, zero or NaN rates
+        sid, self.suppliers = _labels(batch["Supplier"] if "Supplier" in batch.columns else pd.Series("", index=batch.index), self.suppliers)
+        ok = np.flatnonzero(gid >= 0)
+        key = (gid[ok].astype(np.int64) << _RATE_BITS) | _paise(rate[ok])
+        order = np.argsort(key)
+        at = np.searchsorted(self.key, key[order], "right")
+        self.key = np.insert(self.key, at, key[order])
+        self.pos = np.insert(self.pos, at, ok[order] + self.n)
+        self.gid = np.concatenate([self.gid, gid]); self.sid = np.concatenate([self.sid, sid.astype(np.int32)])
+        self.n += len(batch)
+        self._compute(np.unique(gid[ok]))
+        return self
+
+    def _compute(self, groups: np.ndarray):
+        """Recompute the statistics of `groups` (sorted group ids) from their sorted runs."""
+        if not len(groups): return
+        g64 = groups.astype(np.int64)
+        lo = np.searchsorted(self.key, g64 << _RATE_BITS)
+        cnt = np.searchsorted(self.key, (g64+1) << _RATE_BITS) - lo
+        rows = _ranges(lo, cnt)
+        v = (self.key[rows] & _RATE_MASK) / 100                  # each group's rates, ascending
+        off = np.concatenate(([0], np.cumsum(cnt)[:-1]))
+        st = {"Lines": cnt.astype(float)}
+        for c, q in (("P10",.1), ("P25",.25), ("Median",.5), ("P75",.75), ("P90",.9)): st[c] = _sorted_quantile(v, off, cnt, q)
+        local = np.repeat(np.arange(len(groups), dtype=np.int64), cnt)
+        dev = np.sort((local << _RATE_BITS) | _paise(np.abs(v - st["Median"][local])))
+        st["MAD"] = _sorted_quantile((dev & _RATE_MASK) / 100, off, cnt, .5)
+        # per-supplier medians: a stable sort by (group, supplier) keeps each cell's rates ascending
+        S = len(self.suppliers) + 1                              # sid -1 (no supplier) → 0
+        cell = local * S + self.sid[self.pos[rows]] + 1
+        order = np.argsort(cell, kind="stable")
+        cell, cv = cell[order], v[order]
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        ccnt = np.diff(np.r_[starts, len(cell)])
+        cmed, cg, cs = _sorted_quantile(cv, starts, ccnt, .5), cell[starts] // S, cell[starts] % S - 1
+        first = np.lexsort((cmed, cg)); first = first[np.r_[True, cg[first][1:] != cg[first][:-1]]]
+        st["Suppliers"] = np.bincount(cg, minlength=len(groups)).astype(float)
+        st["Best Rate"] = cmed[first]
+        for c in PRICE_STATS: self.stats[c][groups] = st[c]
+        self.best_sid[groups] = cs[first]
+
+    def groups(self, ids=None) -> pd.DataFrame:
+        """Statistics per group (all groups, or those in `ids`)."""
+        ids = np.arange(len(self.keys)) if ids is None else np.asarray(ids)
+        k = self.keys[ids]
+        return pd.DataFrame({"Item": k.get_level_values(0), "Item Description": self.desc[ids], "UOM": k.get_level_values(2),
+                             **{c: self.stats[c][ids] for c in PRICE_STATS},
+                             "Best Supplier": np.append(self.suppliers.to_numpy(dtype=object), "")[self.best_sid[ids]]})
+
+    def anomalies(self, df: pd.DataFrame, rows=None, z: float = PRICE_Z, min_lines: int = PRICE_MIN_LINES) -> pd.DataFrame:
+        """Lines of df (the indexed frame; only positions `rows` when given) whose rate is more
+        than `z` robust standard deviations above their group's median, ranked by the excess paid
+        over that median. Robust z = 0.6745·(rate − median)/MAD, with MAD floored at
+        PRICE_MAD_FLOOR of the median; groups under `min_lines` priced lines are not scored."""
+        rows = np.arange(self.n) if rows is None else np.asarray(rows, dtype=np.int64)
+        g = self.gid[rows]; rows, g = rows[g >= 0], g[g >= 0]
+        s = self.stats
+        rate, med = df["Rate"].to_numpy(dtype=float)[rows], s["Median"][g]
+        rz = 0.6745 * (rate - med) / np.maximum(s["MAD"][g], med * PRICE_MAD_FLOOR)
+        hit = np.flatnonzero((rz > z) & (s["Lines"][g] >= min_lines))
+        rows, g, rate, med, rz = rows[hit], g[hit], rate[hit], med[hit], rz[hit]
+        qty = df["Quantity"].to_numpy(dtype=float)[rows] if "Quantity" in df.columns else np.ones(len(rows))
+        excess = (rate - med) * qty
+        keep = np.argsort(-excess, kind="stable")
+        rows, g, rate, med, rz, excess = rows[keep], g[keep], rate[keep], med[keep], rz[keep], excess[keep]
+        best = s["Best Rate"][g]
+        out = df.take(rows)[[c for c in ["PO Dt","PO No","Supplier","Item","Item Description","UOM","Quantity","Rate"]
+                             if c in df.columns]].reset_index(drop=True)
+        return out.assign(**{"Typical Rate": med, "P10": s["P10"][g], "P90": s["P90"][g], "vs Typical %": (rate/med - 1) * 100,
+                             "Robust Z": rz, "Best Rate": best,
+                             "Best Supplier": np.append(self.suppliers.to_numpy(dtype=object), "")[self.best_sid[g]],
+                             "vs Best %": (rate/best - 1) * 100, "Excess": excess, "_group": g})
+
+# ═══════════════════════════════════════════════════════════════
+#  CHART BUILDERS
+# ═══════════════════════════════════════════════════════════════
+def chart_supplier_bar(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("Supplier", observed=True)["Net"].sum().reset_index().sort_values("Net",ascending=False).head(8)
+    g["L"] = g["Supplier"].str[:22]
+    fig = go.Figure(go.Bar(
+        x=g["L"], y=g["Net"],
+        marker=dict(color=g["Net"],colorscale=[[0,"#0ea5e9"],[1,"#6366f1"]],line=dict(width=0)),
+        customdata=g["Supplier"],
+        hovertemplate="<b>%{customdata}</b><br>₹%{y:,.0f}<extra></extra>",
+    ))
+    fig.update_traces(marker_cornerradius=5)
+    fig.update_layout(**_LAYOUT, height=240, bargap=0.3,
+                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
+    return fig
+
+def chart_material_bar(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("Item Description", observed=True)["Net"].sum().reset_index().sort_values("Net",ascending=False).head(8)
+    g["L"] = g["Item Description"].str[:24]
+    fig = go.Figure(go.Bar(
+        x=g["L"], y=g["Net"],
+        marker=dict(color=g["Net"],colorscale=[[0,"#10b981"],[1,"#0ea5e9"]],line=dict(width=0)),
+        customdata=g["Item Description"],
+        hovertemplate="<b>%{customdata}</b><br>₹%{y:,.0f}<extra></extra>",
+    ))
+    fig.update_traces(marker_cornerradius=5)
+    fig.update_layout(**_LAYOUT, height=240, bargap=0.3,
+                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
+    return fig
+
+def chart_trend(df: pd.DataFrame):
+    import plotly.graph_objects as go
+    try:
+        month = month_of(df); ok = month.notna()
+        if not ok.any(): return None
+        g = df.loc[ok,"Net"].groupby(month[ok]).sum()
+        g = pd.DataFrame({"Month": g.index.astype(str), "Net": g.to_numpy()})
+        fig = go.Figure(go.Scatter(
+            x=g["Month"], y=g["Net"], mode="lines+markers",
+            line=dict(color="#0ea5e9",width=2.4),
+            marker=dict(size=6,color="#0ea5e9",line=dict(color=_BG,width=2)),
+            fill="tozeroy", fillcolor="rgba(14,165,233,0.08)",
+            hovertemplate="<b>%{x}</b><br>₹%{y:,.0f}<extra></extra>",
+        ))
+        fig.update_layout(**_LAYOUT, height=210, xaxis=_ax(False), yaxis=_ax(tickprefix="₹"))
+        return fig
+    except Exception:
+        print("[VendorIQ] chart_trend error"); traceback.print_exc(); return None
+
+def chart_cost_breakdown(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("Supplier", observed=True)[["Material","Tax","Freight","Others"]].sum().reset_index()
+    g["_total"] = g[["Material","Tax","Freight","Others"]].sum(axis=1)
+    g = g.sort_values("_total",ascending=False).head(8)
+    fig = go.Figure()
+    for col,color,label in [("Material","#0ea5e9","Material"),("Tax","#f59e0b","Tax"),
+                             ("Freight","#10b981","Freight"),("Others","#a78bfa","Others")]:
+        fig.add_trace(go.Bar(name=label, x=g["Supplier"].str[:18], y=g[col], marker_color=color,
+                             hovertemplate=f"<b>%{{x}}</b><br>{label}: ₹%{{y:,.0f}}<extra></extra>"))
+    fig.update_layout(**_LAYOUT, height=300, barmode="stack", bargap=0.24,
+                      xaxis=_ax(False, tickangle=-18), yaxis=_ax(tickprefix="₹"))
+    return fig
+
+def chart_donut(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("Supplier", observed=True)["Net"].sum().reset_index().sort_values("Net",ascending=False).head(10)
+    fig = go.Figure(go.Pie(
+        labels=g["Supplier"], values=g["Net"], hole=0.55,
+        marker=dict(colors=PALETTE, line=dict(color=_BG, width=2)),
+        textposition="inside", textinfo="percent",
+        hovertemplate="<b>%{label}</b><br>₹%{value:,.0f}<br>%{percent}<extra></extra>",
+    ))
+    layout = {**_LAYOUT, "height":300}
+    layout["legend"] = dict(orientation="v", font=dict(size=10), x=1.01, y=0.5)
+    fig.update_layout(**layout)
+    return fig
+
+def chart_hbar(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("Item Description", observed=True)["Net"].sum().reset_index().sort_values("Net",ascending=True).tail(10)
+    g["L"] = g["Item Description"].str[:32]
+    fig = go.Figure(go.Bar(
+        y=g["L"], x=g["Net"], orientation="h",
+        marker=dict(color=g["Net"],colorscale=[[0,"#6366f1"],[1,"#0ea5e9"]],line=dict(width=0)),
+        customdata=g["Item Description"],
+        hovertemplate="<b>%{customdata}</b><br>₹%{x:,.0f}<extra></extra>",
+    ))
+    fig.update_traces(marker_cornerradius=4)
+    # ✅ FIX: tickfont passed INTO _ax() as kwarg — no duplicate key TypeError
+    fig.update_layout(**_LAYOUT, height=320, bargap=0.22,
+                      xaxis=_ax(tickprefix="₹"),
+                      yaxis=_ax(False, tickfont=dict(size=9, color=_TICK)))
+    return fig
+
+def _tail_rows(values: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k smallest and the k largest values (credit notes and big discounts alike)."""
+    if len(values) <= 2*k: return np.arange(len(values))
+    part = np.argpartition(values, (k-1, len(values)-k))
+    return np.concatenate([part[:k], part[-k:]])
+
+def chart_discount_tax(df) -> "go.Figure":
+    """One marker per PO line up to SCATTER_DENSITY_ROWS (WebGL past SCATTER_WEBGL_ROWS). Beyond
+    that the bulk is binned into a density grid and only the SCATTER_EXTREMES largest and smallest
+    lines per measure stay as points, so outliers remain visible while the figure stays small.
+    `df` is PO rows, or a ScatterGrid a query backend has already binned."""
+    import plotly.graph_objects as go
+    if isinstance(df, pd.DataFrame) and len(df) > SCATTER_DENSITY_ROWS: df = density_grid(df)
+    if isinstance(df, ScatterGrid):
+        ext = df.points
+        fig = go.Figure(go.Heatmap(
+            x=df.x, y=df.y, z=df.z,
+            colorscale="Blues", colorbar=dict(title="PO lines",tickfont=dict(size=9,color=_TICK)),
+            hovertemplate="Discount ≈ ₹%{x:,.0f}<br>Tax ≈ ₹%{y:,.0f}<br>%{z:,} PO lines<extra></extra>",
+        ))
+        fig.add_trace(go.Scattergl(
+            x=ext["Discount"], y=ext["Tax"], mode="markers", showlegend=False,
+            marker=dict(color="#f472b6",size=6,opacity=0.85,line=dict(color=_BG,width=0.5)),
+            text=ext["Supplier"],
+            hovertemplate="<b>%{text}</b><br>Discount: ₹%{x:,.0f}<br>Tax: ₹%{y:,.0f}<extra>extreme</extra>",
+        ))
+        note = f"{df.n:,} PO lines · {df.n-len(ext):,} binned · {len(ext):,} extremes as points"
+    else:
+        n = len(df)
+        trace = go.Scattergl if n > SCATTER_WEBGL_ROWS else go.Scatter
+        fig = go.Figure(trace(
+            x=df["Discount"], y=df["Tax"], mode="markers",
+            marker=dict(color=df["Net"],colorscale="Blues",size=7,opacity=0.75,
+                        line=dict(color="#0ea5e9",width=0.5),showscale=True,
+                        colorbar=dict(title="Net ₹",tickprefix="₹",tickfont=dict(size=9,color=_TICK))),
+            text=df["Supplier"],
+            hovertemplate="<b>%{text}</b><br>Discount: ₹%{x:,.0f}<br>Tax: ₹%{y:,.0f}<extra></extra>",
+        ))
+        note = f"{n:,} PO lines" + (" · WebGL" if trace is go.Scattergl else "")
+    fig.update_layout(**{**_LAYOUT, "margin": dict(t=26, b=10, l=10, r=10)}, height=300,
+                      xaxis=_ax(title="Discount (₹)", tickprefix="₹"),
+                      yaxis=_ax(title="Tax (₹)", tickprefix="₹"))
+    fig.add_annotation(text=note, xref="paper", yref="paper", x=0, y=1, xanchor="left", yanchor="bottom",
+                       showarrow=False, font=dict(size=10, color=_TICK))
+    return fig
+
+def chart_uom_bar(df: pd.DataFrame) -> "go.Figure":
+    import plotly.graph_objects as go
+    g = df.groupby("UOM", observed=True)["Net"].sum().reset_index().sort_values("Net",ascending=False)
+    fig = go.Figure(go.Bar(
+        x=g["UOM"], y=g["Net"],
+        marker=dict(color=g["Net"],colorscale=[[0,"#f59e0b"],[1,"#ef4444"]],line=dict(width=0)),
+        hovertemplate="<b>%{x}</b><br>₹%{y:,.0f}<extra></extra>",
+    ))
+    fig.update_traces(marker_cornerradius=5)
+    fig.update_layout(**_LAYOUT, height=300, bargap=0.3,
+                      xaxis=_ax(False), yaxis=_ax(tickprefix="₹"))
+    return fig
+
+def chart_price_anomalies(df: pd.DataFrame) -> "go.Figure":
+    """Flagged lines of the 12 groups with the most excess spend, as multiples of their group's
+    typical (median) rate, over the group's P10–P90 band and best-supplier rate.
+    `df` is PriceIndex.anomalies() output."""
+    import plotly.graph_objects as go
+    top = df.groupby("_group", sort=False)["Excess"].sum().nlargest(12).index[::-1]
+    d = df[df["_group"].isin(top)]
+    g = d.drop_duplicates("_group").set_index("_group").loc[top]
+    label = lambda f: (f["Item"].astype(str).where(f["Item"].astype(str) != "", f["Item Description"].astype(str)).str[:28]
+                       + " · " + f["UOM"].astype(str))
+    gl, med = label(g), g["Typical Rate"]
+    fig = go.Figure(go.Bar(
+        y=gl, x=(g["P90"]-g["P10"])/med, base=g["P10"]/med, orientation="h", name="P10–P90",
+        marker=dict(color="rgba(56,189,248,0.22)",line=dict(width=0)),
+        customdata=np.c_[g["P10"], g["Typical Rate"], g["P90"]],
+        hovertemplate="<b>%{y}</b><br>P10 ₹%{customdata[0]:,.2f} · median ₹%{customdata[1]:,.2f} · P90 ₹%{customdata[2]:,.2f}<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        y=gl, x=g["Best Rate"]/med, mode="markers", name="Best supplier",
+        marker=dict(symbol="diamond",size=9,color="#34d399",line=dict(color=_BG,width=1)),
+        customdata=np.c_[g["Best Supplier"], g["Best Rate"]],
+        hovertemplate="<b>%{customdata[0]}</b><br>best rate ₹%{customdata[1]:,.2f} · ×%{x:.2f}<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        y=label(d), x=d["Rate"]/d["Typical Rate"], mode="markers", name="Flagged line",
+        marker=dict(size=8,color="#f472b6",opacity=0.85,line=dict(color=_BG,width=0.5)),
+        customdata=np.c_[d["Supplier"], d["PO No"] if "PO No" in d.columns else d["Supplier"], d["Rate"], d["Excess"]],
+        hovertemplate="<b>%{customdata[0]}</b> · %{customdata[1]}<br>₹%{customdata[2]:,.2f} · ×%{x:.2f} typical<br>"
+                      "excess ₹%{customdata[3]:,.0f}<extra></extra>",
+    ))
+    fig.add_vline(x=1, line=dict(color="#38bdf8", width=1, dash="dot"))
+    fig.update_traces(selector=dict(type="bar"), marker_cornerradius=3)
+    fig.update_layout(**{**_LAYOUT, "legend": dict(_LAYOUT["legend"], orientation="h", y=1.06, x=0)},
+                      height=max(260, 34*len(g)+90), bargap=0.45,
+                      xaxis=_ax(title="× typical rate", ticksuffix="×"),
+                      yaxis=_ax(False, tickfont=dict(size=9, color=_TICK)))
+    return fig